@@ -26,6 +26,10 @@ import env
 # Data and ML Wrappers
 from dataModels import Data
 from mlModels import OpenAI
+from metricsModels import metrics
+from plotModels import plot_data, plot_digest
+from historyModels import start_refresher
+from poolModels import pools
 
 ML_MODELS = ['OpenAI ChatGPT']
 
@@ -38,25 +42,41 @@ open_ai_model = env.OPENAI_MODEL
 def main():
     '''Main function to run the app - a demo of Galaxy, Gradio, and ChatGPT working together to analyze customer data.'''
     
-    # Load Local Modules
+    # Load Local Modules, Starburst is warmed up in the background while the UI starts
     my_data = Data()
+    my_data.prefetch()
+    start_refresher(pools, env.QUERY_HISTORY_REFRESH_SECONDS)
     
     if env.ENABLE_OPENAI: my_model = OpenAI(my_data)
 
+    def user_state(user):
+        '''Get the Data and OpenAI of a browser session, they are created on first use and again after being evicted for being idle.
+        Plans, cached results and sessions are shared by all users of the same settings.'''
+        if user is None:
+            data = my_data.for_user()
+            user = (data, my_model.for_user(data) if env.ENABLE_OPENAI else None)
+        return user
+
     # Main Tab for the demo
     with gr.Blocks() as demo_tab:
-        def save_seetings_ev(sb_txt_host: str, sb_txt_user: str, open_ai_key: str = None, open_ai_model: str = None,):
+        # Every handler returns the user state again, which keeps it from expiring while the user is active
+        user = gr.State(None, time_to_live=env.USER_IDLE_TIMEOUT)
+
+        def save_seetings_ev(sb_txt_host: str, sb_txt_user: str, open_ai_key: str = None, open_ai_model: str = None, user = None):
             '''UI Event Handler to save settings'''
             sb_host = sb_txt_host
             sb_user = sb_txt_user
+            user = user_state(user)
+            data, model = user
 
             try:
-                my_data.save_settings(sb_host, sb_user)
+                data.save_settings(sb_host, sb_user)
 
-                my_model.save_settings(open_ai_key, open_ai_model)
+                if model is not None: model.save_settings(open_ai_key, open_ai_model)
                 gr.Info('Settings Saved')
             except Exception as e:
                 gr.Error(f'Error saving settings: {e}')  
+            return user
 
         
         gr.Markdown(
@@ -92,14 +112,25 @@ def main():
 
         plt = gr.BarPlot(x='state', y='count', tooltip=['state','count'], 
                          color='risk_appetite', y_title='Num of Customers', x_title='State')
+        # Digest of the data the browser shows, a selection with the same result isn't sent and rendered again
+        plot_seen = gr.State(None)
 
-        def load_dropdown():
+        def load_dropdown(user):
             '''UI Event Handler to load dropdowns for segments.'''
+            user = user_state(user)
+            data = user[0]
+
+            # Pull the data using our wrapper class and Python Starburst, shared with the prefetch and other first requests
+            data.get_unique_segs()
 
-            # Pull the data using our wrapper class and Python Starburst
-            my_data.get_initial_data()
+            return gr.Dropdown(choices=data.segments, value = data.segments, label='Segment', allow_custom_value=True), user
 
-            return gr.Dropdown(choices=my_data.segments, value = my_data.segments, label='Segment', allow_custom_value=True)
+        def load_agg_data(segments, seen, user):
+            '''UI Event Handler to plot the selected segments, only sent when the plotted data changed.'''
+            user = user_state(user)
+            payload = plot_data(user[0].get_agg_data(segments), 'state', 'count', 'risk_appetite')
+            digest = plot_digest(payload)
+            return (gr.update() if digest == seen else payload), digest, user
         
         # Now some Gen AI
         if env.ENABLE_OPENAI:
@@ -112,9 +143,15 @@ def main():
 
             response = gr.TextArea('', label='Response', lines=5, interactive=False)
 
-            btn_ask.click(fn=my_model.predict,
-                    inputs=[question],
-                    outputs=[response], queue=True)
+            def ask(question, user):
+                '''UI Event Handler to answer the question on the user's selection, streamed as it is generated.'''
+                user = user_state(user)
+                for text in user[1].predict(question):
+                    yield text, user
+
+            btn_ask.click(fn=metrics.event('btn_ask.click')(ask),
+                    inputs=[question, user],
+                    outputs=[response, user], queue=True)
 
         if env.ENABLE_WRITE:
             gr.Markdown('## Optional: Write Data')
@@ -125,11 +162,17 @@ def main():
             summary = gr.Dataframe([], type='array', interactive=False, wrap=True,
                                 headers=['State', 'Risk_Appetite', 'Count_of_Customers'], datatype=['str', 'str', 'number'], label='Output Table')
         
-        # Event Handlers
-        if env.ENABLE_WRITE: btn_write.click(my_data.write_agg_data, [], [summary], queue=True)
-        demo_tab.load(load_dropdown, [], [], queue=True)
-        demo_tab.load(my_data.get_agg_data, [seg], [plt], queue=True)
-        seg.change(my_data.get_agg_data, [seg], plt, queue=True)
+        def write_agg_data(user):
+            '''UI Event Handler to write the user's selection.'''
+            user = user_state(user)
+            return user[0].write_agg_data(), user
+
+        # Event Handlers, the user state is created once before the other load handlers run
+        if env.ENABLE_WRITE: btn_write.click(metrics.event('btn_write.click')(write_agg_data), [user], [summary, user], queue=True)
+        load = demo_tab.load(user_state, [user], [user], queue=False)
+        load.then(metrics.event('demo_tab.load')(load_dropdown), [user], [seg, user], queue=True)
+        load.then(metrics.event('demo_tab.load')(load_agg_data), [seg, plot_seen, user], [plt, plot_seen, user], queue=True)
+        seg.change(metrics.event('seg.change')(load_agg_data), [seg, plot_seen, user], [plt, plot_seen, user], queue=True)
 
     # Query History tab showing queries issues to Galaxy
     with gr.Blocks() as query_tab:
@@ -137,8 +180,30 @@ def main():
             queries = gr.Dataframe([], type='array', interactive=False, wrap=True,
                                 headers=['QueryID', 'QueryText'], datatype=['str', 'str'], label='Query History')
 
+            # Version of the history the client shows, polls only send the table again when it changed
+            queries_seen = gr.State(None)
+
+            def refresh_queries(seen, user):
+                '''UI Event Handler to update the query history when there are new queries'''
+                user = user_state(user)
+                token, df = user[0].get_queries_since(seen)
+                return (gr.update() if df is None else df), token, user
+
             btn = gr.Button('Refresh Query History')
-            btn.click(my_data.get_queries, [], queries, queue=True, every=20)
+            btn.click(metrics.event('query_tab.refresh')(refresh_queries), [queries_seen, user], [queries, queries_seen, user], queue=True, every=20)
+
+            # Latency of the Data and OpenAI operations per UI event, the query time is split into the time to the first row and the transfer, the conversion is pandas
+            gr.Markdown('Latency')
+            latency = gr.Dataframe(metrics.summary().round(1), interactive=False, wrap=True, label='Operations (ms)')
+            btn_latency = gr.Button('Refresh Latency')
+            btn_latency.click(lambda: metrics.summary().round(1), [], latency, queue=True, every=20)
+
+            with gr.Row():
+                btn_json = gr.Button('Export JSON')
+                btn_prometheus = gr.Button('Export Prometheus')
+            export = gr.Textbox('', label='Export', lines=10, max_lines=20, interactive=False, show_copy_button=True)
+            btn_json.click(metrics.to_json, [], export, queue=True)
+            btn_prometheus.click(metrics.to_prometheus, [], export, queue=True)
 
     # Settings Tab
     with gr.Blocks() as settings_tab:
@@ -151,20 +216,32 @@ def main():
         if env.ENABLE_OPENAI:
             gr.Markdown('ML Model Settings')
             open_ai_key = gr.Textbox(env.OPENAI_API_KEY, label='API Key', type='password')
-            open_ai_model = gr.Dropdown(my_model.models, label='Model', value=env.OPENAI_MODEL, allow_custom_value=True)
+            open_ai_model = gr.Dropdown([env.OPENAI_MODEL], label='Model', value=env.OPENAI_MODEL, allow_custom_value=True)
 
         save = gr.Button('Save Settings')
         if env.ENABLE_OPENAI:
-            save.click(save_seetings_ev, inputs=[sb_txt_host, sb_txt_user, open_ai_key, open_ai_model], queue=True)
+            save.click(save_seetings_ev, inputs=[sb_txt_host, sb_txt_user, open_ai_key, open_ai_model, user], outputs=[user], queue=True)
         else:
-            save.click(save_seetings_ev, inputs=[sb_txt_host, sb_txt_user], queue=True)
+            save.click(lambda host, username, user: save_seetings_ev(host, username, user=user), inputs=[sb_txt_host, sb_txt_user, user], outputs=[user], queue=True)
+
+    def load_models(user):
+        '''UI Event Handler to list the OpenAI models once the settings are opened'''
+        user = user_state(user)
+        return gr.Dropdown(choices=user[1].get_models()), user
 
     # Main Loaders
-    if env.SHOW_SETTINGS:
-        demo = gr.TabbedInterface([demo_tab, settings_tab, query_tab], ['Demo', 'Settings', 'Query History'], analytics_enabled=True).queue()
-    else:
-        demo = gr.TabbedInterface([demo_tab, query_tab], ['Demo', 'Query History'], analytics_enabled=True).queue()
-    demo.launch(server_name=env.BIND_HOST, server_port=env.PORT, share=env.SHARE, debug=env.DEBUG)
+    with gr.Blocks(analytics_enabled=True) as demo:
+        with gr.Tab('Demo'):
+            demo_tab.render()
+        if env.SHOW_SETTINGS:
+            with gr.Tab('Settings') as settings:
+                settings_tab.render()
+            if env.ENABLE_OPENAI:
+                settings.select(load_models, [user], [open_ai_model, user], queue=True)
+        with gr.Tab('Query History'):
+            query_tab.render()
+    demo.queue()
+    demo.launch(server_name=env.BIND_HOST, server_port=env.PORT, share=env.SHARE, debug=env.DEBUG, state_session_capacity=env.MAX_USERS)
 
 
 if __name__ == '__main__': main()
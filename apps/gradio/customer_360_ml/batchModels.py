@@ -0,0 +1,115 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file holds the rate limiting and retries of batched OpenAI requests. Token buckets keep the requests and tokens per minute below the account limits, requests rejected with 429 or failing with a 5xx error are retried with exponential backoff, honoring Retry-After.
+
+import time
+import random
+import asyncio
+
+
+class TokenBucket():
+    '''Asyncio token bucket, waiters are served in order
+
+    Attributes
+    ----------
+        rate : float
+            Tokens added per second, no limit when None
+        capacity : float
+            Tokens the bucket holds at most, i.e. the largest burst
+
+    Methods
+    -------
+        acquire(amount = 1)
+            Wait until amount tokens are available and take them
+        pause(seconds)
+            Hand out no tokens for the next seconds, e.g. after a 429 with Retry-After
+    '''
+
+    def __init__(self, rate: float = None, capacity: float = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused = 0.0
+        self._lock = None
+
+    async def acquire(self, amount: float = 1):
+        if self.rate is None:
+            return
+        # Created here, the bucket may be built outside of the event loop it is used in
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # A request larger than the bucket waits for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused:
+                    await asyncio.sleep(self._paused - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._paused = max(self._paused, time.monotonic() + seconds)
+
+
+def is_retryable(error: Exception) -> bool:
+    '''Rate limits, server errors, timeouts and dropped connections are retried, invalid requests and authentication errors are not'''
+    import openai
+
+    if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.Timeout,
+                          openai.error.APIConnectionError, openai.error.TryAgain, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return False
+
+def retry_after(error: Exception) -> float | None:
+    '''Seconds to wait requested by the server with Retry-After, None if it didn't ask'''
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after') or headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+def error_message(error: Exception) -> str:
+    '''Type and message of an error, OpenAI errors without the response body and headers'''
+    message = (getattr(error, 'error', None) or {}).get('message') or str(error)
+    return f'{type(error).__name__}: {message}'
+
+async def with_retries(call, retries: int = 5, base_delay: float = 0.5, max_delay: float = 30, on_retry = None):
+    '''Await call() until it succeeds, retrying retryable errors up to retries times with exponential backoff and full jitter
+    Args:  call: Function returning a new awaitable for every attempt
+            on_retry: Called with the error and the delay before every retry
+    Returns: (result, attempts)'''
+    for attempt in range(retries + 1):
+        try:
+            return await call(), attempt + 1
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                e.attempts = attempt + 1
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            delay = max(delay, retry_after(e) or 0)
+            if on_retry is not None:
+                on_retry(e, delay)
+            await asyncio.sleep(delay)
@@ -0,0 +1,32 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Shared by the benchmark scripts. Importing it puts the app directory on the path, so the scripts import the app modules like app.py
+# does, the stand-ins of this directory are found as the directory of the script.
+
+import os
+import sys
+import math
+
+APP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if APP not in sys.path:
+    sys.path.insert(1, APP)
+
+def percentile(values, q: float) -> float:
+    '''Nearest rank percentile, an observed value, e.g. the slowest run of fewer than 20 for q = 0.95'''
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
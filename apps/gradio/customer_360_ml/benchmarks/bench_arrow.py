@@ -0,0 +1,94 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Compares the previous pandas-first result path with the Arrow-native one in dataModels.Data on a generated dataset served by the local stand-in.
+# Every variant runs in a fresh process so the peak RSS of one doesn't hide the other.
+#
+#   python benchmarks/bench_arrow.py --rows 1000000
+
+import os
+import time
+import json
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+import benchCommon
+
+import pyarrow as pa
+
+from localStarburst import LocalSession, load_customer_tables
+
+VARIANTS = {
+    # What Data.to_pyarrow used to do, pa.deserialize_pandas is gone from current pyarrow releases
+    'pandas -> arrow (before)': lambda data, df: pa.Table.from_pandas(df.to_pandas()),
+    'arrow batches (after)': lambda data, df: data.to_pyarrow(df),
+    'pandas (before)': lambda data, df: df.to_pandas(),
+    'arrow -> pandas (after)': lambda data, df: data.to_pandas(df),
+}
+
+def run_variant(database: str, name: str, queue):
+    from dataModels import Data
+
+    data = Data(session_factory=lambda: LocalSession(database))
+    data.get_initial_data(do_agg=False)
+
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    result = VARIANTS[name](data, data.df_joined)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    queue.put({'variant': name, 'rows': len(result), 'seconds': elapsed, 'peak_rss_mb': (peak_rss - base_rss) / 1024})
+
+def main():
+    parser = argparse.ArgumentParser(description='Arrow vs pandas result path benchmark')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Number of generated customers')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per variant, the fastest is reported')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'customers.db')
+        session = LocalSession(database)
+        load_customer_tables(session, args.rows)
+        session.close()
+
+        for name in VARIANTS:
+            runs = []
+            for _ in range(args.repeat):
+                queue = ctx.Queue()
+                proc = ctx.Process(target=run_variant, args=(database, name, queue))
+                proc.start()
+                runs.append(queue.get())
+                proc.join()
+            best = min(runs, key=lambda i: i['seconds'])
+            best['peak_rss_mb'] = max(i['peak_rss_mb'] for i in runs)
+            results.append(best)
+
+    print(f"{'variant':<28}{'rows':>12}{'seconds':>10}{'peak RSS MB':>14}")
+    for i in results:
+        print(f"{i['variant']:<28}{i['rows']:>12}{i['seconds']:>10.3f}{i['peak_rss_mb']:>14.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,103 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Measures the throughput of answering a batch of questions against the local fake OpenAI server with a rate limit and random server
+# errors: one question after the other with OpenAI.complete like the app does, and OpenAI.evaluate with different concurrency caps,
+# with and without its request rate limit. Requests rejected with 429 are wasted, the rate limit should keep them close to zero.
+#
+#   python benchmarks/bench_batch.py --questions 60 --requests-per-second 10 --error-rate 0.02
+
+import time
+import json
+import argparse
+
+import benchCommon
+
+from dataModels import Data
+from mlModels import OpenAI
+from fakeOpenAI import FakeOpenAI
+from localStarburst import LocalSession, load_customer_tables
+
+QUESTIONS = ['Which 5 states have the highest risk appetite? Why?', 'Which state has the most customers with a low risk appetite?',
+             'How many customers are there in Texas?', 'Compare the risk appetite of California and New York.']
+
+def sequential(model: OpenAI, questions: list) -> tuple:
+    answered = 0
+    for question in questions:
+        try:
+            model.complete(question)
+            answered += 1
+        except Exception:
+            pass
+    return answered, 0
+
+def batch(model: OpenAI, questions: list, concurrency: int, requests_per_minute: float) -> tuple:
+    result = model.evaluate(questions, concurrency, requests_per_minute, 0)
+    return int(result['error'].isna().sum()), int(result['attempts'].sum() - len(result))
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch OpenAI evaluation benchmark')
+    parser.add_argument('--questions', type=int, default=60, help='Questions per variant')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 16], help='Concurrency caps of the batch variants')
+    parser.add_argument('--requests-per-second', type=float, default=10, help='Rate limit of the fake server')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='Share of requests failing with 500 or 503')
+    parser.add_argument('--first-token-latency', type=float, default=0.3, help='Seconds before the first token')
+    parser.add_argument('--token-delay', type=float, default=0.005, help='Seconds between tokens')
+    parser.add_argument('--tokens', type=int, default=50, help='Tokens per completion')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    server = FakeOpenAI(0, args.first_token_latency, args.token_delay, args.tokens, args.requests_per_second, args.error_rate).start()
+
+    base = LocalSession()
+    load_customer_tables(base, 10_000)
+    data = Data(session_factory=lambda: base.new_session())
+    data.get_initial_data()
+
+    model = OpenAI(data, api_key='fake')
+    model.api_base = server.api_base
+    model.stream = False
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.questions)]
+
+    # Slightly below the server limit, like configuring the account limit
+    limit = 0.9 * 60 * args.requests_per_second
+    variants = [('sequential (before)', lambda: sequential(model, questions))]
+    for c in args.concurrency:
+        variants.append((f'batch c={c} no limit', lambda c=c: batch(model, questions, c, 0)))
+        variants.append((f'batch c={c} rpm={limit:.0f}', lambda c=c: batch(model, questions, c, limit)))
+
+    results = []
+    for name, run in variants:
+        # Every variant starts in a fresh rate limit window
+        time.sleep(1.5)
+        rejected, failed = server.rejected, server.failed
+        start = time.perf_counter()
+        answered, retries = run()
+        elapsed = time.perf_counter() - start
+        results.append({'variant': name, 'seconds': elapsed, 'questions_per_second': args.questions / elapsed, 'answered': answered,
+                        'retries': retries, 'rejected_429': server.rejected - rejected, 'server_errors': server.failed - failed})
+    server.shutdown()
+
+    print(f"{'variant':<24}{'seconds':>9}{'q/s':>8}{'answered':>10}{'retries':>9}{'429s':>6}{'5xx':>5}")
+    for i in results:
+        print(f"{i['variant']:<24}{i['seconds']:>9.1f}{i['questions_per_second']:>8.1f}{i['answered']:>10}{i['retries']:>9}{i['rejected_429']:>6}{i['server_errors']:>5}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
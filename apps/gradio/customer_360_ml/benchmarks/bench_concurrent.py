@@ -0,0 +1,84 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Compares the time to the first full dashboard, the segment list and the default aggregate of get_initial_data, and the time of a
+# summary write with its queries run one by one (env.QUERY_CONCURRENCY = 1) and concurrently, against the local stand-in with a fixed
+# latency added to every query like the round trip to a cluster. Reports the queries and the wall time next to the latency of one query.
+#
+#   python benchmarks/bench_concurrent.py --latency 0.5 --concurrency 1 4
+
+import time
+import json
+import argparse
+
+import benchCommon
+
+import env
+from dataModels import Data
+from localStarburst import LocalSession, load_customer_tables
+
+MODES = ['replace', 'merge']
+
+def measure(base, name: str, fn) -> dict:
+    queries = base.queries_run
+    start = time.perf_counter()
+    fn()
+    return {'step': name, 'queries': base.queries_run - queries, 'seconds': time.perf_counter() - start}
+
+def run(concurrency: int, args) -> list:
+    env.QUERY_CONCURRENCY = concurrency
+    env.POOL_MAX_SIZE = max(env.POOL_MAX_SIZE, concurrency)
+
+    # New tables for every run, none of them finds the summary table of the one before. The latency only applies to the app
+    base = LocalSession()
+    load_customer_tables(base, args.rows)
+    base.latency = args.latency
+    data = Data(session_factory=lambda: base.new_session())
+    data.pool.warm_up()
+
+    results = [measure(base, 'first dashboard', lambda: data.get_initial_data(do_agg=True))]
+    for mode in args.modes:
+        env.WRITE_MODE = mode
+        data.get_agg_data(args.segments)
+        results.append(measure(base, f'write ({mode})', data.write_agg_data))
+        # The next mode writes again instead of skipping the unchanged summary
+        data.written.clear()
+    data.pool.close()
+    return [{'concurrency': concurrency, **i} for i in results]
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent query execution benchmark')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of generated customers')
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds added to every query')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4], help='Values of env.QUERY_CONCURRENCY')
+    parser.add_argument('--segments', nargs='+', default=['gold', 'silver'], help='Segments of the written summary')
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES, help='Values of env.WRITE_MODE')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    results = [i for concurrency in args.concurrency for i in run(concurrency, args)]
+
+    print(f"latency of one query: {args.latency:.2f}s")
+    print(f"{'concurrency':>11}  {'step':<18}{'queries':>9}{'seconds':>9}")
+    for i in results:
+        print(f"{i['concurrency']:>11}  {i['step']:<18}{i['queries']:>9}{i['seconds']:>9.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
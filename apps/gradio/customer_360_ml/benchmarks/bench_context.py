@@ -0,0 +1,88 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Measures the Starburst queries, build time and prompt tokens of the system message per question, rebuilding it from a fresh query
+# like the app used to do versus the cached context in the different encodings. Tokens are counted with tiktoken when it's installed.
+#
+#   python benchmarks/bench_context.py --questions 20
+
+import time
+import json
+import argparse
+
+import benchCommon
+
+from tabulate import tabulate
+
+from dataModels import Data
+from mlModels import OpenAI, count_tokens
+from localStarburst import LocalSession, load_customer_tables
+
+def rebuild(model: OpenAI):
+    # What set_system_message used to do for every question
+    data = model.data_class
+    message_data = tabulate(data.to_pandas(data.df_summary).rename(columns={'state': 'State', 'risk_appetite': 'Risk_Appetite', 'count': 'Count_of_Customers'}), headers='keys', tablefmt='outline', showindex=False)
+    model.system_message = f'''You are an AI assistant who's purpose is to provide information on structured data. Please be as accurate as possible in any calculations.
+                                The data formated as table is:
+                                {message_data}"'''
+    model.context_tokens = count_tokens(model.system_message, model.model)
+
+VARIANTS = {
+    'table, query per question (before)': (rebuild, {}),
+    'table, cached': (OpenAI.set_system_message, {'context_format': 'table', 'context_max_tokens': None}),
+    'csv, cached': (OpenAI.set_system_message, {'context_format': 'csv', 'context_max_tokens': None}),
+    'csv, top 50': (OpenAI.set_system_message, {'context_format': 'csv', 'context_top_k': 50}),
+    'csv, 500 token budget': (OpenAI.set_system_message, {'context_format': 'csv', 'context_max_tokens': 500}),
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='LLM context benchmark')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of generated customers')
+    parser.add_argument('--questions', type=int, default=20, help='Questions per variant')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every query')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    base = LocalSession(latency=args.latency)
+    load_customer_tables(base, args.rows)
+    data = Data(session_factory=lambda: base.new_session())
+    data.get_initial_data()
+
+    results = []
+    for name, (set_system_message, settings) in VARIANTS.items():
+        model = OpenAI(data, api_key='fake')
+        for key, value in settings.items():
+            setattr(model, key, value)
+
+        queries = base.queries_run
+        start = time.perf_counter()
+        for _ in range(args.questions):
+            set_system_message(model)
+        elapsed = time.perf_counter() - start
+
+        results.append({'variant': name, 'queries_per_question': (base.queries_run - queries) / args.questions,
+                        'ms_per_question': 1000 * elapsed / args.questions, 'prompt_tokens': model.context_tokens})
+
+    print(f"{'variant':<36}{'queries':>9}{'ms':>9}{'tokens':>9}")
+    for i in results:
+        print(f"{i['variant']:<36}{i['queries_per_question']:>9.2f}{i['ms_per_question']:>9.1f}{i['prompt_tokens']:>9}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,136 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Compares exporting the joined customer data like before, one pandas data frame of the whole result written to Parquet, with the
+# chunked streams of Data.iter_batches and Data.export, for results of growing size served by the local stand-in. Reports the time to
+# the first rows, the total time and the peak RSS above the RSS before the export. Every variant runs in a fresh process so the peak RSS of one doesn't hide the other.
+#
+#   python benchmarks/bench_export.py --rows 100000 1000000
+
+import os
+import time
+import json
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+import benchCommon
+
+from localStarburst import LocalSession, load_customer_tables
+
+def read_only(data, df, path: str) -> dict:
+    # What reading the result costs the stand-in itself, SQLite and its Python rows
+    start, first_row, rows = time.perf_counter(), None, 0
+    with data.checkout() as session:
+        for batch in type(df)(session, df._plan).to_arrow_batches():
+            first_row = first_row if first_row is not None else time.perf_counter() - start
+            rows += batch.num_rows
+    return {'rows': rows, 'first_row_seconds': first_row}
+
+def to_pandas(data, df, path: str) -> dict:
+    start = time.perf_counter()
+    result = data.to_pandas(df)
+    # The first row is only available once the whole result is
+    first_row = time.perf_counter() - start
+    result.to_parquet(path)
+    return {'rows': len(result), 'first_row_seconds': first_row}
+
+def iter_pandas(data, df, path: str) -> dict:
+    start, first_row, rows = time.perf_counter(), None, 0
+    for chunk in data.iter_batches(df, as_pandas=True):
+        first_row = first_row if first_row is not None else time.perf_counter() - start
+        rows += len(chunk)
+    return {'rows': rows, 'first_row_seconds': first_row}
+
+def export(data, df, path: str) -> dict:
+    stats = data.export(df, path)
+    return {'rows': stats['rows'], 'first_row_seconds': stats['first_row_seconds']}
+
+def rss_mb() -> float:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+class PeakRSS():
+    # Samples the resident memory in a thread, ru_maxrss is a high-water mark of the whole process including the setup
+    def __enter__(self):
+        self.base = self.peak = rss_mb()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._done.wait(0.005):
+            self.peak = max(self.peak, rss_mb())
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_mb())
+
+VARIANTS = {
+    'read only (stand-in)': read_only,
+    'to_pandas + parquet (before)': to_pandas,
+    'iter_batches pandas chunks': iter_pandas,
+    'export to parquet (after)': export,
+}
+
+def run_variant(database: str, name: str, path: str, queue):
+    from dataModels import Data
+
+    data = Data(session_factory=lambda: LocalSession(database))
+    data.get_initial_data(do_agg=False)
+
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        result = VARIANTS[name](data, data.df_joined, path)
+        elapsed = time.perf_counter() - start
+
+    queue.put({'variant': name, **result, 'seconds': elapsed, 'peak_rss_mb': rss.peak - rss.base})
+
+def main():
+    parser = argparse.ArgumentParser(description='Chunked export benchmark')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000], help='Numbers of generated customers')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            database = os.path.join(tmp, f'customers_{rows}.db')
+            session = LocalSession(database)
+            load_customer_tables(session, rows)
+            session.close()
+
+            for name in VARIANTS:
+                queue = ctx.Queue()
+                proc = ctx.Process(target=run_variant, args=(database, name, os.path.join(tmp, 'export.parquet'), queue))
+                proc.start()
+                results.append({'customers': rows, **queue.get()})
+                proc.join()
+
+    print(f"{'customers':>10}  {'variant':<30}{'rows':>10}{'first row s':>13}{'seconds':>9}{'peak RSS MB':>13}")
+    for i in results:
+        print(f"{i['customers']:>10}  {i['variant']:<30}{i['rows']:>10}{i['first_row_seconds']:>13.3f}{i['seconds']:>9.2f}{i['peak_rss_mb']:>13.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
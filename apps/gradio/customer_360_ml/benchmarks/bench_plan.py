@@ -0,0 +1,76 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Measures the client-side time to get the SQL of the aggregation for a segment selection, building the data frame chain for every
+# selection like before versus binding the segments into the plan template of Data.summary_plan. pystarburst resolves every
+# transformation with a round trip to the cluster, simulated by the plan latency of the local stand-in; 0 measures the Python side only.
+#
+#   python benchmarks/bench_plan.py --plan-latency 0 0.05
+
+import time
+import json
+import random
+import argparse
+import statistics
+
+from benchCommon import percentile
+
+def run(data, base, selections: list, templated: bool) -> dict:
+    build = data.summary_plan if templated else data._build_summary_plan
+    resolved = base.plans_resolved
+    times = []
+    with data.checkout() as session:
+        for segments in selections:
+            start = time.perf_counter()
+            build(segments, session).queries['queries'][-1]
+            times.append(time.perf_counter() - start)
+    return {'variant': 'template (after)' if templated else 'data frame chain (before)', 'plan_latency_ms': 1000 * base.plan_latency,
+            'median_us': 1e6 * statistics.median(times), 'p95_us': 1e6 * percentile(times, 0.95),
+            'plans_per_selection': (base.plans_resolved - resolved) / len(selections)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregation plan building benchmark')
+    parser.add_argument('--selections', type=int, default=200, help='Segment selections per variant')
+    parser.add_argument('--plan-latency', type=float, nargs='+', default=[0.0, 0.05], help='Seconds to resolve a plan on the cluster')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    from dataModels import Data
+    from localStarburst import LocalSession, load_customer_tables, SEGMENTS
+
+    rng = random.Random(0)
+    results = []
+    for latency in args.plan_latency:
+        base = LocalSession(plan_latency=latency)
+        load_customer_tables(base, 1000)
+        data = Data(session_factory=base.new_session)
+        data.get_initial_data()
+        # Fewer selections with a plan latency, the chain takes seconds per selection
+        n = args.selections if not latency else max(10, int(args.selections * 0.001 / latency))
+        selections = [rng.sample(SEGMENTS, rng.randint(1, len(SEGMENTS))) for _ in range(n)]
+        data.summary_plan(SEGMENTS)
+        results += [run(data, base, selections, False), run(data, base, selections, True)]
+
+    print(f"{'variant':<28}{'plan latency ms':>16}{'median us':>12}{'p95 us':>10}{'plans/selection':>17}")
+    for i in results:
+        print(f"{i['variant']:<28}{i['plan_latency_ms']:>16.0f}{i['median_us']:>12.0f}{i['p95_us']:>10.0f}{i['plans_per_selection']:>17.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
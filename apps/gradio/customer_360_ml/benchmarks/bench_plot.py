@@ -0,0 +1,112 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Measures the server time, bytes sent and plot renders of the segment plot for simulated browser sessions against the local stand-in:
+# the data frame postprocessed by gr.BarPlot like before, and the payload built by plotModels.plot_data that isn't sent again when the
+# browser already shows the same data. A session is a page load, where the plot is loaded and then the dropdown change loads it again,
+# followed by segment toggles, some of which don't change the plotted data.
+#
+#   python benchmarks/bench_plot.py --sessions 50 --toggles 10
+
+import time
+import json
+import random
+import argparse
+
+import orjson
+
+import benchCommon
+
+def events(segments: list, sessions: int, toggles: int, seed: int = 0) -> list:
+    '''Segment selections of the plot events, per session'''
+    rng = random.Random(seed)
+    result = []
+    for _ in range(sessions):
+        selection = list(segments)
+        session = [list(selection), list(selection)]
+        for _ in range(toggles):
+            segment = rng.choice(segments + ['unknown'])
+            if segment in selection and len(selection) > 1:
+                selection.remove(segment)
+            elif segment not in selection:
+                selection.append(segment)
+            session.append(list(selection))
+        result.append(session)
+    return result
+
+def run(data, plot, sessions: list, compact: bool) -> dict:
+    import gradio as gr
+    from plotModels import plot_data, plot_digest
+
+    sent, renders, seconds, n = 0, 0, 0.0, 0
+    for session in sessions:
+        seen = None
+        for segments in session:
+            df = data.get_agg_data(segments)
+            start = time.perf_counter()
+            if compact:
+                payload = plot_data(df, 'state', 'count', 'risk_appetite')
+                digest = plot_digest(payload)
+                value, seen = (gr.update() if digest == seen else payload), digest
+            else:
+                value = df
+            # What Gradio sends to the browser for the plot output
+            output = plot.postprocess(value)
+            body = orjson.dumps(output.model_dump() if hasattr(output, 'model_dump') else output)
+            seconds += time.perf_counter() - start
+            n += 1
+            if not (isinstance(output, dict) and output.get('__type__') == 'update'):
+                renders += 1
+                sent += len(body)
+
+    return {'variant': 'plot_data + delta (after)' if compact else 'data frame (before)', 'events': n, 'renders': renders,
+            'kb_sent': sent / 1024, 'bytes_per_event': sent / n, 'server_us_per_event': 1e6 * seconds / n}
+
+def main():
+    parser = argparse.ArgumentParser(description='Plot payload benchmark')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of generated customers')
+    parser.add_argument('--sessions', type=int, default=50, help='Simulated browser sessions')
+    parser.add_argument('--toggles', type=int, default=10, help='Segment toggles per session')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    import gradio as gr
+    from dataModels import Data
+    from localStarburst import LocalSession, load_customer_tables
+
+    base = LocalSession()
+    load_customer_tables(base, args.rows)
+    data = Data(session_factory=base.new_session)
+    plot = gr.BarPlot(x='state', y='count', tooltip=['state', 'count'], color='risk_appetite', y_title='Num of Customers', x_title='State')
+
+    sessions = events(data.get_unique_segs(), args.sessions, args.toggles)
+    # Results are cached after the first run, both variants see the same latency
+    for session in sessions:
+        for segments in session:
+            data.get_agg_data(segments)
+
+    results = [run(data, plot, sessions, False), run(data, plot, sessions, True)]
+
+    print(f"{'variant':<28}{'events':>8}{'renders':>9}{'KB sent':>10}{'B/event':>9}{'server us/event':>17}")
+    for i in results:
+        print(f"{i['variant']:<28}{i['events']:>8}{i['renders']:>9}{i['kb_sent']:>10.0f}{i['bytes_per_event']:>9.0f}{i['server_us_per_event']:>17.0f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,95 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Measures get_agg_data latency and throughput for concurrent users with different session pool sizes. A pool size of 1 behaves like the previous single shared session.
+# The local stand-in adds a fixed latency per query and per new session to simulate the cluster round trip and the TLS/OAuth handshake.
+#
+#   python benchmarks/bench_pool.py --users 8 --pool-sizes 1 2 4 8
+
+import time
+import json
+import random
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from benchCommon import percentile
+
+import env
+from dataModels import Data
+from localStarburst import LocalSession, load_customer_tables, SEGMENTS
+
+def run(base: LocalSession, pool_size: int, users: int, requests: int) -> dict:
+    env.POOL_MIN_SIZE = pool_size
+    env.POOL_MAX_SIZE = pool_size
+    # Every request has to reach the cluster
+    env.AGG_CACHE_TTL = 0
+
+    # A new factory per run, pools are shared per factory
+    data = Data(session_factory=lambda: base.new_session())
+    data.get_initial_data(do_agg=False)
+
+    def user(seed):
+        rng = random.Random(seed)
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            data.get_agg_data(rng.sample(SEGMENTS, rng.randint(1, len(SEGMENTS))))
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(users) as executor:
+        latencies = sorted(i for result in executor.map(user, range(users)) for i in result)
+    elapsed = time.perf_counter() - start
+
+    stats = data.pool.stats()
+    data.pool.close()
+    return {
+        'pool_size': pool_size,
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': 1000 * statistics.median(latencies),
+        'p95_ms': 1000 * percentile(latencies, 0.95),
+        'sessions_created': stats['created'],
+        'checkout_waits': stats['waits'],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Session pool benchmark')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of generated customers')
+    parser.add_argument('--users', type=int, default=8, help='Concurrent simulated users')
+    parser.add_argument('--requests', type=int, default=10, help='Requests per user')
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every query')
+    parser.add_argument('--connect-latency', type=float, default=0.5, help='Seconds added to every new session')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    base = LocalSession(latency=args.latency, connect_latency=args.connect_latency)
+    load_customer_tables(base, args.rows)
+
+    results = [run(base, i, args.users, args.requests) for i in args.pool_sizes]
+
+    print(f"{'pool size':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'sessions':>10}{'waits':>8}")
+    for i in results:
+        print(f"{i['pool_size']:>10}{i['requests_per_second']:>10.1f}{i['p50_ms']:>10.1f}{i['p95_ms']:>10.1f}{i['sessions_created']:>10}{i['checkout_waits']:>8}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
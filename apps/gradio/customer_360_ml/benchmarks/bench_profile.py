@@ -0,0 +1,81 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Compares profiling the TPC-H lineitem table like notebooks/tpch.ipynb, describe() on all columns and again on a few of them, with
+# Data.profile: one aggregate query for all columns, the same on a sample, and a repeated profile answered from the cache. Reports the
+# queries, table scans and wall time. The stand-in reads its tables from memory, --scan-latency adds the time a production-size table
+# takes to scan on the cluster for every table read.
+#
+#   python benchmarks/bench_profile.py --schema tiny --scan-latency 0.5
+
+import time
+import json
+import argparse
+
+import benchCommon
+
+COLUMNS = ['quantity', 'extendedprice', 'discount', 'tax']
+
+def run(base, name: str, fn) -> dict:
+    queries, scanned = base.queries_run, base.tables_scanned
+    start = time.perf_counter()
+    result = fn()
+    return {'variant': name, 'queries': base.queries_run - queries, 'tables_scanned': base.tables_scanned - scanned,
+            'wall_ms': 1000 * (time.perf_counter() - start), 'rows': len(result)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Column profiling benchmark')
+    parser.add_argument('--schema', default='tiny', help='TPC-H schema of the generated tables, tiny, sf1...')
+    parser.add_argument('--scan-latency', type=float, default=0.5, help='Seconds the stand-in adds for every table a query reads')
+    parser.add_argument('--sample', type=float, default=0.1, help='Fraction of the rows of the sampled profile')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    from dataModels import Data
+    from localStarburst import LocalSession, load_tpch_tables
+
+    base = LocalSession(scan_latency=args.scan_latency)
+    load_tpch_tables(base, args.schema)
+    data = Data(session_factory=base.new_session)
+    table = f'tpch.{args.schema}.lineitem'
+
+    def describe():
+        with data.checkout() as session:
+            lineitem = session.table(table)
+            lineitem.describe().to_pandas()
+            return lineitem.describe().select('summary', *COLUMNS).to_pandas()
+
+    def profile(sample = None):
+        result = data.profile(table, sample=sample)
+        return result[result['column'].isin(COLUMNS)]
+
+    results = [
+        run(base, 'describe() twice (before)', describe),
+        run(base, 'profile', profile),
+        run(base, 'profile again (cached)', profile),
+        run(base, f'profile {args.sample:.0%} sample', lambda: profile(args.sample)),
+    ]
+
+    print(f"{'variant':<28}{'queries':>9}{'table scans':>13}{'wall ms':>10}")
+    for i in results:
+        print(f"{i['variant']:<28}{i['queries']:>9}{i['tables_scanned']:>13}{i['wall_ms']:>10.0f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
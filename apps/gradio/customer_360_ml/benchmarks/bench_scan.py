@@ -0,0 +1,93 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Compares the bytes scanned from the query statistics (physicalInputBytes) of the queries the app runs, on the full join of the source
+# tables like it used to do, on the projection-pruned join and on the materialized slim table. Against the local stand-in the scan is
+# estimated per referenced column, --live runs the same queries on the Galaxy cluster configured in env.py and reports its statistics.
+#
+#   python benchmarks/bench_scan.py --rows 1000000
+#   python benchmarks/bench_scan.py --live --slim-table s3lakehouse.pystarburst_360_sum.customer_slim
+
+import json
+import argparse
+
+import benchCommon
+
+import env
+from dataModels import Data
+
+SELECTION = ['gold', 'silver', 'platinum']
+
+def aggregate(df):
+    from pystarburst.functions import col
+    return df.filter(col('customer_segment').in_(SELECTION)).group_by('state', 'risk_appetite').count().sort(col('count').desc())
+
+def plans(data: Data, session, slim_table: str) -> dict:
+    # Query: (before, projection-pruned, slim table)
+    df_slim = data.get_slim_plan(session)
+    df_table = session.table(slim_table) if slim_table else None
+    variant = lambda build, df: build(df) if df is not None else None
+    return {
+        'segments': (data.df_onprem_credit.select('customer_segment').distinct(), session.table(data.source_tables[0]).select('customer_segment').distinct(),
+                     variant(lambda df: df.select('customer_segment').distinct(), df_table)),
+        'aggregate': (aggregate(data.df_joined), aggregate(df_slim), variant(aggregate, df_table)),
+        'full read': (data.df_joined, df_slim, df_table),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Scanned bytes benchmark')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of generated customers')
+    parser.add_argument('--live', action='store_true', help='Query the Galaxy cluster configured in env.py instead of the local stand-in')
+    parser.add_argument('--slim-table', help='Materialize the slim table here, default a local table and skipped with --live')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    if args.live:
+        data = Data()
+    else:
+        from localStarburst import LocalSession, load_customer_tables
+        base = LocalSession()
+        load_customer_tables(base, args.rows)
+        data = Data(session_factory=lambda: base.new_session())
+        args.slim_table = args.slim_table or 'local.pystarburst_360_sum.customer_slim'
+
+    data.get_initial_data(do_agg=False)
+    if args.slim_table:
+        env.SLIM_TABLE = args.slim_table
+        data.refresh_slim(force=True)
+
+    results = []
+    with data.checkout() as session:
+        for query, variants in plans(data, session, args.slim_table).items():
+            for name, df in zip(('before', 'pruned', 'slim table'), variants):
+                if df is None:
+                    continue
+                stats = data.query_stats(df)
+                results.append({'query': query, 'variant': name, 'physical_input_bytes': stats.get('physicalInputBytes'),
+                                'processed_rows': stats.get('processedRows'), 'rows': stats['rows'], 'wall_ms': 1000 * stats['wall_seconds']})
+
+    print(f"{'query':<12}{'variant':<12}{'scanned MB':>12}{'vs before':>11}{'rows':>10}{'ms':>9}")
+    before = {i['query']: i['physical_input_bytes'] for i in results if i['variant'] == 'before'}
+    for i in results:
+        ratio = i['physical_input_bytes'] / before[i['query']] if before.get(i['query']) else None
+        print(f"{i['query']:<12}{i['variant']:<12}{(i['physical_input_bytes'] or 0) / 2**20:>12.2f}{f'{ratio:.0%}' if ratio is not None else '':>11}{i['rows']:>10}{i['wall_ms']:>9.0f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
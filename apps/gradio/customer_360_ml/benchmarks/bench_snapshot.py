@@ -0,0 +1,99 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Measures how long a restarted app takes until it can show the segments and the first chart, in a fresh process against the local
+# stand-in, with and without the on-disk snapshots of the previous run. The previous run is simulated by a process that loads the data
+# once with the snapshots enabled.
+#
+#   python benchmarks/bench_snapshot.py --connect-latency 1.5 --latency 0.5
+
+import os
+import time
+import json
+import argparse
+import tempfile
+import multiprocessing
+
+import benchCommon
+
+def run(database: str, snapshot_dir: str, latency: float, connect_latency: float, queue):
+    '''A fresh app process, returns the time until the segments and the first chart are there.'''
+    import env
+    env.SNAPSHOT_DIR = snapshot_dir
+
+    from dataModels import Data
+    from localStarburst import LocalSession
+
+    start = time.perf_counter()
+    base = None
+    def factory():
+        # Like the real session, connecting is paid on first use
+        nonlocal base
+        base = base.new_session() if base is not None else LocalSession(database, latency=latency, connect_latency=connect_latency)
+        return base
+
+    data = Data(session_factory=factory)
+    data.prefetch()
+    segments = data.get_unique_segs()
+    segments_seconds = time.perf_counter() - start
+    result = data.get_agg_data(segments)
+    chart_seconds = time.perf_counter() - start
+
+    queue.put({'segments_ms': 1000 * segments_seconds, 'first_chart_ms': 1000 * chart_seconds, 'rows': len(result),
+               'snapshots': data.snapshots.stats() if data.snapshots is not None else None})
+
+def spawn(*args) -> dict:
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run, args=args + (queue,))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Restart with on-disk snapshots benchmark')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of generated customers')
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds added to every query')
+    parser.add_argument('--connect-latency', type=float, default=1.5, help='Seconds added to opening a session')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    from localStarburst import LocalSession, load_customer_tables
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database, snapshots = os.path.join(tmp, 'customers.db'), os.path.join(tmp, 'snapshots')
+        session = LocalSession(database)
+        load_customer_tables(session, args.rows)
+        session.close()
+
+        # The previous run, which leaves its snapshots behind
+        spawn(database, snapshots, 0.0, 0.0)
+        results = [
+            {'restart': 'without snapshots', **spawn(database, None, args.latency, args.connect_latency)},
+            {'restart': 'with snapshots', **spawn(database, snapshots, args.latency, args.connect_latency)},
+        ]
+
+    print(f"{'restart':<20}{'segments ms':>13}{'first chart ms':>16}")
+    for i in results:
+        print(f"{i['restart']:<20}{i['segments_ms']:>13.1f}{i['first_chart_ms']:>16.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
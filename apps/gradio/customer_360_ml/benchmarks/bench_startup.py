@@ -0,0 +1,143 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Measures the time to first paint of the Gradio app, from calling app.main() until the page is served, against the local stand-in.
+# The eager variant loads the data and the OpenAI model list before building the UI like the app used to do. The ui only variant loads
+# no data at all, it is the floor set by Gradio building the UI and serving the page. The import time is of the app modules only, the
+# stand-in is imported before, and the heavy modules loaded by the time of the first paint are listed. Every variant runs --repeat times
+# in a new process, the medians are reported.
+#
+#   python benchmarks/bench_startup.py --connect-latency 1.5 --latency 0.5
+
+import os
+import sys
+import time
+import json
+import socket
+import argparse
+import statistics
+import threading
+import subprocess
+import urllib.request
+
+import benchCommon
+
+VARIANTS = ['eager', 'background', 'ui only']
+HEAVY_MODULES = ['pystarburst', 'openai', 'matplotlib', 'tiktoken']
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def child(args):
+    '''Runs the app in this process and prints the timings as JSON once the page is served.'''
+    # pystarburst and what else the stand-in imports don't count for the app
+    before = set(sys.modules)
+    from localStarburst import LocalSession, load_customer_tables
+    stand_in = set(sys.modules) - before
+    start = time.perf_counter()
+    import env
+    import app
+    import mlModels
+    import dataModels
+    imported = time.perf_counter()
+
+    env.PORT = args.port
+    env.BIND_HOST = '127.0.0.1'
+    env.ENABLE_OPENAI = True
+
+    # Latencies only apply to the app, not to generating the data
+    base = LocalSession()
+    load_customer_tables(base, args.rows)
+    base.latency, base.connect_latency = args.latency, args.connect_latency
+
+    def get_models(self):
+        time.sleep(args.openai_latency)
+        return [self.model]
+    mlModels.OpenAI.get_models = get_models
+
+    def create_data():
+        data = dataModels.Data(session_factory=base.new_session)
+        if args.variant == 'eager':
+            data.get_initial_data()
+            time.sleep(args.openai_latency)
+        elif args.variant == 'ui only':
+            data.prefetch = lambda: None
+        return data
+    app.Data = create_data
+
+    def wait_for_page():
+        url = f'http://127.0.0.1:{args.port}/'
+        while True:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as r:
+                    if r.status == 200:
+                        break
+            except OSError:
+                time.sleep(0.01)
+        first_paint = time.perf_counter() - main_start
+        loaded = {i.split('.')[0] for i in set(sys.modules) - stand_in}
+        print(json.dumps({'variant': args.variant, 'import_seconds': imported - start, 'first_paint_seconds': first_paint,
+                          'heavy_modules': [i for i in HEAVY_MODULES if i in loaded]}), flush=True)
+        os._exit(0)
+
+    threading.Thread(target=wait_for_page, daemon=True).start()
+    main_start = time.perf_counter()
+    app.main()
+
+def main():
+    parser = argparse.ArgumentParser(description='Gradio app startup benchmark')
+    parser.add_argument('--rows', type=int, default=10_000, help='Number of generated customers')
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds added to every query')
+    parser.add_argument('--connect-latency', type=float, default=1.5, help='Seconds added to every new session')
+    parser.add_argument('--openai-latency', type=float, default=1.0, help='Seconds added to listing the OpenAI models')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per variant, the medians are reported')
+    parser.add_argument('--variant', choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args)
+
+    results = []
+    for variant in VARIANTS:
+        runs = []
+        for _ in range(args.repeat):
+            cmd = [sys.executable, os.path.abspath(__file__), '--child', '--variant', variant, '--port', str(free_port()), '--rows', str(args.rows),
+                   '--latency', str(args.latency), '--connect-latency', str(args.connect_latency), '--openai-latency', str(args.openai_latency)]
+            proc = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+            lines = [i for i in proc.stdout.splitlines() if i.startswith('{')]
+            if not lines:
+                sys.exit(f'The app failed to start:\n{proc.stderr}')
+            runs.append(json.loads(lines[-1]))
+        results.append({'variant': variant, 'runs': len(runs),
+                        'import_seconds': statistics.median(i['import_seconds'] for i in runs),
+                        'first_paint_seconds': statistics.median(i['first_paint_seconds'] for i in runs),
+                        'heavy_modules': sorted({j for i in runs for j in i['heavy_modules']})})
+
+    print(f"{'startup':<12}{'import s':>10}{'first paint s':>16}  heavy modules at first paint")
+    for i in results:
+        print(f"{i['variant']:<12}{i['import_seconds']:>10.2f}{i['first_paint_seconds']:>16.2f}  {', '.join(i['heavy_modules']) or '-'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,98 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Measures the time until the user sees the first words of an answer and the tokens billed per question for OpenAI.predict,
+# blocking on three completions like the app used to do versus streaming a single one, against the local fake OpenAI server. The last
+# variant asks the same question again and is answered from the answer cache.
+#
+#   python benchmarks/bench_stream.py --first-token-latency 0.5 --token-delay 0.02 --tokens 200
+
+import time
+import json
+import argparse
+import statistics
+
+import benchCommon
+
+from dataModels import Data
+from mlModels import OpenAI
+from cacheModels import ResultCache
+from fakeOpenAI import FakeOpenAI
+from localStarburst import LocalSession, load_customer_tables
+
+VARIANTS = {
+    'n=3 blocking (before)': {'n': 3, 'stream': False},
+    'n=1 blocking': {'n': 1, 'stream': False},
+    'n=1 streaming (after)': {'n': 1, 'stream': True},
+    'repeated (answer cache)': {'n': 1, 'stream': True, 'cached': True},
+}
+
+def run(model: OpenAI, server: FakeOpenAI, name: str, questions: int) -> dict:
+    model.n, model.stream = VARIANTS[name]['n'], VARIANTS[name]['stream']
+    # Every question is sent to the server unless the variant measures the answer cache
+    model.answer_cache = ResultCache() if VARIANTS[name].get('cached') else ResultCache(ttl=0)
+    tokens = server.completion_tokens
+
+    first, total = [], []
+    for _ in range(questions):
+        start = time.perf_counter()
+        seen = None
+        for _ in model.predict('Which 5 states have the highest risk appetite? Why?'):
+            if seen is None:
+                seen = time.perf_counter() - start
+        first.append(seen)
+        total.append(time.perf_counter() - start)
+
+    return {
+        'variant': name,
+        'first_words_ms': 1000 * statistics.median(first),
+        'ttft_ms': 1000 * statistics.median(i['ttft_seconds'] for i in list(model.timings)[-questions:]),
+        'total_ms': 1000 * statistics.median(total),
+        'tokens_per_question': (server.completion_tokens - tokens) / questions,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI streaming benchmark')
+    parser.add_argument('--questions', type=int, default=5, help='Questions per variant')
+    parser.add_argument('--first-token-latency', type=float, default=0.5, help='Seconds before the first token')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='Seconds between tokens')
+    parser.add_argument('--tokens', type=int, default=200, help='Tokens per completion')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    server = FakeOpenAI(0, args.first_token_latency, args.token_delay, args.tokens).start()
+
+    base = LocalSession()
+    load_customer_tables(base, 10_000)
+    data = Data(session_factory=lambda: base.new_session())
+    data.get_initial_data()
+
+    model = OpenAI(data, api_key='fake')
+    model.api_base = server.api_base
+
+    results = [run(model, server, i, args.questions) for i in VARIANTS]
+    server.shutdown()
+
+    print(f"{'variant':<24}{'first words ms':>16}{'ttft ms':>10}{'total ms':>10}{'tokens':>8}")
+    for i in results:
+        print(f"{i['variant']:<24}{i['first_words_ms']:>16.0f}{i['ttft_ms']:>10.0f}{i['total_ms']:>10.0f}{i['tokens_per_question']:>8.0f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
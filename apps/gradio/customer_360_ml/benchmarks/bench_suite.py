@@ -0,0 +1,227 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Benchmark suite for the data paths of the app against the local stand-in, no Galaxy cluster needed. For every operation it reports
+# the first call in a fresh process (cold: no warm sessions or cached results) and the following calls (warm) with
+# latency, throughput and peak RSS, then sweeps get_agg_data over concurrent simulated users with the result cache on and off.
+# Results can be saved as a baseline and later runs compared against it, the script exits with 1 on a regression.
+#
+#   python benchmarks/bench_suite.py --rows 1000000 --save baselines/1m.json
+#   python benchmarks/bench_suite.py --rows 1000000 --compare baselines/1m.json --tolerance 0.25
+#
+# Large scales take a while to generate, --database keeps the generated tables for the next run.
+
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import statistics
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from benchCommon import percentile
+
+from localStarburst import LocalSession, load_customer_tables, SEGMENTS
+
+SELECTION = ['gold', 'silver', 'platinum']
+
+def _init(data, model):
+    data.get_initial_data(do_agg=False)
+
+def _agg(data, model):
+    _init(data, model)
+    data.get_agg_data(SELECTION)
+
+# Operation: (setup, call, env overrides), setup runs before the cold call and isn't measured
+OPERATIONS = {
+    'get_initial_data': (None, lambda data, model: data.get_initial_data(do_agg=False), {}),
+    'get_agg_data': (_init, lambda data, model: data.get_agg_data(SELECTION), {}),
+    'get_agg_data uncached': (_init, lambda data, model: data.get_agg_data(SELECTION), {'AGG_CACHE_TTL': 0}),
+    'get_agg_data cube': (_init, lambda data, model: data.get_agg_data(SELECTION), {'USE_AGG_CUBE': True}),
+    'write_agg_data': (_agg, lambda data, model: data.write_agg_data(), {}),
+    'to_pyarrow joined': (_init, lambda data, model: data.to_pyarrow(data.df_joined), {}),
+    'set_system_message': (_agg, lambda data, model: model.set_system_message(), {}),
+}
+
+def run_operation(database: str, name: str, repeat: int, latency: float, queue):
+    '''Runs in a fresh process, the first call is cold and the others warm.'''
+    import env
+    setup, call, overrides = OPERATIONS[name]
+    for key, value in overrides.items():
+        setattr(env, key, value)
+
+    from dataModels import Data
+    from mlModels import OpenAI
+
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    data = Data(session_factory=lambda: LocalSession(database, latency=latency))
+    model = OpenAI(data, api_key='benchmark')
+    if setup is not None:
+        setup(data, model)
+
+    start = time.perf_counter()
+    call(data, model)
+    cold = time.perf_counter() - start
+
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call(data, model)
+        warm.append(time.perf_counter() - start)
+    warm.sort()
+
+    queue.put({
+        'operation': name,
+        'cold_ms': 1000 * cold,
+        'warm_p50_ms': 1000 * statistics.median(warm),
+        'warm_p95_ms': 1000 * percentile(warm, 0.95),
+        'warm_ops_per_second': len(warm) / sum(warm) if sum(warm) else None,
+        'peak_rss_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) / 1024,
+    })
+
+def run_concurrency(database: str, users: int, requests: int, cached: bool, latency: float, queue):
+    '''Simulated Gradio users changing the segment dropdown, in a fresh process.'''
+    import env
+    env.AGG_CACHE_TTL = env.AGG_CACHE_TTL if cached else 0
+    env.POOL_MAX_SIZE = max(env.POOL_MAX_SIZE, users)
+
+    from dataModels import Data
+
+    data = Data(session_factory=lambda: LocalSession(database, latency=latency))
+    data.get_initial_data(do_agg=False)
+
+    def user(seed):
+        rng = random.Random(seed)
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            data.get_agg_data(rng.sample(SEGMENTS, rng.randint(1, len(SEGMENTS))))
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(users) as executor:
+        latencies = sorted(i for result in executor.map(user, range(users)) for i in result)
+    elapsed = time.perf_counter() - start
+
+    queue.put({
+        'users': users,
+        'cache': cached,
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': 1000 * statistics.median(latencies),
+        'p95_ms': 1000 * percentile(latencies, 0.95),
+    })
+
+def spawn(target, *args) -> dict:
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=args + (queue,))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+# Metric: True when higher is better
+METRICS = {'cold_ms': False, 'warm_p50_ms': False, 'warm_p95_ms': False, 'warm_ops_per_second': True, 'peak_rss_mb': False,
+           'requests_per_second': True, 'p50_ms': False, 'p95_ms': False}
+
+def compare(results: dict, baseline: dict, tolerance: float, min_ms: float, min_mb: float) -> list:
+    '''Get the metrics that are worse than the baseline by more than the tolerance, tiny absolute differences are ignored.'''
+    regressions = []
+    for section, key in (('operations', lambda i: i['operation']), ('concurrency', lambda i: (i['users'], i['cache']))):
+        before = {key(i): i for i in baseline.get(section, [])}
+        for row in results[section]:
+            old = before.get(key(row))
+            if old is None:
+                continue
+            for metric, higher in METRICS.items():
+                new_value, old_value = row.get(metric), old.get(metric)
+                if new_value is None or old_value is None:
+                    continue
+                slack = min_mb if metric.endswith('_mb') else min_ms if metric.endswith('_ms') else 0
+                if higher and new_value < old_value * (1 - tolerance):
+                    regressions.append((key(row), metric, old_value, new_value))
+                elif not higher and new_value > old_value * (1 + tolerance) + slack:
+                    regressions.append((key(row), metric, old_value, new_value))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Data path benchmark suite')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of generated customers, e.g. 10000 up to 100000000')
+    parser.add_argument('--database', help='SQLite file for the generated tables, reused if it exists')
+    parser.add_argument('--repeat', type=int, default=10, help='Warm calls per operation')
+    parser.add_argument('--operations', nargs='+', default=list(OPERATIONS), choices=list(OPERATIONS))
+    parser.add_argument('--users', type=int, nargs='*', default=[1, 2, 4, 8, 16], help='Concurrent users of the sweep, none to skip it')
+    parser.add_argument('--requests', type=int, default=10, help='Requests per user')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every query')
+    parser.add_argument('--save', help='Save the results as a baseline to this file')
+    parser.add_argument('--compare', help='Compare the results to this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Relative slowdown tolerated before a metric counts as a regression')
+    parser.add_argument('--min-ms', type=float, default=5.0, help='Absolute slowdown in ms tolerated on top of the tolerance')
+    parser.add_argument('--min-mb', type=float, default=16.0, help='Absolute memory increase in MB tolerated on top of the tolerance')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = args.database or os.path.join(tmp, 'customers.db')
+        if not os.path.exists(database):
+            start = time.perf_counter()
+            session = LocalSession(database)
+            load_customer_tables(session, args.rows)
+            session.close()
+            print(f'Generated {args.rows} customers in {time.perf_counter() - start:.1f}s')
+
+        operations = [spawn(run_operation, database, i, args.repeat, args.latency) for i in args.operations]
+        concurrency = [spawn(run_concurrency, database, users, args.requests, cached, args.latency) for users in args.users for cached in (False, True)]
+
+    results = {
+        'meta': {'rows': args.rows, 'repeat': args.repeat, 'requests': args.requests, 'latency': args.latency, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count()},
+        'operations': operations,
+        'concurrency': concurrency,
+    }
+
+    print(f"{'operation':<24}{'cold ms':>10}{'warm p50':>10}{'warm p95':>10}{'ops/s':>10}{'peak RSS MB':>13}")
+    for i in operations:
+        print(f"{i['operation']:<24}{i['cold_ms']:>10.1f}{i['warm_p50_ms']:>10.1f}{i['warm_p95_ms']:>10.1f}{i['warm_ops_per_second'] or 0:>10.1f}{i['peak_rss_mb']:>13.1f}")
+    if concurrency:
+        print(f"\n{'users':>6}{'cache':>7}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for i in concurrency:
+            print(f"{i['users']:>6}{'on' if i['cache'] else 'off':>7}{i['requests_per_second']:>10.1f}{i['p50_ms']:>10.1f}{i['p95_ms']:>10.1f}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta']['rows'] != args.rows:
+            print(f"WARNING: The baseline was taken with {baseline['meta']['rows']} customers")
+        regressions = compare(results, baseline, args.tolerance, args.min_ms, args.min_mb)
+        for key, metric, before, after in regressions:
+            print(f'REGRESSION {key} {metric}: {before:.1f} -> {after:.1f}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions against the baseline')
+
+
+if __name__ == '__main__': main()
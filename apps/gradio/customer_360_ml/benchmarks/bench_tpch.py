@@ -0,0 +1,183 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Runs the pairs of DataFrame API pipelines and hand-written SQL of notebooks/tpch.ipynb on a TPC-H schema and compares them: the
+# client-side time and plans resolved to build the data frame, the generated SQL, the wall time of a cold run on a new session and the
+# median of the warm runs, and the rows and Arrow bytes returned. Both results of a pair are checked to be equal with except_ in both
+# directions. A pipeline whose API variant runs slower than its SQL by more than the tolerance and --min-ms is flagged and the script exits with 1.
+# Against the local stand-in the tables are generated with the row counts of the schema, --live runs on the cluster configured in env.py.
+#
+#   python benchmarks/bench_tpch.py --schema tiny sf1 --repeat 5
+#   python benchmarks/bench_tpch.py --live --schema sf1 sf10
+
+import sys
+import time
+import json
+import argparse
+import statistics
+
+import benchCommon
+
+def pipelines(catalog: str, schema: str) -> dict:
+    '''DataFrame API and SQL builders of every pipeline of the notebook, functions of a session returning a data frame'''
+    from pystarburst.functions import col, lit, round
+
+    s = f'{catalog}.{schema}'
+
+    def lineitem_api(session):
+        return session.table(f'{s}.lineitem') \
+            .select('orderkey', 'linenumber', 'quantity', 'extendedprice', 'linestatus') \
+            .filter('orderkey <= 5').sort('orderkey', 'linenumber')
+
+    def shipmode_agg_api(session):
+        return session.table(f'{s}.lineitem').group_by('shipmode').agg(
+            (col('shipmode'), 'count'), (col('quantity'), 'sum'), (col('extendedprice'), 'avg'), (col('discount'), 'max')
+        ).sort('count(shipmode)', ascending=False)
+
+    def nation_avg_price_api(session):
+        orders = session.table(f'{s}.orders')
+        lineitem = session.table(f'{s}.lineitem').rename('orderkey', 'li_ok')
+        joined = lineitem.join(orders, orders.orderkey == lineitem.li_ok) \
+            .select('orderkey', 'linenumber', 'extendedprice', 'linestatus', 'custkey')
+        smaller = joined.drop('linenumber', 'linestatus').rename('custkey', 'sol_ck').filter('orderkey BETWEEN 100 AND 199')
+        customer = session.sql(f'SELECT custkey, nationkey AS c_nk FROM {s}.customer')
+        o_li_c = smaller.join(customer, smaller.sol_ck == customer.custkey)
+        nation = session.table(f'{s}.nation').drop('regionkey').drop('comment')
+        return o_li_c.join(nation, o_li_c.c_nk == nation.nationkey) \
+            .rename('name', 'nation_name') \
+            .select('nation_name', 'extendedprice') \
+            .group_by('nation_name').avg('extendedprice') \
+            .with_column('avg_price', round('avg(extendedprice)', lit(2))) \
+            .select('nation_name', 'avg_price') \
+            .sort('avg_price', ascending=False)
+
+    return {
+        'lineitem_pfs': (lineitem_api, lambda session: session.sql(f'''
+            SELECT orderkey, linenumber, quantity, extendedprice, linestatus
+              FROM {s}.lineitem
+             WHERE orderkey <= 5
+             ORDER BY orderkey, linenumber''')),
+        'distinct_shipmode': (lambda session: session.table(f'{s}.lineitem').select('shipmode').distinct(),
+                              lambda session: session.sql(f'SELECT DISTINCT(shipmode) FROM {s}.lineitem')),
+        'shipmode_count': (lambda session: session.table(f'{s}.lineitem').group_by('shipmode').count().sort('shipmode'),
+                           lambda session: session.sql(f'''
+            SELECT shipmode, count()
+              FROM {s}.lineitem
+             GROUP BY shipmode
+             ORDER BY shipmode''')),
+        'shipmode_agg': (shipmode_agg_api, lambda session: session.sql(f'''
+            SELECT shipmode, count(shipmode), sum(quantity), avg(extendedprice), max(discount)
+              FROM {s}.lineitem
+             GROUP BY shipmode
+             ORDER BY 2 DESC''')),
+        'nation_avg_price': (nation_avg_price_api, lambda session: session.sql(f'''
+            SELECT n.name AS nation_name,
+                   ROUND(AVG(li.extendedprice), 2) AS avg_price
+              FROM {s}.lineitem li
+              JOIN {s}.orders o   ON (li.orderkey = o.orderkey)
+              JOIN {s}.customer c ON (o.custkey = c.custkey)
+              JOIN {s}.nation n   ON (c.nationkey = n.nationkey)
+             WHERE o.orderkey BETWEEN 100 and 199
+             GROUP BY n.name
+             ORDER BY avg_price DESC''')),
+    }
+
+def plans_resolved(session) -> int | None:
+    # Only the stand-in counts the round trips to the analyzer
+    return getattr(session, 'plans_resolved', None)
+
+def execute(df) -> tuple:
+    start = time.perf_counter()
+    table = df.to_arrow_table()
+    return time.perf_counter() - start, table.num_rows, table.nbytes
+
+def run(session_factory, build, repeat: int) -> dict:
+    # Cold: a new session builds and runs the plan for the first time
+    session = session_factory()
+    try:
+        resolved = plans_resolved(session)
+        start = time.perf_counter()
+        df = build(session)
+        sql = df.queries['queries'][-1]
+        build_seconds = time.perf_counter() - start
+        resolved = plans_resolved(session) - resolved if resolved is not None else None
+
+        cold, rows, nbytes = execute(df)
+        warm = [execute(df)[0] for _ in range(repeat)]
+    finally:
+        session.close()
+
+    return {'build_ms': 1000 * build_seconds, 'plans_resolved': resolved, 'sql': str(sql), 'cold_ms': 1000 * cold,
+            'warm_ms': 1000 * statistics.median(warm) if warm else None, 'rows': rows, 'bytes': nbytes}
+
+def differences(session_factory, build_api, build_sql) -> int:
+    '''Rows of either variant missing from the other, like the except_ checks of the notebook'''
+    session = session_factory()
+    try:
+        api, sql = build_api(session), build_sql(session)
+        # Few rows, none when both are equal
+        return len(api.except_(sql).collect()) + len(sql.except_(api).collect())
+    finally:
+        session.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='TPC-H DataFrame API versus SQL benchmark')
+    parser.add_argument('--schema', nargs='+', default=['tiny'], help='TPC-H schemas, tiny, sf1, sf10...')
+    parser.add_argument('--catalog', default='tpch', help='Catalog of the TPC-H schemas')
+    parser.add_argument('--repeat', type=int, default=5, help='Warm runs per variant')
+    parser.add_argument('--plan-latency', type=float, default=0.0, help='Seconds the stand-in takes to resolve a plan on the cluster')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Flag the API when its warm time exceeds the SQL by more than this fraction')
+    parser.add_argument('--min-ms', type=float, default=5.0, help='and by more than these milliseconds, shorter differences are timing noise')
+    parser.add_argument('--live', action='store_true', help='Query the Galaxy cluster configured in env.py instead of the local stand-in')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for schema in args.schema:
+        if args.live:
+            from dataModels import Data
+            session_factory = Data().create_session
+        else:
+            from localStarburst import LocalSession, load_tpch_tables
+            base = LocalSession(plan_latency=args.plan_latency)
+            load_tpch_tables(base, schema, args.catalog)
+            session_factory = base.new_session
+
+        for name, (build_api, build_sql) in pipelines(args.catalog, schema).items():
+            api, sql = run(session_factory, build_api, args.repeat), run(session_factory, build_sql, args.repeat)
+            diff = differences(session_factory, build_api, build_sql)
+            slower = api['warm_ms'] is not None and api['warm_ms'] > max(sql['warm_ms'] * (1 + args.tolerance), sql['warm_ms'] + args.min_ms)
+            results.append({'schema': schema, 'pipeline': name, 'api': api, 'sql': sql, 'differences': diff, 'slower': slower})
+
+    print(f"{'schema':<8}{'pipeline':<20}{'variant':<8}{'build ms':>10}{'plans':>7}{'cold ms':>10}{'warm ms':>10}{'rows':>9}{'KB':>9}  check")
+    for i in results:
+        for variant in ('api', 'sql'):
+            r = i[variant]
+            check = ('SLOWER ' if i['slower'] else '') + ('ok' if not i['differences'] else f"{i['differences']} rows differ") if variant == 'api' else ''
+            print(f"{i['schema']:<8}{i['pipeline']:<20}{variant:<8}{r['build_ms']:>10.1f}{r['plans_resolved'] if r['plans_resolved'] is not None else '':>7}"
+                  f"{r['cold_ms']:>10.1f}{r['warm_ms'] or 0:>10.1f}{r['rows']:>9}{r['bytes'] / 1024:>9.1f}  {check}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    flagged = [f"{i['schema']}.{i['pipeline']}" for i in results if i['slower'] or i['differences']]
+    if flagged:
+        print(f"WARNING: The DataFrame API is slower than SQL or returns other rows for {', '.join(flagged)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__': main()
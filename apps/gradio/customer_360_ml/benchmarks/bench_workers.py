@@ -0,0 +1,168 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Load test of serve.py: simulated browsers change the segment dropdown through the load balancer as fast as they can, with 1, 2, 4, ...
+# workers against the local stand-in. Every browser is a Gradio client with its own session, it gets the worker cookie from the balancer
+# like a browser would. Throughput should grow close to linearly with the workers up to the number of cores.
+#
+#   python benchmarks/bench_workers.py --workers 1 2 4 --users 16 --seconds 20
+
+import os
+import sys
+import time
+import json
+import random
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchCommon import APP, percentile
+
+def free_port(n: int) -> int:
+    # A port followed by n free ones for the workers
+    while True:
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        if port + n < 65536 and all(_free(port + 1 + i) for i in range(n)):
+            return port
+
+def _free(port: int) -> bool:
+    with socket.socket() as s:
+        try:
+            s.bind(('127.0.0.1', port))
+            return True
+        except OSError:
+            return False
+
+def worker(args):
+    '''Runs the app on the stand-in database, started by serve.py.'''
+    import env
+    import app
+    import dataModels
+    from localStarburst import LocalSession
+
+    env.ENABLE_OPENAI = False
+    base = LocalSession(args.database, latency=args.latency)
+    app.Data = lambda: dataModels.Data(session_factory=base.new_session)
+    app.main()
+
+def wait_for(url: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                if r.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f'{url} did not start')
+
+def browser(url: str):
+    # Gets the worker cookie from the balancer and keeps sending it, like a browser
+    from gradio_client import Client
+
+    with urllib.request.urlopen(url) as r:
+        cookie = r.headers.get('Set-Cookie', '').split(';')[0]
+    return Client(url, headers={'Cookie': cookie}, verbose=False), cookie
+
+def run(args, workers: int) -> dict:
+    from localStarburst import SEGMENTS
+
+    port = free_port(workers)
+    url = f'http://127.0.0.1:{port}/'
+    command = [sys.executable, os.path.join(APP, 'serve.py'), '--workers', str(workers), '--app', os.path.abspath(__file__), '--',
+               '--worker', '--database', args.database, '--latency', str(args.latency)]
+    # All simulated browsers connect from 127.0.0.1, each gets the least busy worker instead of the one of the address
+    server = subprocess.Popen(command, env=dict(os.environ, PORT=str(port), BIND_HOST='127.0.0.1', BALANCER_CLIENT_TTL='0'),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(url)
+        for i in range(workers):
+            wait_for(f'http://127.0.0.1:{port + 1 + i}/')
+
+        with ThreadPoolExecutor(args.users) as executor:
+            browsers = list(executor.map(lambda _: browser(url), range(args.users)))
+
+            def user(seed):
+                client = browsers[seed][0]
+                rng = random.Random(seed)
+                latencies = []
+                deadline = time.monotonic() + args.seconds
+                while time.monotonic() < deadline:
+                    start = time.perf_counter()
+                    client.predict(rng.sample(SEGMENTS, rng.randint(1, len(SEGMENTS))), api_name='/load_agg_data')
+                    latencies.append(time.perf_counter() - start)
+                return latencies
+
+            start = time.perf_counter()
+            latencies = sorted(i for result in executor.map(user, range(args.users)) for i in result)
+            elapsed = time.perf_counter() - start
+
+        return {
+            'workers': workers,
+            'users': args.users,
+            'browsers_per_worker': sorted(sum(1 for _, c in browsers if c.endswith(f'={i}')) for i in range(workers)),
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': 1000 * statistics.median(latencies),
+            'p95_ms': 1000 * percentile(latencies, 0.95),
+        }
+    finally:
+        server.terminate()
+        server.wait(30)
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-worker load test')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Worker counts to compare')
+    parser.add_argument('--users', type=int, default=16, help='Simulated browsers')
+    parser.add_argument('--seconds', type=float, default=20, help='Duration of every run')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of generated customers')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every query')
+    parser.add_argument('--database', help='SQLite file for the generated tables, reused if it exists')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    from localStarburst import LocalSession, load_customer_tables
+
+    with tempfile.TemporaryDirectory() as tmp:
+        args.database = args.database or os.path.join(tmp, 'customers.db')
+        if not os.path.exists(args.database):
+            session = LocalSession(args.database)
+            load_customer_tables(session, args.rows)
+            session.close()
+
+        results = [run(args, i) for i in args.workers]
+
+    print(f"{'workers':>8}{'users':>7}{'req/s':>10}{'speedup':>9}{'p50 ms':>10}{'p95 ms':>10}  browsers per worker")
+    for i in results:
+        print(f"{i['workers']:>8}{i['users']:>7}{i['requests_per_second']:>10.1f}{i['requests_per_second'] / results[0]['requests_per_second']:>9.2f}"
+              f"{i['p50_ms']:>10.1f}{i['p95_ms']:>10.1f}  {i['browsers_per_worker']}")
+    print(f'{os.cpu_count()} cores')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,114 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Runs the same sequence of summary writes with every env.WRITE_MODE against the local stand-in: a first write, an unchanged write,
+# a write after some customers moved state and a write of another selection. A reader polls the target during the writes and measures
+# how long it wasn't there.
+#
+#   python benchmarks/bench_write.py --rows 100000 --moved 50
+
+import time
+import json
+import sqlite3
+import argparse
+import threading
+
+import benchCommon
+
+import env
+from dataModels import Data
+from localStarburst import LocalSession, load_customer_tables, quote
+
+MODES = ['replace', 'swap', 'merge']
+
+def run(mode: str, args) -> list:
+    env.WRITE_MODE = mode
+
+    base = LocalSession(latency=args.latency)
+    load_customer_tables(base, args.rows)
+    data = Data(session_factory=lambda: base.new_session())
+    data.get_initial_data(do_agg=False)
+
+    stop = threading.Event()
+    reads = {'ok': 0, 'missing_seconds': 0.0}
+    def reader():
+        # Reads on the connection directly so they don't add latency or count as queries of the app
+        conn = base.new_session().connection
+        last = time.perf_counter()
+        while not stop.is_set():
+            try:
+                conn.execute(f'SELECT COUNT(*) FROM {quote(data.target_table)}').fetchone()
+                reads['ok'] += 1
+            except sqlite3.OperationalError as e:
+                # Shared cache table locks are a SQLite artefact, only a missing table counts
+                if 'no such table' in str(e) and reads['ok']:
+                    reads['missing_seconds'] += time.perf_counter() - last
+            last = time.perf_counter()
+            time.sleep(0.001)
+
+    def move_customers():
+        # Changes the counts of a few states for every selection
+        base.execute(f"UPDATE {quote('sample.burstbank.customer')} SET state = 'CA' WHERE custkey % {max(args.rows // args.moved, 1)} = 0")
+
+    steps = [
+        ('first write', lambda: None, ['gold', 'silver']),
+        ('unchanged', lambda: None, ['gold', 'silver']),
+        ('customers moved', move_customers, ['gold', 'silver']),
+        ('other selection', lambda: None, ['platinum']),
+    ]
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    results = []
+    for name, prepare, segments in steps:
+        prepare()
+        data.get_agg_data(segments)
+        queries = base.queries_run
+        missing = reads['missing_seconds']
+
+        start = time.perf_counter()
+        table = data.write_agg_data()
+        elapsed = time.perf_counter() - start
+
+        results.append({'mode': mode, 'step': name, 'seconds': elapsed, 'queries': base.queries_run - queries, 'rows': len(table),
+                        'rows_written': data.last_write['rows_written'], 'rows_deleted': data.last_write['rows_deleted'],
+                        'skipped': data.last_write['skipped'], 'missing_ms': 1000 * (reads['missing_seconds'] - missing)})
+    stop.set()
+    thread.join()
+    data.pool.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Summary write modes benchmark')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of generated customers')
+    parser.add_argument('--moved', type=int, default=50, help='Customers moved to another state between writes')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every query')
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    results = [i for mode in args.modes for i in run(mode, args)]
+
+    print(f"{'mode':<9}{'step':<17}{'seconds':>9}{'queries':>9}{'written':>9}{'deleted':>9}{'skipped':>9}{'missing ms':>12}")
+    for i in results:
+        print(f"{i['mode']:<9}{i['step']:<17}{i['seconds']:>9.3f}{i['queries']:>9}{i['rows_written']:>9}{str(i['rows_deleted'] if i['rows_deleted'] is not None else '-'):>9}{str(i['skipped']):>9}{i['missing_ms']:>12.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__': main()
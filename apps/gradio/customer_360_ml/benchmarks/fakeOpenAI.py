@@ -0,0 +1,201 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# A local fake of the OpenAI models and chat completions endpoints used by the benchmarks. Completions are canned text generated
+# with a fixed delay before the first token and between tokens, streamed as server-sent events when requested. Point the app at it
+# with OPENAI_API_BASE=http://127.0.0.1:<port>/v1. Like the real API it can reject requests above a rate limit with 429 and
+# Retry-After, and fail a share of the requests with 500 or 503.
+#
+#   python benchmarks/fakeOpenAI.py --port 8000
+
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = ('California and Texas have the most customers with a high risk appetite, followed by New York, Florida and Illinois. '
+         'These states also have the largest customer base overall, so the share of high risk customers is worth comparing as well. ').split(' ')
+
+
+class FakeOpenAI(ThreadingHTTPServer):
+    '''Fake OpenAI API server
+
+    Attributes
+    ----------
+        first_token_latency : float
+            Seconds before the first token of a completion
+        token_delay : float
+            Seconds between two tokens
+        tokens : int
+            Tokens per completion, capped by max_tokens of the request
+        requests : int
+            Number of chat completion requests served
+        completion_tokens : int
+            Number of tokens generated over all completions, i.e. what would be billed
+        requests_per_second : float
+            Chat completion requests accepted per second, the others get 429, no limit when None
+        error_rate : float
+            Share of the accepted requests failing with 500 or 503
+        rejected : int
+            Number of requests rejected with 429
+        failed : int
+            Number of requests failed with a server error
+
+    Methods
+    -------
+        start() -> FakeOpenAI
+            Serve on a background thread
+        api_base -> str
+            URL to use as OPENAI_API_BASE
+    '''
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, first_token_latency: float = 0.5, token_delay: float = 0.02, tokens: int = 200,
+                 requests_per_second: float = None, error_rate: float = 0.0) -> None:
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.first_token_latency = first_token_latency
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.requests_per_second = requests_per_second
+        self.error_rate = error_rate
+
+        self.requests = 0
+        self.completion_tokens = 0
+        self.rejected = 0
+        self.failed = 0
+        self._window = (0, 0)
+        self._lock = threading.Lock()
+
+    @property
+    def api_base(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/v1'
+
+    def start(self) -> 'FakeOpenAI':
+        threading.Thread(target=self.serve_forever, name='fake-openai', daemon=True).start()
+        return self
+
+    def count(self, tokens: int):
+        with self._lock:
+            self.requests += 1
+            self.completion_tokens += tokens
+
+    def admit(self) -> int:
+        # Status of a new request: 429 above the rate limit of the current one second window, sometimes a server error, else 200
+        with self._lock:
+            if self.requests_per_second is not None:
+                second, n = self._window
+                now = int(time.monotonic())
+                n = n + 1 if now == second else 1
+                self._window = (now, n)
+                if n > self.requests_per_second:
+                    self.rejected += 1
+                    return 429
+            if random.random() < self.error_rate:
+                self.failed += 1
+                return random.choice((500, 503))
+            return 200
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/v1/models':
+            return self._json(404, {'error': {'message': f'Unknown path {self.path}'}})
+        self._json(200, {'object': 'list', 'data': [{'id': 'gpt-3.5-turbo-16k', 'object': 'model'}, {'id': 'gpt-4', 'object': 'model'}]})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            return self._json(404, {'error': {'message': f'Unknown path {self.path}'}})
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+        server = self.server
+        status = server.admit()
+        if status == 429:
+            return self._json(429, {'error': {'message': 'Rate limit reached for requests', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                              {'Retry-After': '1'})
+        if status != 200:
+            return self._json(status, {'error': {'message': 'The server had an error while processing your request', 'type': 'server_error'}})
+        n = request.get('n', 1)
+        tokens = min(server.tokens, request.get('max_tokens') or server.tokens)
+        words = [WORDS[i % len(WORDS)] + ' ' for i in range(tokens)]
+        server.count(n * tokens)
+
+        base = {'id': f'chatcmpl-{uuid.uuid4().hex[:24]}', 'created': int(time.time()), 'model': request.get('model')}
+        # The n completions are generated side by side, the response takes as long as one of them
+        time.sleep(server.first_token_latency)
+
+        if not request.get('stream'):
+            time.sleep(server.token_delay * (tokens - 1))
+            choices = [{'index': i, 'message': {'role': 'assistant', 'content': ''.join(words).strip()}, 'finish_reason': 'stop'} for i in range(n)]
+            return self._json(200, {**base, 'object': 'chat.completion', 'choices': choices,
+                                    'usage': {'prompt_tokens': 0, 'completion_tokens': n * tokens, 'total_tokens': n * tokens}})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for t, word in enumerate(words):
+            if t:
+                time.sleep(server.token_delay)
+            for i in range(n):
+                delta = {'role': 'assistant', 'content': word} if t == 0 else {'content': word}
+                self._event({**base, 'object': 'chat.completion.chunk', 'choices': [{'index': i, 'delta': delta, 'finish_reason': None}]})
+        for i in range(n):
+            self._event({**base, 'object': 'chat.completion.chunk', 'choices': [{'index': i, 'delta': {}, 'finish_reason': 'stop'}]})
+        self._chunk(b'data: [DONE]\n\n')
+        self._chunk(b'')
+
+    def _event(self, body: dict):
+        self._chunk(f'data: {json.dumps(body)}\n\n'.encode())
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def _json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake OpenAI chat completions server')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--first-token-latency', type=float, default=0.5, help='Seconds before the first token')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='Seconds between tokens')
+    parser.add_argument('--tokens', type=int, default=200, help='Tokens per completion')
+    parser.add_argument('--requests-per-second', type=float, help='Rate limit, requests above it get 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests failing with 500 or 503')
+    args = parser.parse_args()
+
+    server = FakeOpenAI(args.port, args.first_token_latency, args.token_delay, args.tokens, args.requests_per_second, args.error_rate)
+    print(f'Serving on {server.api_base}')
+    server.serve_forever()
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,703 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# A local stand-in for a Starburst cluster used by the benchmarks. It implements the part of the pystarburst Session and DataFrame API used by the app on top of an embedded SQLite database, with an optional fixed latency per query to simulate the round trip to the cluster.
+
+import re
+import time
+import uuid
+import sqlite3
+import threading
+import statistics
+import itertools
+
+import pyarrow as pa
+import pandas as pd
+
+from pystarburst.column import Column
+from pystarburst.row import Row
+from pystarburst.types import StructType, StructField, LongType, DoubleType, StringType
+from pystarburst.query_history import QueryRecord
+from pystarburst._internal.analyzer.expression import binary, unary, general, sort
+
+_BINARY_OPS = {
+    binary.EqualTo: '=', binary.NotEqualTo: '<>', binary.GreaterThan: '>', binary.LessThan: '<',
+    binary.GreaterThanOrEqual: '>=', binary.LessThanOrEqual: '<=', binary.And: 'AND', binary.Or: 'OR',
+    binary.Add: '+', binary.Subtract: '-', binary.Multiply: '*', binary.Divide: '/', binary.Remainder: '%',
+}
+
+_TABLE_NAME = re.compile(r'(?<![\w."])([A-Za-z_]\w*\.[A-Za-z_]\w*\.[A-Za-z_]\w*)(?![\w"])')
+
+_TABLE_PLAN = re.compile(r'SELECT \* FROM ("(?:[^"]|"")+")')
+
+_SCANNED_TABLE = re.compile(r'"[^".]+\.[^".]+\.[^".]+"')
+_CREATE_OR_REPLACE = re.compile(r'(?is)^CREATE\s+OR\s+REPLACE\s+TABLE\s+("(?:[^"]|"")+")\s+AS\s+(.*)$')
+_TABLESAMPLE = re.compile(r'(?i)("(?:[^"]|"")+")\s+TABLESAMPLE\s+BERNOULLI\s*\(\s*([\d.]+)\s*\)')
+
+_aliases = itertools.count()
+
+
+def quote(name: str) -> str:
+    '''Quote an identifier, fully qualified Trino names are kept as a single SQLite table name.'''
+    return '"' + name.strip('"').replace('"', '""') + '"'
+
+def literal(value) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def to_sql(expr) -> str:
+    '''Render a pystarburst column, expression or column name as SQLite SQL.'''
+    if isinstance(expr, str):
+        return quote(expr)
+    if isinstance(expr, Column):
+        expr = expr._expression
+
+    if isinstance(expr, general.UnresolvedAttribute):
+        # Either a quoted column name or raw SQL from functions.sql_expr
+        return expr.name
+    if isinstance(expr, general.Literal):
+        return literal(expr.value)
+    if isinstance(expr, general.InExpression):
+        return f"{to_sql(expr.column)} IN ({', '.join(to_sql(i) for i in expr.values)})"
+    if isinstance(expr, general.FunctionExpression):
+        distinct = 'DISTINCT ' if expr.is_distinct else ''
+        return f"{expr.name}({distinct}{', '.join(to_sql(i) for i in expr.arguments)})"
+    if isinstance(expr, general.Like):
+        return f'{to_sql(expr.expr)} LIKE {to_sql(expr.pattern)}'
+    if isinstance(expr, general.Star):
+        return '*'
+    if type(expr) in _BINARY_OPS:
+        return f'({to_sql(expr.left)} {_BINARY_OPS[type(expr)]} {to_sql(expr.right)})'
+    if isinstance(expr, unary.Alias):
+        return f'{to_sql(expr.child)} AS {quote(expr.name)}'
+    if isinstance(expr, unary.Not):
+        return f'NOT ({to_sql(expr.child)})'
+    if isinstance(expr, unary.IsNull):
+        return f'{to_sql(expr.child)} IS NULL'
+    if isinstance(expr, unary.IsNotNull):
+        return f'{to_sql(expr.child)} IS NOT NULL'
+    if isinstance(expr, sort.SortOrder):
+        return f"{to_sql(expr.child)} {'DESC' if expr.direction == 'DESCENDING' else 'ASC'}"
+
+    raise NotImplementedError(f'Expression not supported by the local stand-in: {type(expr).__name__}')
+
+def translate(query: str) -> str:
+    '''Translate the Trino statements used by the app into SQLite.'''
+    query = query.strip().rstrip(';')
+    if re.match(r'(?i)^create\s+schema', query):
+        return 'SELECT 1'
+    # Trino's count() is count(*)
+    query = re.sub(r'(?i)\bcount\(\s*\)', 'count(*)', query)
+    query = _TABLE_NAME.sub(lambda m: quote(m.group(1)), query)
+    # Bernoulli samples keep every row with the given percentage
+    return _TABLESAMPLE.sub(lambda m: f'(SELECT * FROM {m.group(1)} WHERE abs(random()) % 1000000 < {float(m.group(2)) * 10000:g})', query)
+
+
+class _StdDev():
+    # Sample standard deviation like Trino's stddev()
+    def __init__(self) -> None:
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        return statistics.stdev(self.values) if len(self.values) > 1 else None
+
+
+class _ApproxDistinct():
+    # Exact here, Trino estimates it with a HyperLogLog sketch
+    def __init__(self) -> None:
+        self.values = set()
+
+    def step(self, value):
+        if value is not None:
+            self.values.add(value)
+
+    def finalize(self):
+        return len(self.values)
+
+
+class _ApproxPercentile():
+    # Nearest rank, Trino estimates it with a t-digest
+    def __init__(self) -> None:
+        self.values, self.percentile = [], None
+
+    def step(self, value, percentile):
+        self.percentile = percentile
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        if not self.values:
+            return None
+        self.values.sort()
+        return self.values[min(len(self.values) - 1, int(self.percentile * len(self.values)))]
+
+
+class LocalSession():
+    '''Stand-in for pystarburst.Session backed by SQLite
+
+    Attributes
+    ----------
+        database : str
+            SQLite database file, an in-memory database shared by all threads when None
+        latency : float
+            Seconds added to every query to simulate the round trip to the cluster
+        batch_size : int
+            Rows per Arrow record batch
+        connect_latency : float
+            Seconds added to opening a session to simulate the TLS and authentication handshake
+        plan_latency : float
+            Seconds added to every table(), sql() and transformation to simulate pystarburst resolving the plan on the cluster
+        scan_latency : float
+            Seconds added for every table a query reads to simulate scanning a production-size table
+        queries_run : int
+            Number of queries executed by this session and the ones opened from it
+        plans_resolved : int
+            Number of plans resolved by this session and the ones opened from it
+        tables_scanned : int
+            Number of table reads of the queries executed by this session and the ones opened from it
+        _conn : LocalServerConnection
+            Same path to a DB-API connection as pystarburst, its cursors report Trino-like query statistics
+
+    Methods
+    -------
+        new_session() -> LocalSession
+            Open another session on the same database
+        resolve(query) -> LocalDataFrame
+            Get a data frame for a new plan, like the round trip of pystarburst to its analyzer
+        table(name) -> LocalDataFrame
+            Get a data frame for a table
+        sql(query) -> LocalDataFrame
+            Get a data frame for a SQL query
+        query_history() -> LocalQueryHistory
+            Record the queries run by this session
+        load_table(name, df, append = False)
+            Create a table from a pandas.DataFrame or append to it
+        close()
+            Close the session
+    '''
+
+    def __init__(self, database: str = None, latency: float = 0.0, batch_size: int = 64 * 1024, connect_latency: float = 0.0, plan_latency: float = 0.0,
+                 scan_latency: float = 0.0, parent: 'LocalSession' = None) -> None:
+        self.database = database
+        self.latency = latency
+        self.batch_size = batch_size
+        self.connect_latency = connect_latency
+        self.plan_latency = plan_latency
+        self.scan_latency = scan_latency
+
+        self._local = threading.local()
+        self._listeners = []
+        if parent is None:
+            self._uri = f'file:{database}' if database else f'file:local-{uuid.uuid4().hex}?mode=memory&cache=shared'
+            self._stats = {'queries_run': 0, 'sessions': 0, 'plans_resolved': 0, 'tables_scanned': 0}
+            self._lock = threading.Lock()
+        else:
+            self._uri, self._stats, self._lock = parent._uri, parent._stats, parent._lock
+
+        with self._lock:
+            self._stats['sessions'] += 1
+        if connect_latency:
+            time.sleep(connect_latency)
+
+        # Keeps a shared in-memory database alive for the lifetime of the session
+        self._keeper = self._connect()
+
+    @property
+    def queries_run(self) -> int:
+        return self._stats['queries_run']
+
+    @property
+    def plans_resolved(self) -> int:
+        return self._stats['plans_resolved']
+
+    @property
+    def tables_scanned(self) -> int:
+        return self._stats['tables_scanned']
+
+    def new_session(self) -> 'LocalSession':
+        '''Open another session on the same database, e.g. as the session factory of a pool.'''
+        return LocalSession(self.database, self.latency, self.batch_size, self.connect_latency, self.plan_latency, self.scan_latency, parent=self)
+
+    def resolve(self, query: str) -> 'LocalDataFrame':
+        # pystarburst sends every new plan to the cluster to be analyzed, data frames wrapping a resolved plan are free
+        if self.plan_latency:
+            time.sleep(self.plan_latency)
+        with self._lock:
+            self._stats['plans_resolved'] += 1
+        return LocalDataFrame(self, query)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False, isolation_level=None)
+        # Trino aggregates missing in SQLite
+        conn.create_aggregate('stddev', 1, _StdDev)
+        conn.create_aggregate('approx_distinct', 1, _ApproxDistinct)
+        conn.create_aggregate('approx_percentile', 2, _ApproxPercentile)
+        return conn
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # SQLite connections are not shared between threads, so concurrent callers don't serialize on one
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def execute(self, query: str) -> sqlite3.Cursor:
+        if self.latency:
+            time.sleep(self.latency)
+        # Every reference to a table is a scan of its own, e.g. each part of a union
+        scans = len(_SCANNED_TABLE.findall(query))
+        if self.scan_latency:
+            time.sleep(self.scan_latency * scans)
+
+        replace = _CREATE_OR_REPLACE.match(query)
+        cursor = self._replace_table(*replace.groups()) if replace else self.connection.execute(query)
+        record = QueryRecord(f'local_{uuid.uuid4().hex[:16]}', query)
+        with self._lock:
+            self._stats['queries_run'] += 1
+            self._stats['tables_scanned'] += scans
+            for i in self._listeners:
+                i._add_query(record)
+        return cursor
+
+    def _replace_table(self, name: str, query: str) -> sqlite3.Cursor:
+        # Like CREATE OR REPLACE TABLE on Iceberg, one transaction, readers find the old or the new table and never none
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(f'DROP TABLE IF EXISTS {name}')
+            cursor = conn.execute(f'CREATE TABLE {name} AS {query}')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return cursor
+
+    @property
+    def _conn(self) -> 'LocalServerConnection':
+        return LocalServerConnection(self)
+
+    def table(self, name: str) -> 'LocalDataFrame':
+        return self.resolve(f'SELECT * FROM {quote(name)}')
+
+    def sql(self, query: str) -> 'LocalDataFrame':
+        return self.resolve(translate(query))
+
+    def query_history(self) -> 'LocalQueryHistory':
+        history = LocalQueryHistory(self)
+        self._listeners.append(history)
+        return history
+
+    def load_table(self, name: str, df: pd.DataFrame, append: bool = False):
+        conn = self.connection
+        if not append:
+            conn.execute(f'DROP TABLE IF EXISTS {quote(name)}')
+            conn.execute(f"CREATE TABLE {quote(name)} ({', '.join(quote(i) for i in df.columns)})")
+        conn.execute('BEGIN')
+        conn.executemany(f"INSERT INTO {quote(name)} VALUES ({', '.join('?' * len(df.columns))})",
+                         df.itertuples(index=False, name=None))
+        conn.execute('COMMIT')
+
+    def close(self):
+        self._keeper.close()
+
+
+class LocalServerConnection():
+    '''Stand-in for the pystarburst server connection, _conn is the DB-API connection like trino.dbapi.Connection'''
+
+    def __init__(self, session: LocalSession) -> None:
+        self._conn = self
+        self.session = session
+
+    def cursor(self) -> 'LocalCursor':
+        return LocalCursor(self.session)
+
+
+class LocalCursor():
+    '''Stand-in for trino.dbapi.Cursor with query statistics
+
+    SQLite has no scan statistics, so they are estimated like a columnar connector would read the tables: every value of each
+    column of a source table the query mentions (all columns when it mentions none), without any filter push-down.
+    '''
+
+    def __init__(self, session: LocalSession) -> None:
+        self.session = session
+        self._query = None
+        self._rows = []
+
+    def execute(self, query: str):
+        self._query = translate(query)
+        cursor = self.session.execute(self._query)
+        self.description = cursor.description
+        self._rows = cursor.fetchall()
+        return self
+
+    def fetchall(self) -> list:
+        return self._rows
+
+    @property
+    def stats(self) -> dict:
+        rows, scanned = 0, 0
+        conn = self.session.connection
+        for table in set(re.findall(r'"([^".]+\.[^".]+\.[^".]+)"', self._query or '')):
+            columns = [i[1] for i in conn.execute(f'PRAGMA table_info({quote(table)})')]
+            used = [i for i in columns if quote(i) in self._query] or columns
+            sizes = ', '.join(f"SUM(CASE typeof({quote(i)}) WHEN 'text' THEN length(CAST({quote(i)} AS BLOB)) WHEN 'null' THEN 0 ELSE 8 END)" for i in used)
+            count, *bytes = conn.execute(f'SELECT COUNT(*), {sizes} FROM {quote(table)}').fetchone()
+            rows += count
+            scanned += sum(i or 0 for i in bytes)
+        return {'state': 'FINISHED', 'processedRows': rows, 'processedBytes': scanned, 'physicalInputBytes': scanned}
+
+    def close(self):
+        pass
+
+
+class LocalQueryHistory():
+    '''Stand-in for pystarburst.QueryHistory'''
+
+    def __init__(self, session: LocalSession) -> None:
+        self.session = session
+        self._queries = []
+
+    def _add_query(self, record: QueryRecord):
+        self._queries.append(record)
+
+    @property
+    def queries(self) -> list:
+        return self._queries
+
+
+class LocalPlan(str):
+    '''SQL of a LocalDataFrame with the parts of pystarburst's TrinoPlan used by the app.'''
+
+    @property
+    def queries(self) -> list:
+        return [str(self)]
+
+    def model_copy(self, update: dict = None) -> 'LocalPlan':
+        return LocalPlan((update or {}).get('queries', self.queries)[-1])
+
+
+class LocalDataFrame():
+    '''Stand-in for pystarburst.DataFrame, every transformation wraps the SQL of its parent in a sub query.'''
+
+    def __init__(self, session: LocalSession, plan: str) -> None:
+        self._session = session
+        self._plan = LocalPlan(plan)
+        self.alias = f't{next(_aliases)}'
+        self._columns = None
+
+    def _derive(self, query: str) -> 'LocalDataFrame':
+        return self._session.resolve(query)
+
+    def _from(self) -> str:
+        # Tables are read directly instead of from a sub query, SQLite's parser runs out of stack after about 15 nested ones
+        table = _TABLE_PLAN.fullmatch(self._plan)
+        return f'{table.group(1)} AS {self.alias}' if table else f'({self._plan}) AS {self.alias}'
+
+    @property
+    def columns(self) -> list:
+        if self._columns is None:
+            self._columns = [i[0] for i in self._session.connection.execute(f'SELECT * FROM {self._from()} LIMIT 0').description]
+        return self._columns
+
+    @property
+    def schema(self) -> StructType:
+        # SQLite columns have no types, they are told from the values of the first row
+        row = self._session.connection.execute(f'SELECT * FROM {self._from()} LIMIT 1').fetchone() or [None] * len(self.columns)
+        types = {int: LongType, float: DoubleType}
+        return StructType([StructField(name, types.get(type(value), StringType)()) for name, value in zip(self.columns, row)])
+
+    @property
+    def queries(self) -> dict:
+        return {'queries': self._plan.queries, 'post_actions': []}
+
+    @property
+    def write(self) -> 'LocalDataFrameWriter':
+        return LocalDataFrameWriter(self)
+
+    def __getitem__(self, name: str) -> Column:
+        # Qualified with the alias so join conditions can tell both sides apart
+        return Column(general.UnresolvedAttribute(name=f'{self.alias}.{quote(name)}'))
+
+    def __getattr__(self, name: str) -> Column:
+        # df.orderkey like df['orderkey']
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def select(self, *cols) -> 'LocalDataFrame':
+        if len(cols) == 1 and isinstance(cols[0], (list, tuple)):
+            cols = cols[0]
+        return self._derive(f"SELECT {', '.join(to_sql(i) for i in cols)} FROM {self._from()}")
+
+    def with_column(self, name: str, column: Column) -> 'LocalDataFrame':
+        cols = [f'{to_sql(column)} AS {quote(name)}' if i == name else quote(i) for i in self.columns]
+        if name not in self.columns:
+            cols.append(f'{to_sql(column)} AS {quote(name)}')
+        return self._derive(f"SELECT {', '.join(cols)} FROM {self._from()}")
+
+    withColumn = with_column
+
+    def rename(self, existing: str, new: str) -> 'LocalDataFrame':
+        cols = [f'{quote(i)} AS {quote(new)}' if i == existing else quote(i) for i in self.columns]
+        return self._derive(f"SELECT {', '.join(cols)} FROM {self._from()}")
+
+    def drop(self, *cols) -> 'LocalDataFrame':
+        return self.select([i for i in self.columns if i not in cols])
+
+    def except_(self, other: 'LocalDataFrame') -> 'LocalDataFrame':
+        return self._derive(f'SELECT * FROM {self._from()} EXCEPT SELECT * FROM {other._from()}')
+
+    def describe(self, *cols) -> 'LocalDataFrame':
+        # Like pystarburst, a union of one aggregation per statistic, each scanning the data again
+        fields = [i for i in self.schema.fields if not cols or i.name in cols]
+        selects = []
+        for name, function in [('count', 'count'), ('mean', 'avg'), ('stddev', 'stddev'), ('min', 'min'), ('max', 'max')]:
+            aggs = [f'NULL AS {quote(i.name)}' if isinstance(i.datatype, StringType) and name in ('mean', 'stddev') else
+                    f'{function}({quote(i.name)}) AS {quote(i.name)}' for i in fields]
+            selects.append(f"SELECT '{name}' AS \"summary\", {', '.join(aggs)} FROM {self._from()}")
+        order = "CASE \"summary\" WHEN 'count' THEN 1 WHEN 'mean' THEN 2 WHEN 'stddev' THEN 3 WHEN 'min' THEN 4 ELSE 5 END"
+        return self._derive(f"SELECT * FROM ({' UNION ALL '.join(selects)}) ORDER BY {order}")
+
+    def filter(self, condition) -> 'LocalDataFrame':
+        condition = condition if isinstance(condition, Column) else Column(general.UnresolvedAttribute(name=condition))
+        return self._derive(f'SELECT * FROM {self._from()} WHERE {to_sql(condition)}')
+
+    where = filter
+
+    def join(self, right: 'LocalDataFrame', on: Column) -> 'LocalDataFrame':
+        # Columns with the same name on both sides are only kept once
+        cols = [f'{self.alias}.{quote(i)}' for i in self.columns]
+        cols += [f'{right.alias}.{quote(i)}' for i in right.columns if i not in self.columns]
+        return self._derive(f"SELECT {', '.join(cols)} FROM {self._from()} JOIN {right._from()} ON {to_sql(on)}")
+
+    def distinct(self) -> 'LocalDataFrame':
+        return self._derive(f'SELECT DISTINCT * FROM {self._from()}')
+
+    def group_by(self, *cols) -> 'LocalGroupedDataFrame':
+        return LocalGroupedDataFrame(self, cols)
+
+    groupBy = group_by
+
+    def sort(self, *cols, ascending: bool = True) -> 'LocalDataFrame':
+        order = ', '.join(to_sql(i) if isinstance(i, Column) else f"{quote(i)} {'ASC' if ascending else 'DESC'}" for i in cols)
+        return self._derive(f'SELECT * FROM {self._from()} ORDER BY {order}')
+
+    def limit(self, n: int) -> 'LocalDataFrame':
+        return self._derive(f'SELECT * FROM {self._from()} LIMIT {int(n)}')
+
+    def count(self) -> int:
+        return self._session.execute(f'SELECT COUNT(*) FROM {self._from()}').fetchone()[0]
+
+    def collect(self) -> list:
+        cursor = self._session.execute(self._plan)
+        names = [i[0] for i in cursor.description or []]
+        return [Row(**dict(zip(names, i))) for i in cursor.fetchall()]
+
+    def to_local_iterator(self):
+        cursor = self._session.execute(self._plan)
+        names = [i[0] for i in cursor.description]
+        for i in cursor:
+            yield Row(**dict(zip(names, i)))
+
+    def to_pandas(self) -> pd.DataFrame:
+        # Same shape as the JSON protocol path, all rows are materialized as Python objects first
+        cursor = self._session.execute(self._plan)
+        return pd.DataFrame(cursor.fetchall(), columns=[i[0] for i in cursor.description])
+
+    def to_arrow_batches(self, *, arrow_max_workers: int = None, fallback_to_json: bool = False) -> pa.RecordBatchReader:
+        cursor = self._session.execute(self._plan)
+        names = [i[0] for i in cursor.description]
+
+        rows = cursor.fetchmany(self._session.batch_size)
+        first = pa.RecordBatch.from_arrays([pa.array(i) for i in zip(*rows)] if rows else [pa.array([], pa.null())] * len(names), names=names)
+
+        def batches():
+            yield first
+            while rows := cursor.fetchmany(self._session.batch_size):
+                yield pa.RecordBatch.from_arrays([pa.array(v, type=f.type) for v, f in zip(zip(*rows), first.schema)], schema=first.schema)
+
+        return pa.RecordBatchReader.from_batches(first.schema, batches())
+
+    def to_arrow_table(self, *, arrow_max_workers: int = None, fallback_to_json: bool = False) -> pa.Table:
+        return self.to_arrow_batches().read_all()
+
+
+class LocalGroupedDataFrame():
+    '''Stand-in for pystarburst.RelationalGroupedDataFrame'''
+
+    def __init__(self, df: LocalDataFrame, cols) -> None:
+        self.df = df
+        self.cols = [to_sql(i) for i in cols]
+
+    def _agg(self, *aggs) -> LocalDataFrame:
+        keys = ', '.join(self.cols)
+        return self.df._derive(f"SELECT {', '.join(self.cols + list(aggs))} FROM {self.df._from()} GROUP BY {keys}")
+
+    def count(self) -> LocalDataFrame:
+        return self._agg('COUNT(*) AS "count"')
+
+    def agg(self, *exprs) -> LocalDataFrame:
+        # (column, function) pairs named like pystarburst, e.g. count(shipmode)
+        aggs = []
+        for column, function in exprs:
+            name = to_sql(column).strip('"')
+            aggs.append(f'{function.upper()}({to_sql(column)}) AS {quote(f"{function}({name})")}')
+        return self._agg(*aggs)
+
+    def avg(self, *cols) -> LocalDataFrame:
+        return self.agg(*((i, 'avg') for i in cols))
+
+    def sum(self, *cols) -> LocalDataFrame:
+        return self.agg(*((i, 'sum') for i in cols))
+
+
+class LocalDataFrameWriter():
+    '''Stand-in for pystarburst.DataFrameWriter'''
+
+    def __init__(self, df: LocalDataFrame) -> None:
+        self.df = df
+
+    def save_as_table(self, table_name: str, *, mode: str = None, **kwargs):
+        session = self.df._session
+        name = quote(table_name)
+        if mode == 'append':
+            session.execute(f'INSERT INTO {name} {self.df._plan}')
+            return
+        if mode == 'overwrite':
+            session.execute(f'DROP TABLE IF EXISTS {name}')
+        elif mode == 'ignore':
+            name = f'IF NOT EXISTS {name}'
+        session.execute(f'CREATE TABLE {name} AS {self.df._plan}')
+
+    saveAsTable = save_as_table
+
+
+STATES = ['AK', 'AL', 'AR', 'AZ', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'IA', 'ID', 'IL', 'IN', 'KS', 'KY', 'LA', 'MA', 'MD', 'ME', 'MI', 'MN', 'MO', 'MS',
+          'MT', 'NC', 'ND', 'NE', 'NH', 'NJ', 'NM', 'NV', 'NY', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VA', 'VT', 'WA', 'WI', 'WV', 'WY']
+RISK_APPETITES = ['low', 'medium', 'high', 'wild_west']
+SEGMENTS = ['silver', 'gold', 'platinum', 'bronze', 'diamond']
+
+def load_customer_tables(session: LocalSession, rows: int, catalog: str = 'sample', schema: str = 'burstbank', seed: int = 42, chunk_rows: int = 1_000_000):
+    '''Generate the customer_profile and customer tables used by the app with the given number of customers, chunk_rows at a time to bound memory.'''
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    for start in range(0, max(rows, 1), chunk_rows):
+        n = min(chunk_rows, rows - start)
+        custkey = np.arange(start, start + n)
+
+        session.load_table(f'{catalog}.{schema}.customer_profile', pd.DataFrame({
+            'custkey': custkey,
+            'customer_segment': rng.choice(SEGMENTS, n),
+            'risk_appetite': rng.choice(RISK_APPETITES, n),
+            'credit_score': rng.integers(300, 850, n),
+        }), append=start > 0)
+        session.load_table(f'{catalog}.{schema}.customer', pd.DataFrame({
+            'custkey': custkey,
+            'first_name': rng.choice(['Ann', 'Bob', 'Carla', 'Dev', 'Eli', 'Fay'], n),
+            'last_name': [f'customer_{i}' for i in custkey],
+            'state': rng.choice(STATES, n),
+            'estimated_income': rng.integers(20_000, 250_000, n),
+        }), append=start > 0)
+
+
+SHIPMODES = ['AIR', 'FOB', 'MAIL', 'RAIL', 'REG AIR', 'SHIP', 'TRUCK']
+SHIPINSTRUCTS = ['COLLECT COD', 'DELIVER IN PERSON', 'NONE', 'TAKE BACK RETURN']
+NATIONS = ['ALGERIA', 'ARGENTINA', 'BRAZIL', 'CANADA', 'EGYPT', 'ETHIOPIA', 'FRANCE', 'GERMANY', 'INDIA', 'INDONESIA', 'IRAN', 'IRAQ', 'JAPAN',
+           'JORDAN', 'KENYA', 'MOROCCO', 'MOZAMBIQUE', 'PERU', 'CHINA', 'ROMANIA', 'SAUDI ARABIA', 'VIETNAM', 'RUSSIA', 'UNITED KINGDOM', 'UNITED STATES']
+_WORDS = ['unusual', 'final', 'regular', 'special', 'pending', 'express', 'ironic', 'quick', 'deposits', 'requests', 'accounts', 'packages']
+
+def tpch_scale(schema: str) -> float:
+    '''Scale factor of a TPC-H schema name of the tpch connector, e.g. 0.01 for tiny and 10 for sf10.'''
+    if schema == 'tiny':
+        return 0.01
+    match = re.fullmatch(r'sf(\d+)', schema)
+    if match is None:
+        raise ValueError(f'Not a TPC-H schema: {schema}')
+    return float(match.group(1))
+
+def load_tpch_tables(session: LocalSession, schema: str = 'tiny', catalog: str = 'tpch', seed: int = 42, chunk_rows: int = 250_000):
+    '''Generate the lineitem, orders, customer and nation tables of a TPC-H schema with its row counts, chunk_rows orders at a time.
+    Values are uniformly random in the ranges of the TPC-H specification, order keys are dense unlike the tpch connector.'''
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    scale = tpch_scale(schema)
+    customers, orders = max(int(150_000 * scale), 1), max(int(1_500_000 * scale), 1)
+    comments = lambda n: [' '.join(i) for i in rng.choice(_WORDS, (n, 4))]
+
+    session.load_table(f'{catalog}.{schema}.nation', pd.DataFrame({
+        'nationkey': np.arange(len(NATIONS)),
+        'name': NATIONS,
+        'regionkey': np.arange(len(NATIONS)) % 5,
+        'comment': comments(len(NATIONS)),
+    }))
+    for start in range(0, customers, chunk_rows):
+        n = min(chunk_rows, customers - start)
+        custkey = np.arange(start + 1, start + n + 1)
+        session.load_table(f'{catalog}.{schema}.customer', pd.DataFrame({
+            'custkey': custkey,
+            'name': [f'Customer#{i:09d}' for i in custkey],
+            'nationkey': rng.integers(0, len(NATIONS), n),
+            'acctbal': np.round(rng.uniform(-999.99, 9999.99, n), 2),
+            'mktsegment': rng.choice(['AUTOMOBILE', 'BUILDING', 'FURNITURE', 'HOUSEHOLD', 'MACHINERY'], n),
+            'comment': comments(n),
+        }), append=start > 0)
+
+    for start in range(0, orders, chunk_rows):
+        n = min(chunk_rows, orders - start)
+        orderkey = np.arange(start + 1, start + n + 1)
+        session.load_table(f'{catalog}.{schema}.orders', pd.DataFrame({
+            'orderkey': orderkey,
+            'custkey': rng.integers(1, customers + 1, n),
+            'orderstatus': rng.choice(['F', 'O', 'P'], n),
+            'totalprice': np.round(rng.uniform(800, 500_000, n), 2),
+            'orderdate': (np.datetime64('1992-01-01') + rng.integers(0, 2405, n)).astype(str),
+            'orderpriority': rng.choice(['1-URGENT', '2-HIGH', '3-MEDIUM', '4-NOT SPECIFIED', '5-LOW'], n),
+            'comment': comments(n),
+        }), append=start > 0)
+
+        # 1 to 7 line items per order
+        lines = rng.integers(1, 8, n)
+        m = int(lines.sum())
+        quantity = rng.integers(1, 51, m)
+        session.load_table(f'{catalog}.{schema}.lineitem', pd.DataFrame({
+            'orderkey': np.repeat(orderkey, lines),
+            'partkey': rng.integers(1, max(int(200_000 * scale), 2), m),
+            'suppkey': rng.integers(1, max(int(10_000 * scale), 2), m),
+            'linenumber': np.arange(m) - np.repeat(np.cumsum(lines) - lines, lines) + 1,
+            'quantity': quantity.astype(float),
+            'extendedprice': np.round(quantity * rng.uniform(900, 2100, m), 2),
+            'discount': np.round(rng.integers(0, 11, m) / 100, 2),
+            'tax': np.round(rng.integers(0, 9, m) / 100, 2),
+            'returnflag': rng.choice(['A', 'N', 'R'], m),
+            'linestatus': rng.choice(['F', 'O'], m),
+            'shipdate': (np.datetime64('1992-01-02') + rng.integers(0, 2526, m)).astype(str),
+            'shipinstruct': rng.choice(SHIPINSTRUCTS, m),
+            'shipmode': rng.choice(SHIPMODES, m),
+            'comment': comments(m),
+        }), append=start > 0)
@@ -0,0 +1,442 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file holds the caches used by the Data and ML wrappers so repeated UI interactions can be answered from memory instead of going back to Starburst. With several app workers (see serve.py) the results are shared through files all processes memory-map.
+
+import os
+import sys
+import time
+import pickle
+import hashlib
+import asyncio
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pandas as pd
+
+import env
+
+
+def sizeof(value) -> int:
+    '''Best effort estimate of the memory held by a cached value in bytes.'''
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sys.getsizeof(i) for i in value)
+    return sys.getsizeof(value)
+
+
+def content_hash(df: pd.DataFrame, keys: list = None) -> str:
+    '''Hash of the values of a data frame, independent of its row order and index when sorted by keys.'''
+    if keys:
+        # Categories may be in any order, sort by their values
+        df = df.sort_values(keys, kind='stable', key=lambda i: i.astype(str) if isinstance(i.dtype, pd.CategoricalDtype) else i)
+    digest = hashlib.sha256(','.join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache():
+    '''Thread-safe result cache with a time to live and LRU eviction bounded by memory.
+
+    Cached values are shared between callers and must be treated as read-only.
+
+    Attributes
+    ----------
+        ttl : float
+            Seconds an entry stays valid, 0 or less disables caching
+        max_bytes : int
+            Upper bound for the summed size of all cached values
+        hits : int
+            Number of lookups answered from the cache
+        misses : int
+            Number of lookups that were not cached or expired
+        evictions : int
+            Number of entries dropped to stay under max_bytes
+
+    Methods
+    -------
+        get(key)
+            Get a cached value or None
+        put(key, value)
+            Cache a value
+        invalidate()
+            Drop all cached values
+        stats() -> dict
+            Get the cache counters
+    '''
+
+    def __init__(self, ttl: float = 300, max_bytes: int = 64 * 1024 * 1024, sizeof = sizeof) -> None:
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_bytes > 0
+
+    def get(self, key):
+        '''Get a cached value, or None if the key is missing or expired.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        '''Cache a value, evicting the least recently used entries when over max_bytes.'''
+        if not self.enabled:
+            return value
+
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            # The value cached before for the key is outdated as well
+            with self._lock:
+                if key in self._entries:
+                    self._drop(key)
+            return value
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+            self._entries[key] = (time.monotonic() + self.ttl, value, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+        return value
+
+    def invalidate(self):
+        '''Drop all cached values, the counters are kept.'''
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedCache():
+    '''Result cache shared by the worker processes of a machine through a directory, with the same interface as ResultCache.
+
+    Data frames are stored as Arrow IPC files and memory-mapped when read, other values are pickled. Entries are written
+    to a temporary file and renamed into place, so readers never see a partial one. Each process keeps the values it read in
+    a local ResultCache and only reads the file again once another process replaced it, a lookup then costs a stat().
+    Replacing or invalidating entries is seen by all processes on their next lookup. The files are bounded by max_bytes, the
+    oldest are deleted once a process wrote a tenth of it since its last cleanup, so every process adds at most that much on top.
+
+    Attributes
+    ----------
+        directory : str
+            Directory of the cache files
+        ttl : float
+            Seconds an entry stays valid after it was written, 0 or less disables caching
+        max_bytes : int
+            Upper bound for the size of the cache files, and of the values this process keeps in local
+        local : ResultCache
+            Values read by this process with the modification time of their file
+        hits : int
+            Number of lookups answered from the cache
+        misses : int
+            Number of lookups that were not cached or expired
+        evictions : int
+            Number of files this process deleted to stay under max_bytes
+
+    Methods
+    -------
+        get(key)
+            Get a cached value or None
+        put(key, value)
+            Cache a value for all processes
+        invalidate()
+            Drop all cached values of all processes
+        stats() -> dict
+            Get the cache counters
+    '''
+    ARROW_MAGIC = b'ARROW1'
+    CLEANUP_EVERY = 100
+
+    def __init__(self, directory: str, ttl: float = 300, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.local = ResultCache(ttl=ttl, max_bytes=max_bytes, sizeof=lambda entry: sizeof(entry[1]))
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._puts = 0
+        self._written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.local.enabled
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        if stat.st_mtime + self.ttl < time.time():
+            self.misses += 1
+            return None
+
+        stamp = (stat.st_mtime_ns, stat.st_ino)
+        entry = self.local.get(key)
+        if entry is None or entry[0] != stamp:
+            try:
+                entry = self.local.put(key, (stamp, self._read(path)))
+            except (FileNotFoundError, EOFError, OSError):
+                # Replaced or invalidated meanwhile
+                self.misses += 1
+                return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        if not self.enabled:
+            return value
+
+        path = self._path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self._write(f, value)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        stat = os.stat(path)
+        self.local.put(key, ((stat.st_mtime_ns, stat.st_ino), value))
+
+        self._puts += 1
+        self._written += stat.st_size
+        if self._puts % self.CLEANUP_EVERY == 0 or self._written * 10 >= self.max_bytes:
+            self._cleanup()
+        return value
+
+    def invalidate(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.cache'):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+        self.local.invalidate()
+
+    def stats(self) -> dict:
+        return {'entries': sum(1 for i in os.listdir(self.directory) if i.endswith('.cache')), 'bytes': self.local.stats()['bytes'],
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.local.evictions + self.evictions}
+
+    def _path(self, key) -> str:
+        # Keys are tuples of strings and numbers, their repr is the same in every process
+        return os.path.join(self.directory, hashlib.sha256(repr(key).encode()).hexdigest() + '.cache')
+
+    def _write(self, f, value):
+        if isinstance(value, pd.DataFrame):
+            import pyarrow as pa
+
+            table = pa.Table.from_pandas(value, preserve_index=False)
+            with pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _read(self, path: str):
+        with open(path, 'rb') as f:
+            arrow = f.read(len(self.ARROW_MAGIC)) == self.ARROW_MAGIC
+            if not arrow:
+                f.seek(0)
+                return pickle.load(f)
+
+        import pyarrow as pa
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+
+    def _cleanup(self):
+        # Expired entries and temporary files left by crashed writers, then the oldest entries above max_bytes
+        self._written = 0
+        now = time.time()
+        files = list()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                age = now - stat.st_mtime
+                if (name.endswith('.cache') and age > self.ttl) or (name.endswith('.tmp') and age > 3600):
+                    os.unlink(path)
+                elif name.endswith('.cache'):
+                    files.append((stat.st_mtime_ns, stat.st_size, path))
+            except FileNotFoundError:
+                pass
+
+        total = sum(i[1] for i in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def __len__(self):
+        return len(self.local)
+
+
+def get_cache(name: str, ttl: float = 300, max_bytes: int = 64 * 1024 * 1024):
+    '''Get a ResultCache, or a SharedCache in env.SHARED_CACHE_DIR when the app runs with several worker processes.'''
+    if env.SHARED_CACHE_DIR:
+        return SharedCache(os.path.join(env.SHARED_CACHE_DIR, name), ttl=ttl, max_bytes=max_bytes)
+    return ResultCache(ttl=ttl, max_bytes=max_bytes)
+
+
+class SingleFlight():
+    '''Coalesces concurrent calls for the same key into one execution, later callers wait for the running call and share its result or exception.
+
+    Results are not kept once the call finishes, pair it with a ResultCache for that.
+
+    Attributes
+    ----------
+        calls : int
+            Number of calls
+        executions : int
+            Number of calls that ran their function
+        coalesced : int
+            Number of calls that waited for a running call instead
+        errors : int
+            Number of executions that raised
+
+    Methods
+    -------
+        do(key, fn)
+            Run fn() unless a call for key is running, in which case wait for its result
+        do_async(key, fn)
+            Same as do() for asyncio callers, fn runs in the default executor and waiters don't block the event loop
+        in_flight() -> list
+            Get the keys of the running calls
+        stats() -> dict
+            Get the counters
+    '''
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+
+        self._flights = dict()
+        self._lock = threading.Lock()
+        self._running = threading.local()
+
+    def do(self, key, fn):
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        return self._run(key, future, fn)
+
+    async def do_async(self, key, fn):
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        return await asyncio.get_running_loop().run_in_executor(None, self._run, key, future, fn)
+
+    def in_flight(self) -> list:
+        with self._lock:
+            return list(self._flights)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'calls': self.calls, 'executions': self.executions, 'coalesced': self.coalesced,
+                    'errors': self.errors, 'in_flight': len(self._flights)}
+
+    def _join(self, key) -> tuple:
+        # Returns the future for key and whether the caller has to run it. The leader is registered here, before do_async hands it to an
+        # executor thread, so the calls in between wait for it as well
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            # A call for the same key from inside the running one would wait on itself, it runs on its own instead
+            if flight is not None and flight not in self._owned():
+                self.coalesced += 1
+                return flight, False
+
+            self.executions += 1
+            future = Future()
+            if flight is None:
+                self._flights[key] = future
+            return future, True
+
+    def _owned(self) -> list:
+        # Futures whose function runs in this thread
+        if not hasattr(self._running, 'futures'):
+            self._running.futures = list()
+        return self._running.futures
+
+    def _run(self, key, future: Future, fn):
+        owned = self._owned()
+        owned.append(future)
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                self.errors += 1
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            owned.remove(future)
+            with self._lock:
+                if self._flights.get(key) is future:
+                    del self._flights[key]
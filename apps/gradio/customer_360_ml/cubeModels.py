@@ -0,0 +1,85 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file holds a pre-aggregated cube of the customer counts so segment selections can be answered locally instead of with a new Starburst query.
+
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class SegmentCube():
+    '''Dense state x risk_appetite x customer_segment cube of customer counts
+
+    Built from the result of
+    df_joined.group_by('state', 'risk_appetite', 'customer_segment').count()
+    and sliced locally for every segment selection.
+
+    Attributes
+    ----------
+        states : numpy.ndarray
+            State labels, the first axis of counts
+        risks : numpy.ndarray
+            Risk appetite labels, the second axis of counts
+        segments : numpy.ndarray
+            Customer segment labels, the third axis of counts
+        counts : numpy.ndarray
+            Number of customers for every state, risk appetite and segment
+        built : float
+            Time the counts were queried, seconds since the epoch
+
+    Methods
+    -------
+        slice(segments) -> pd.DataFrame
+            Get the counts by state and risk appetite for the selected segments
+    '''
+
+    def __init__(self, df: pd.DataFrame, count_col: str = 'count', built: float = None) -> None:
+        state_codes, self.states = pd.factorize(df['state'], use_na_sentinel=False)
+        risk_codes, self.risks = pd.factorize(df['risk_appetite'], use_na_sentinel=False)
+        segment_codes, self.segments = pd.factorize(df['customer_segment'], use_na_sentinel=False)
+
+        self.counts = np.zeros((len(self.states), len(self.risks), len(self.segments)), dtype=np.int64)
+        np.add.at(self.counts, (state_codes, risk_codes, segment_codes), df[count_col].to_numpy(dtype=np.int64))
+
+        self._segment_index = pd.Index(self.segments)
+        self.built = time.time() if built is None else built
+
+    @property
+    def nbytes(self) -> int:
+        return self.counts.nbytes
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.built
+
+    def slice(self, segments) -> pd.DataFrame:
+        '''Get the counts by state and risk appetite for the selected segments, sorted by count descending.
+        Args:  segments: Customer segments to include'''
+        selected = self._segment_index.get_indexer(pd.unique(pd.Series(list(segments or []), dtype=object)))
+        totals = self.counts[:, :, selected[selected >= 0]].sum(axis=2)
+
+        # Only groups with customers exist in the group_by result
+        state_idx, risk_idx = np.nonzero(totals)
+        counts = totals[state_idx, risk_idx]
+        order = np.argsort(-counts, kind='stable')
+
+        return pd.DataFrame({
+            'state': self.states[state_idx[order]],
+            'risk_appetite': self.risks[risk_idx[order]],
+            'count': counts[order],
+        })
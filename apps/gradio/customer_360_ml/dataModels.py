@@ -16,16 +16,88 @@ limitations under the License.
 
 # This file is used as a wrapper to any of the data maninuplation and PyStarburst interfaces to simulate an MVC pattern in the application. A class (Data) is the main class to handle these actions.
 
-from pystarburst import Session, DataFrame
-from pystarburst import functions as f
-from pystarburst.functions import col
+# PyStarburst and PyArrow take seconds to import, they are only loaded on first use so the UI can start without them
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pystarburst import Session, DataFrame
+    import pyarrow as pa
 
 import trino
 import env
 
-import pyarrow as pa
+from cacheModels import SingleFlight, content_hash, get_cache
+from cubeModels import SegmentCube
+import exportModels
+from profileModels import PERCENTILES, table_fields, table_snapshot, profile_query, profile_result
+from snapshotModels import SnapshotStore
+from poolModels import SessionPool, get_pool
+from executorModels import QueryExecutor
+from metricsModels import metrics
+
+import re
+import copy
+import asyncio
+import time
+import functools
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 
+class SharedData():
+    '''Data of one host, user and authentication shared by the Data of every browser session, see Data for the attributes.'''
+
+    def __init__(self) -> None:
+        self.segments = ['silver', 'gold', 'platinum', 'bronze', 'diamond']
+        self.df_onprem_credit = None
+        self.df_dl_customer_360 = None
+        self.df_joined = None
+        self.df_slim = None
+        self.slim_refreshed = None
+        self.summary_template = None
+        self.cube = None
+
+        self.agg_cache = get_cache('agg', ttl=env.AGG_CACHE_TTL, max_bytes=env.AGG_CACHE_MAX_BYTES)
+        self.profile_cache = get_cache('profile', ttl=env.PROFILE_CACHE_TTL, max_bytes=env.PROFILE_CACHE_MAX_BYTES)
+        self.flights = SingleFlight()
+        self.written = get_cache('written', ttl=env.WRITTEN_TTL, max_bytes=1024 * 1024)
+        self.snapshots = SnapshotStore(env.SNAPSHOT_DIR, max_age=env.SNAPSHOT_MAX_AGE, max_bytes=env.SNAPSHOT_MAX_BYTES) if env.SNAPSHOT_DIR else None
+        self.restored = False
+        self._revalidated = set()
+
+        self.initialized = False
+        self._init_lock = threading.RLock()
+        self._slim_lock = threading.Lock()
+        self._slim_thread = None
+
+
+class _Shared():
+    # Attribute of Data kept in its SharedData, so it is the same for all users of the settings
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner = None):
+        return self if obj is None else getattr(obj.shared, self.name)
+
+    def __set__(self, obj, value):
+        setattr(obj.shared, self.name, value)
+
+
+_shared = dict()
+_shared_lock = threading.Lock()
+
+def get_shared(key: tuple) -> SharedData:
+    '''Get the process-wide shared data for a connection key, e.g. (host, user, auth), creating it on first use.'''
+    with _shared_lock:
+        shared = _shared.get(key)
+        if shared is None:
+            shared = _shared[key] = SharedData()
+        return shared
+
+
 # Class to handle connection to Starburst and retrieve data
 class Data():
     """Class to handle connection to Starburst and retrieve data actions
@@ -35,19 +107,42 @@ class Data():
         host : str 
             Starburst host
         username : str 
-            Starburst username
+            Starburst username, the authentication decides the user of the sessions
         session_properties : dict 
-            Starburst session properties
-        session : pystarburst.Session
-            Starburst session
+            Starburst session properties, replaced and never changed in place as pools keep the ones they were created with
+        session_factory : callable
+            Creates sessions instead of session_properties, e.g. for a local stand-in
+        pool : poolModels.SessionPool
+            Pool of Starburst sessions, each request checks out its own
+        shared : SharedData
+            Plans, segments, cube and caches shared by all users of the same settings, see for_user()
         
-        query_history : pystarburst.QueryHistor
-            Starburst query history
         queries_list : list([str, str])
             List of Starburst queries
         
+        Shared by all users of the same settings:
+
         initialized : bool
             Flag to indicate if data has been initialized
+        agg_cache : cacheModels.ResultCache
+            Cache of aggregated results keyed by source tables and segments, a cacheModels.SharedCache with several workers
+        profile_cache : cacheModels.ResultCache
+            Cache of column profiles keyed by table snapshot, columns and sample
+        flights : cacheModels.SingleFlight
+            Coalesces identical queries issued concurrently by several users or tabs
+        written : cacheModels.ResultCache
+            Content hashes of the last writes per segments, keyed by host and target table, a cacheModels.SharedCache with several workers
+        snapshots : snapshotModels.SnapshotStore
+            Segments, cube and aggregates on disk when env.SNAPSHOT_DIR is set, a restart uses them until Starburst is connected
+        restored : bool
+            Flag to indicate the segments were restored from a snapshot and are not initialized yet
+        summary_template : PlanTemplate
+            Aggregation of df_slim resolved once, summary_plan() binds the selected segments into its SQL
+
+        Per user:
+
+        last_write : dict
+            Mode, skipped flag and number of rows written and deleted by the last write
             
     Data Elements
     -------------
@@ -59,8 +154,19 @@ class Data():
             Data lake customer data
         df_joined : pystarburst.DataFrame
             Joined on-prem and data lake customer data
+        df_slim : pystarburst.DataFrame
+            State, risk appetite and segment of every customer, the only columns segment filters and aggregations use.
+            Read from env.SLIM_TABLE when it is set, otherwise a projection-pruned join of the source tables
+        slim_refreshed : float
+            Time env.SLIM_TABLE was last rebuilt
+        cube : cubeModels.SegmentCube
+            Pre-aggregated customer counts when env.USE_AGG_CUBE is set, rebuilt in the background once older than env.AGG_CACHE_TTL
         df_summary : pystarburst.DataFrame
-            Summarized customer data
+            Summarized customer data of the user's selection
+        summary_segments : list(str)
+            Segments df_summary is filtered on
+        summary : pandas.DataFrame
+            Latest result of df_summary
 
     Gradio Helpers
     --------------
@@ -75,22 +181,70 @@ class Data():
     
     Methods
     --------------
-        get_initial_data(do_agg = True)
-            Get initial data
+        get_initial_data(do_agg = True, warm_agg = False)
+            Get initial data, with warm_agg the default aggregate is cached along with it without becoming the summary
+        ensure_initialized()
+            Get initial data once, shared by concurrent callers
+        restore_snapshots() -> bool
+            Load the segments and the cube of the last run from env.SNAPSHOT_DIR
+        prefetch() -> threading.Thread
+            Warm sessions, segments and the default aggregate in the background
+        for_user() -> Data
+            Get a Data for a browser session, with its own selection and settings but sharing the plans, caches and sessions
+        get_slim_plan(session) -> pystarburst.DataFrame
+            Get the projection-pruned join of the columns used by segment filters and aggregations
+        refresh_slim(force = False, session = None) -> bool
+            Rebuild env.SLIM_TABLE when it is older than env.SLIM_REFRESH_SECONDS, on session if given
+        create_session() -> pystarburst.Session
+            Create a Starburst session from session_properties
+        settings_key() -> tuple
+            Get the session properties and authentication the pool and shared data belong to
+        get_pool() -> poolModels.SessionPool
+            Get the session pool for the current session properties
+        checkout(session = None)
+            Context manager for a session, checked out from the pool unless one is given
         refresh_session()
-            Refresh Starburst session
-        save_settings(h, u, p)
-            Save Starburst settings and refresh session
+            Switch to the session pool and shared data for the current settings
+        save_settings(h, u)
+            Save Starburst settings of this user and refresh session
         get_queries()
             Get Starburst queries
+        get_queries_since(token) -> (tuple, pd.DataFrame)
+            Get Starburst queries if there are new ones since the token of the last call, else None
         get_unique_segs()
             Get unique customer segments
         get_agg_data(segments)
             Get aggregated customer data
+        get_agg_data_async(segments)
+            Get aggregated customer data from a coroutine
+        summary_plan(segments, session = None) -> pystarburst.DataFrame
+            Get the aggregation of the selected segments
+        get_summary() -> pd.DataFrame
+            Get the latest aggregated customer data without querying it again
+        agg_cache_key(segments) -> tuple
+            Get the result cache key for a segment selection
+        invalidate_cache()
+            Drop all cached aggregated results and their snapshots
+        query_stats(df: DataFrame) -> dict
+            Run a data frame and get the Trino query statistics, e.g. the bytes scanned
+        profile(table, columns = None, sample = None, arrow = False) -> pd.DataFrame
+            Get count, nulls, min, max, mean, stddev, approximate distinct values and percentiles of columns of a table in one query
         write_agg_data()
-            Write aggregated customer data
-        to_pyarrow(df: DataFrame) -> pa.Table
+            Write aggregated customer data, see env.WRITE_MODE
+        write_evaluation(result: pd.DataFrame) -> int
+            Append the answers of a batch evaluation to evaluation_table
+        to_arrow_reader(df: DataFrame) -> pa.RecordBatchReader
+            Stream pystarburst.DataFrame results as Arrow record batches
+        to_pyarrow(df: DataFrame, session = None) -> pa.Table
             Convert pystarburst.DataFrame to pyarrow.Table
+        to_pandas(df: DataFrame, session = None) -> pd.DataFrame
+            Convert pystarburst.DataFrame to pandas.DataFrame through Arrow
+        iter_batches(df: DataFrame, rows = None, max_bytes = None, limit = None, as_pandas = False)
+            Stream pystarburst.DataFrame results in Arrow or pandas chunks of a bounded size
+        preview(df: DataFrame, limit = None, session = None) -> pd.DataFrame
+            Get the first rows of a pystarburst.DataFrame for display without reading the rest
+        export(df: DataFrame, path, format = None, rows = None, max_bytes = None) -> dict
+            Stream pystarburst.DataFrame results to a Parquet or Feather file
         to_torch(t: pa.Table)
             Convert pyarrow.Table to torch.Tensor
     """
@@ -129,6 +283,13 @@ df_onprem_credit = df_onprem_credit.with_column('risk_appetite',\\
 
 df_joined = df_onprem_credit.join(df_dl_customer_360,\\
         df_onprem_credit['custkey'] == df_dl_customer_360['custkey'])
+
+# Only the columns used by the filters and aggregations are read from the source tables
+
+df_profile = df_onprem_credit.select('custkey', 'customer_segment', 'risk_appetite')
+df_customer = df_dl_customer_360.select('custkey', 'state')
+df_slim = df_profile.join(df_customer, df_profile['custkey'] == df_customer['custkey'])\\
+        .select('state', 'risk_appetite', 'customer_segment')
     """
     
     SEGMENTS_CODE = """
@@ -137,7 +298,7 @@ segments = df_onprem_credit.select('customer_segment').distinct().to_pandas()['c
 
     AGG_CODE = f"""
 df_summary = \\
-df_joined.filter(col('customer_segment').in_(segments))\\
+df_slim.filter(col('customer_segment').in_(segments))\\
 .group_by('state', 'risk_appetite')\\
 .count()\\
 .sort(col('count').desc())
@@ -161,6 +322,31 @@ session.table("{env.TARGET_CATALOG}.pystarburst_mis_sum.s360_summary").show()
     host = env.HOST
     username = env.USERNAME
 
+    segments = _Shared()
+    df_onprem_credit = _Shared()
+    df_dl_customer_360 = _Shared()
+    df_joined = _Shared()
+    df_slim = _Shared()
+    slim_refreshed = _Shared()
+    summary_template = _Shared()
+    cube = _Shared()
+    agg_cache = _Shared()
+    profile_cache = _Shared()
+    flights = _Shared()
+    written = _Shared()
+    snapshots = _Shared()
+    restored = _Shared()
+    _revalidated = _Shared()
+    initialized = _Shared()
+    _init_lock = _Shared()
+    _slim_lock = _Shared()
+    _slim_thread = _Shared()
+
+    target_table = f'{env.TARGET_CATALOG}.pystarburst_360_sum.s360_summary'
+    evaluation_table = f'{env.TARGET_CATALOG}.pystarburst_360_sum.s360_evaluation'
+
+    source_tables = (f'{env.SOURCE_CATALOG}.{env.SOURCE_SCHEMA}.customer_profile', f'{env.SOURCE_CATALOG}.{env.SOURCE_SCHEMA}.customer')
+
     session_properties = {
         "host":host,
         "port": 443,
@@ -172,87 +358,748 @@ session.table("{env.TARGET_CATALOG}.pystarburst_mis_sum.s360_summary").show()
         "auth": trino.auth.OAuth2Authentication()
     }
 
-    def __init__(self):
-        # Setup a session, query history logger, and initial data frames
+    def __init__(self, session_factory = None):
+        # Setup the session pool and query history logger, nothing connects to Starburst until first use or prefetch(). A session factory, e.g. for the local stand-in used by the benchmarks, can be passed in.
         if env.DEBUG: print("INFO: Data Init")
-        builder = Session.builder.configs(self.session_properties)
-        builder._options['source'] = 'PyStarburst:Demo:GradioApp'
-        self.session = builder.create()
+        self.session_properties = dict(self.session_properties)
+        self.session_factory = session_factory
 
-        self.query_history = self.session.query_history()
+        self.pool = self.get_pool()
+        self.shared = get_shared(self.settings_key())
         self.queries_list = list()
 
-        self.segments = ['silver', 'gold', 'platinum', 'bronze', 'diamond']
-        
-        self.initialized = False
+        self.df_summary = None
+        self.summary_segments = None
+        self.summary = None
+        self.last_write = dict()
+
+        if self.snapshots is not None and not self.initialized and not self.restored:
+            self.restore_snapshots()
+
+    def for_user(self) -> Data:
+        # A browser session only keeps its settings and selection, a few hundred bytes plus the summary it shares with the cache
+        user = copy.copy(self)
+        user.session_properties = dict(self.session_properties)
+        user.queries_list = list()
+        user.df_summary = None
+        user.summary_segments = None
+        user.summary = None
+        user.last_write = dict()
+        return user
 
-    def get_initial_data(self, do_agg = True):
+    @metrics.measured('get_initial_data')
+    def get_initial_data(self, do_agg = True, warm_agg = False):
         # Pulls the initial data, while peforming some basic clean up and joins
 
         if env.DEBUG: print("INFO: Get Initial Data")
 
-        self.df_onprem_credit = self.session.table(f'{env.SOURCE_CATALOG}.{env.SOURCE_SCHEMA}.customer_profile')
-        self.df_dl_customer_360 = self.session.table(f'{env.SOURCE_CATALOG}.{env.SOURCE_SCHEMA}.customer')
+        with self._init_lock:
+            with self.checkout() as session:
+                self.df_onprem_credit = session.table(self.source_tables[0])
+                self.df_dl_customer_360 = session.table(self.source_tables[1])
+
+                from pystarburst import functions as f
+
+                self.df_onprem_credit = self.df_onprem_credit.with_column('risk_appetite', f.sql_expr(RISK_APPETITE_CLEANUP))
+                self.df_joined = self.df_onprem_credit.join(self.df_dl_customer_360, self.df_onprem_credit['custkey'] == self.df_dl_customer_360['custkey'])
+
+                # Segment filters and aggregations run on the slim columns only, materialized once when env.SLIM_TABLE is set
+                if env.SLIM_TABLE:
+                    self.refresh_slim(session=session)
+                    self.df_slim = session.table(env.SLIM_TABLE)
+                    self._schedule_slim_refresh()
+                else:
+                    self.df_slim = self.get_slim_plan(session)
+
+                # The segment list needs neither the join nor the clean up
+                df_segments = (self.df_slim if env.SLIM_TABLE else session.table(self.source_tables[0])).select('customer_segment').distinct()
+                # One query for every state, risk appetite and segment, segment selections are then sliced locally
+                df_cube = self.get_cube_plan(session) if env.USE_AGG_CUBE else None
+
+            # The queries are independent, each runs on its own pooled session and is measured as part of this operation. The default
+            # aggregate needs the segment list, it runs at the same time for the segments known so far, the default ones or those of the
+            # snapshot, which are almost always the same
+            expected = list(self.segments)
+            with QueryExecutor(env.QUERY_CONCURRENCY) as executor:
+                segments = executor.submit(self.to_pyarrow, df_segments)
+                cube = executor.submit(self.to_pandas, df_cube) if df_cube is not None else None
+                agg = executor.submit(self._query_agg_data, expected) if (do_agg or warm_agg) and df_cube is None else None
+                executor.gather()
+
+            self.segments = segments.result().column('customer_segment').to_pylist()
+            if cube is not None:
+                self.cube = SegmentCube(cube.result())
 
-        self.df_onprem_credit = self.df_onprem_credit.with_column('risk_appetite', f.sql_expr("replace(\"risk_appetite\", 'wild_west', 'very_low')"))
-        self.df_joined = self.df_onprem_credit.join(self.df_dl_customer_360, self.df_onprem_credit['custkey'] == self.df_dl_customer_360['custkey'])
+            # Results served from the snapshots of the last run are outdated now, they are replaced by the fresh ones
+            if self.restored:
+                self.restored = False
+                self.invalidate_cache()
+            self._snapshot(self.snapshot_key('segments'), pd.DataFrame({'customer_segment': self.segments}), df_segments)
+            if cube is not None:
+                self._snapshot(self.snapshot_key('cube'), cube.result(), df_cube)
+            if agg is not None:
+                self._put_agg_data(expected, *agg.result())
 
-        self.segments = self.df_onprem_credit.select('customer_segment').distinct().to_pandas()['customer_segment'].to_list()
+            self.initialized = True
         
+        # Answered from the cache unless the segments changed
         if do_agg:
             self.get_agg_data(self.segments)
-        
-        self.initialized = True
+
+    def ensure_initialized(self):
+        # Concurrent first requests wait for a single initialization instead of each running their own
+        if not self.initialized:
+            self.flights.do(('init', self.host), self._initialize)
+
+    def _initialize(self):
+        # The first chart of every user shows the default selection, it is queried at the same time as the segment list
+        with self._init_lock:
+            if not self.initialized:
+                self.get_initial_data(do_agg=False, warm_agg=True)
+
+    def restore_snapshots(self) -> bool:
+        # The segments and the cube of the last run are shown while the initialization queries them again
+        segments, _ = self.snapshots.load(self.snapshot_key('segments'))
+        if segments is None:
+            return False
+        self.segments = segments['customer_segment'].astype(str).to_list()
+        if env.USE_AGG_CUBE:
+            cube, metadata = self.snapshots.load(self.snapshot_key('cube'))
+            if cube is not None:
+                self.cube = SegmentCube(cube, built=metadata['created'])
+        self.restored = True
+        if env.DEBUG: print(f"INFO: Restored snapshots {self.snapshots.stats()}")
+        return True
+
+    def snapshot_key(self, name: str) -> tuple:
+        return (name, self.host) + self.source_tables
+
+    def _snapshot(self, key: tuple, df: pd.DataFrame, plan: DataFrame = None):
+        # Snapshots are a best effort, a full disk must not fail the request
+        if self.snapshots is None:
+            return
+        try:
+            self.snapshots.save(key, df, self.source_tables, plan.queries['queries'][-1] if plan is not None else None)
+        except Exception as e:
+            print(f"WARNING: Snapshot failed: {e}")
+
+    def _revalidate(self, segments):
+        # A snapshot is served once per process, it is queried again in the background and the next lookup gets the fresh result
+        key = self.agg_cache_key(segments)
+        if key in self._revalidated:
+            return
+        self._revalidated.add(key)
+
+        def run():
+            try:
+                self.ensure_initialized()
+                with self.checkout() as session:
+                    df = self.summary_plan(segments, session)
+                    result = self.agg_cache.put(key, self.to_pandas(df, session))
+                self._snapshot(key, result, df)
+            except Exception as e:
+                print(f"WARNING: Revalidating the snapshot of {segments} failed: {e}")
+
+        threading.Thread(target=run, name='snapshot-revalidate', daemon=True).start()
+
+    def prefetch(self) -> threading.Thread:
+        # Warms the session pool, the segment list and the default aggregate in the background so the UI renders without waiting for Starburst
+        def run():
+            try:
+                with ThreadPoolExecutor(1) as executor:
+                    executor.submit(self.pool.warm_up).add_done_callback(_log_warm_up)
+                    self.ensure_initialized()
+                    self.get_agg_data(self.segments)
+            except Exception as e:
+                print(f"WARNING: Prefetch failed, data is loaded on first use: {e}")
+
+        thread = threading.Thread(target=run, name='data-prefetch', daemon=True)
+        thread.start()
+        return thread
     
+    def get_slim_plan(self, session: Session) -> DataFrame:
+        # Both sides are projected before the join, so Trino reads only these columns from the wide source tables
+        from pystarburst import functions as f
+        from pystarburst.functions import col
+
+        df_profile = session.table(self.source_tables[0]).select(col('custkey'), col('customer_segment'), f.sql_expr(RISK_APPETITE_CLEANUP).alias('risk_appetite'))
+        df_customer = session.table(self.source_tables[1]).select(col('custkey'), col('state'))
+        return df_profile.join(df_customer, df_profile['custkey'] == df_customer['custkey']).select(SLIM_COLUMNS)
+
+    def get_cube_plan(self, session: Session) -> DataFrame:
+        return _bind(self.df_slim, session).group_by('state', 'risk_appetite', 'customer_segment').count()
+
+    def refresh_slim(self, force = False, session: Session = None) -> bool:
+        # Materializes the slim plan into env.SLIM_TABLE, the clean up and the join then run once per refresh instead of once per query.
+        # A caller holding a pooled session passes it, checking out a second one waits for itself when all sessions are in use
+        if not env.SLIM_TABLE:
+            return False
+
+        with self._slim_lock:
+            if not force and self.slim_refreshed is not None and time.time() - self.slim_refreshed < env.SLIM_REFRESH_SECONDS:
+                return False
+            if env.DEBUG: print(f"INFO: Refresh {env.SLIM_TABLE}")
+
+            with self.checkout(session) as held:
+                held.sql(f"CREATE SCHEMA IF NOT EXISTS {env.SLIM_TABLE.rsplit('.', 1)[0]}").collect()
+                _swap_table(held, self.get_slim_plan(held), env.SLIM_TABLE)
+                self.df_slim = held.table(env.SLIM_TABLE)
+
+            refreshed, self.slim_refreshed = self.slim_refreshed, time.time()
+
+        # Results of the previous snapshot are outdated
+        if refreshed is not None:
+            self.invalidate_cache()
+            if self.cube is not None:
+                self._build_cube(session)
+        return True
+
+    def _build_cube(self, session: Session = None):
+        with self.checkout(session) as held:
+            df_cube = self.get_cube_plan(held)
+            result = self.to_pandas(df_cube, held)
+        self.cube = SegmentCube(result)
+        self._snapshot(self.snapshot_key('cube'), result, df_cube)
+
+    def _refresh_cube(self):
+        # Selections are queried until the new cube is there, one rebuild runs at a time
+        if ('cube', self.host) in self.flights.in_flight():
+            return
+
+        def run():
+            try:
+                self.flights.do(('cube', self.host), self._build_cube)
+            except Exception as e:
+                print(f"WARNING: Rebuilding the aggregate cube failed, selections are queried: {e}")
+
+        threading.Thread(target=run, name='cube-refresh', daemon=True).start()
+
+    def _schedule_slim_refresh(self):
+        if self._slim_thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(env.SLIM_REFRESH_SECONDS)
+                try:
+                    self.refresh_slim(force=True)
+                except Exception as e:
+                    print(f"WARNING: Refresh of {env.SLIM_TABLE} failed, the previous one is used: {e}")
+
+        self._slim_thread = threading.Thread(target=run, name='slim-refresh', daemon=True)
+        self._slim_thread.start()
+
+    def create_session(self) -> Session:
+        return create_session(self.session_properties)
+
+    def settings_key(self) -> tuple:
+        # Authentication objects are compared by their type, the other properties by value
+        return tuple(sorted((k, v if isinstance(v, (str, int, float, bool, type(None))) else type(v).__name__)
+                            for k, v in self.session_properties.items())) + (self.session_factory,)
+
+    def get_pool(self) -> SessionPool:
+        # Pools are shared process-wide, switching back to earlier settings reuses their warm sessions. The factory keeps a copy of the
+        # properties, the pool must not follow the user who created it to other settings
+        factory = self.session_factory or functools.partial(create_session, dict(self.session_properties))
+        return get_pool(self.settings_key(), factory, min_size=env.POOL_MIN_SIZE, max_size=env.POOL_MAX_SIZE,
+                        idle_timeout=env.POOL_IDLE_TIMEOUT, health_check_interval=env.POOL_HEALTH_CHECK_INTERVAL)
+
+    def checkout(self, session: Session = None):
+        # Reuse the session the caller already holds, otherwise check one out for this request
+        return nullcontext(session) if session is not None else self.pool.session()
+
     def refresh_session(self):
-        self.session = Session.builder.configs(self.session_properties).create()
+        self.pool = self.get_pool()
+        self.shared = get_shared(self.settings_key())
 
     def save_settings(self, h, u):
+        # Only this user switches, the data of the new settings is loaded in the background unless another user already did
         self.host = h
         self.username = u
+        self.session_properties = dict(self.session_properties, host=h)
         self.refresh_session()
 
+        self.df_summary = None
+        self.summary_segments = None
+        self.summary = None
+        self.prefetch()
+
+    @metrics.measured('get_queries')
     def get_queries(self) -> list:
-        if not self.initialized:
-            self.get_initial_data(do_agg=False)
-        
-        return pd.DataFrame(self.query_history.queries)
+        self.ensure_initialized()
+        self.pool.log.drain(self.pool.histories)
+
+        return self.pool.log.snapshot()[1]
 
+    def get_queries_since(self, token: tuple = None) -> tuple:
+        # Cheap for polling clients, the background refresher collects the queries and the data frame is only built once per change for all of them
+        log = self.pool.log
+        version, df = log.since(token[1] if token is not None and token[0] == id(log) else None)
+        return (id(log), version), df
+
+    @metrics.measured('get_unique_segs')
     def get_unique_segs(self) -> list[str]:
         print("INFO: Get Unique Segs")
-        if not self.initialized:
-            self.get_initial_data(do_agg=False)
+        # Segments restored from a snapshot are used while the initialization runs in the background
+        if not self.restored:
+            self.ensure_initialized()
         
         return self.segments
 
+    @metrics.measured('get_agg_data')
     def get_agg_data(self, segments) -> pd.DataFrame:
         # Summary
         print("INFO: Get Agg Data")
-        if not self.initialized:
-            self.get_initial_data(do_agg=False)
-        
-        self.df_summary = self.df_joined.filter(col('customer_segment').in_(segments))\
-        .group_by('state', 'risk_appetite')\
-        .count()\
-        .sort(col('count').desc())
+        result = self._restored_agg_data(segments)
+        if result is not None:
+            return self._set_summary(segments, result)
+        self.ensure_initialized()
 
-        #self.df_summary.show()
-        return self.df_summary.to_pandas()
+        # Identical selections arriving while one is running, also from other users, wait for its result instead of sending the same query
+        result = self.flights.do(self.agg_cache_key(segments), lambda: self._get_agg_data(segments))
+        if env.DEBUG: print(f"INFO: Agg Cache {self.agg_cache.stats()}, Flights {self.flights.stats()}")
+
+        return self._set_summary(segments, result)
+
+    async def get_agg_data_async(self, segments) -> pd.DataFrame:
+        # Same steps as get_agg_data, everything that may wait for Starburst or the disk runs in the default executor
+        result = await asyncio.to_thread(self._restored_agg_data, segments)
+        if result is None:
+            if not self.initialized:
+                await self.flights.do_async(('init', self.host), self._initialize)
+            result = await self.flights.do_async(self.agg_cache_key(segments), lambda: self._get_agg_data(segments))
+
+        return await asyncio.to_thread(self._set_summary, segments, result)
+
+    def _restored_agg_data(self, segments) -> pd.DataFrame | None:
+        # After a restart the result can come from a snapshot before Starburst is connected
+        return self._cached_agg_data(segments) if not self.initialized else None
+
+    def get_summary(self) -> pd.DataFrame:
+        # The result shown last, e.g. for the LLM context, only queried if there is none yet
+        if self.summary is None:
+            self.get_agg_data(self.segments)
+        return self.summary
+
+    def _set_summary(self, segments, result: pd.DataFrame) -> pd.DataFrame:
+        # The selection of this user, the plan is kept for write_agg_data once the data is initialized
+        self.df_summary = self.summary_plan(segments) if self.df_slim is not None else None
+        self.summary_segments = list(segments)
+        self.summary = result
+        return result
+
+    def summary_plan(self, segments, session: Session = None) -> DataFrame:
+        # Every transformation is resolved by a round trip to the cluster, so the plan is built once per df_slim with a placeholder
+        # segment and a selection only binds its segments into the SQL
+        template = self.summary_template
+        if template is not None and template.source is self.df_slim:
+            return template.bind(segments, session)
+
+        # Resolving runs queries, on a session of this caller as the one df_slim was built on may be in use by another thread
+        with self.checkout(session) as held:
+            try:
+                template = self.summary_template = PlanTemplate(self._build_summary_plan([SEGMENTS_PLACEHOLDER], held), SEGMENTS_PLACEHOLDER,
+                                                                source=self.df_slim)
+            except ValueError as e:
+                print(f"WARNING: Building the aggregation for every selection: {e}")
+                return self._build_summary_plan(segments, held)
+            return template.bind(segments, held)
+
+    def _build_summary_plan(self, segments, session: Session) -> DataFrame:
+        from pystarburst.functions import col
+
+        return _bind(self.df_slim, session).filter(col('customer_segment').in_(segments))\
+            .group_by('state', 'risk_appetite')\
+            .count()\
+            .sort(col('count').desc())
+
+    def _cached_agg_data(self, segments) -> pd.DataFrame | None:
+        # Repeated selections are answered from memory or the cube without a query. Snapshots of the last run are only served while they
+        # were restored and the data isn't initialized yet, after that an expired result is queried again
+        key = self.agg_cache_key(segments)
+        result = self.agg_cache.get(key)
+        if result is not None:
+            metrics.add(cache='hit')
+            return result
+        # The cube expires like the cached results, a restored one is served until the initialization replaces it
+        cube = self.cube
+        if cube is not None and (cube.age < env.AGG_CACHE_TTL or not self.initialized):
+            metrics.add(cache='cube')
+            return self.agg_cache.put(key, cube.slice(segments))
+        if cube is not None:
+            self._refresh_cube()
+        if self.snapshots is not None and self.restored:
+            result, _ = self.snapshots.load(key)
+            if result is not None:
+                metrics.add(cache='snapshot')
+                self._revalidate(segments)
+                return self.agg_cache.put(key, result)
+        return None
+
+    def _get_agg_data(self, segments) -> pd.DataFrame:
+        result = self._cached_agg_data(segments)
+        if result is None:
+            metrics.add(cache='miss')
+            result = self._put_agg_data(segments, *self._query_agg_data(segments))
+
+        return result
+
+    def _query_agg_data(self, segments) -> tuple:
+        with self.checkout() as session:
+            df = self.summary_plan(segments, session)
+            return self.to_pandas(df, session), df
+
+    def _put_agg_data(self, segments, result: pd.DataFrame, df: DataFrame) -> pd.DataFrame:
+        key = self.agg_cache_key(segments)
+        result = self.agg_cache.put(key, result)
+        self._snapshot(key, result, df)
+        return result
+
+    def agg_cache_key(self, segments) -> tuple:
+        # Selections are normalized so the order and duplicates in the dropdown don't matter
+        return (self.host,) + self.source_tables + (tuple(sorted(set(segments or []))),)
+
+    def invalidate_cache(self):
+        self.agg_cache.invalidate()
+        # Only the results of this host and these source tables, the snapshots of other connections stay usable for their restart
+        if self.snapshots is not None:
+            self.snapshots.clear((self.host,) + self.source_tables)
+
+    def query_stats(self, df: DataFrame) -> dict:
+        # Runs the plan of df on a plain Trino cursor, whose statistics tell how much was scanned (physicalInputBytes) and processed.
+        # Without one only the rows and the wall time are known
+        with self.checkout() as session:
+            cursor = _trino_cursor(session)
+            start = time.perf_counter()
+            if cursor is None:
+                rows = self.to_pyarrow(df, session).num_rows
+                return {'rows': rows, 'wall_seconds': time.perf_counter() - start}
+            for query in _bind(df, session).queries['queries']:
+                cursor.execute(query)
+                rows = cursor.fetchall()
+            return {**cursor.stats, 'rows': len(rows), 'wall_seconds': time.perf_counter() - start}
     
+    @metrics.measured('profile')
+    def profile(self, table: str, columns: list = None, sample: float = None, arrow: bool = False) -> pd.DataFrame | pa.Table:
+        # One aggregate query for all statistics, describe() runs one per statistic. Profiles are cached per Iceberg snapshot, so they
+        # are reused until the table changes, tables of other connectors only for env.PROFILE_CACHE_TTL
+        if sample is not None and not 0 < sample <= 1:
+            raise ValueError(f"Sample must be a fraction of the rows between 0 and 1, not {sample}")
+        with self.checkout() as session:
+            snapshot = table_snapshot(session, table)
+            key = (self.host, table, snapshot, tuple(columns or ()), sample, PERCENTILES)
+            result = self.profile_cache.get(key)
+            if result is not None:
+                metrics.add(cache='hit')
+            else:
+                metrics.add(cache='miss')
+                fields = table_fields(session, table, columns)
+                row = self.to_pyarrow(session.sql(profile_query(table, fields, sample)), session)
+                result = self.profile_cache.put(key, profile_result(row, fields, metadata={'table': table, 'snapshot': snapshot, 'sample': sample}))
+
+        return result if arrow else result.to_pandas()
+
+    @metrics.measured('write_agg_data')
     def write_agg_data(self):
         if env.DEBUG: print("INFO: Write Agg Data")
-        if not self.initialized:
-            self.get_initial_data()
-        self.session.sql(f"CREATE SCHEMA IF NOT EXISTS {env.TARGET_CATALOG}.pystarburst_360_sum").collect()
+        self.ensure_initialized()
+        if self.df_summary is None and self.summary_segments is not None:
+            self.df_summary = self.summary_plan(self.summary_segments)
+        elif self.df_summary is None:
+            self.get_agg_data(self.segments)
+
+        # Clicks from several tabs or users writing the same selection concurrently share one write
+        segment_key = ','.join(sorted(set(self.summary_segments)))
+        return self.flights.do(('write', self.host, self.target_table, segment_key), self._write_agg_data)
+
+    def _write_agg_data(self) -> pd.DataFrame:
+        df_summary, segments = self.df_summary, self.summary_segments
+        # The target keeps one summary per segment selection
+        segment_key = ','.join(sorted(set(segments)))
+        target = self.target_table
+
+        result = self.to_pandas(df_summary)
+        # Fresh from the cluster, refresh the cached selection with it
+        self.summary = self._put_agg_data(segments, result, df_summary)
+
+        # An unchanged summary is not written, no other query runs. The digests are shared by the workers and expire after env.WRITTEN_TTL,
+        # writes to the target by anything else than this app are only seen after that
+        digest = content_hash(result, SUMMARY_KEYS)
+        written_key = (self.host, target)
+        if (self.written.get(written_key) or {}).get(segment_key) == digest:
+            if env.DEBUG: print("INFO: Summary unchanged since the last write, skipping")
+            metrics.add(cache='hit')
+            self.last_write = {'mode': env.WRITE_MODE, 'skipped': True, 'rows_written': 0, 'rows_deleted': 0}
+            return result
+
+        # The schema of the target and its columns don't depend on each other and are queried at the same time, each on its own pooled
+        # session. The write waits for both and the read back for the write
+        with QueryExecutor(env.QUERY_CONCURRENCY) as executor:
+            schema = executor.submit(self._run, _execute, f"CREATE SCHEMA IF NOT EXISTS {target.rsplit('.', 1)[0]}")
+            columns = executor.submit(self._run, _table_columns, target)
+
+            select = f"SELECT {', '.join(_quote(i) for i in SUMMARY_COLUMNS)} FROM {target} WHERE segments = {_literal(segment_key)}"
+            write = executor.submit(lambda: self._run(self._write_target, df_summary, result, segment_key, columns.result()), after=[schema, columns])
+            # Only what the output table shows is read back
+            read_back = executor.submit(lambda: self._run(lambda session: self.preview(session.sql(select), session=session)), after=[write])
+
+            self.last_write = executor.gather(write)[0]
+            # A swap or replace leaves only this selection in the target, the digests of the other ones are outdated. Merges of two workers
+            # at the same time may lose one digest, that selection is written again next time
+            digests = dict(self.written.get(written_key) or {}) if self.last_write['mode'] == 'merge' else {}
+            digests[segment_key] = digest
+            self.written.put(written_key, digests)
+            metrics.add(cache='miss')
+            if env.DEBUG: print(f"INFO: Write {self.last_write}")
+
+            return executor.gather(read_back)[0]
+
+    def _write_target(self, session: Session, df_summary: DataFrame, result: pd.DataFrame, segment_key: str, columns: list[str] | None) -> dict:
+        from pystarburst import functions as f
+
+        target = self.target_table
+        df_target = _bind(df_summary, session).with_column('segments', f.lit(segment_key))
+
+        if env.WRITE_MODE == 'merge' and columns is not None and 'segments' in columns:
+            return self._merge_agg_data(session, result, segment_key)
+        elif env.WRITE_MODE in ('merge', 'swap') and columns is not None:
+            _swap_table(session, df_target, target)
+            return {'mode': 'swap', 'skipped': False, 'rows_written': len(result), 'rows_deleted': None}
+        else:
+            session.sql(f"DROP TABLE IF EXISTS {target}").collect()
+            df_target.write.save_as_table(target)
+            return {'mode': 'replace', 'skipped': False, 'rows_written': len(result), 'rows_deleted': None}
+
+    def _run(self, fn, *args):
+        # A step of a QueryExecutor, fn(session, *args) runs on a session checked out for it
+        with self.checkout() as session:
+            return fn(session, *args)
+
+    def write_evaluation(self, result: pd.DataFrame) -> int:
+        '''Append the answers of a batch evaluation to evaluation_table, which is created on the first write
+        Args:  result: Answers from mlModels.OpenAI.evaluate()
+        Returns: Number of rows written'''
+        if env.DEBUG: print("INFO: Write Evaluation")
+        target = self.evaluation_table
+        columns = ', '.join(_quote(i) for i in EVALUATION_COLUMNS)
+
+        with self.checkout() as session:
+            session.sql(f"CREATE SCHEMA IF NOT EXISTS {target.rsplit('.', 1)[0]}").collect()
+            session.sql(f"CREATE TABLE IF NOT EXISTS {target} ({', '.join(f'{_quote(k)} {v}' for k, v in EVALUATION_COLUMNS.items())})").collect()
+            for i in range(0, len(result), EVALUATION_BATCH_ROWS):
+                rows = result.iloc[i:i + EVALUATION_BATCH_ROWS][list(EVALUATION_COLUMNS)]
+                values = ', '.join('(' + ', '.join(_literal(v) if t == 'varchar' else _number(v, t) for v, t in zip(row, EVALUATION_COLUMNS.values())) + ')'
+                                   for row in rows.itertuples(index=False))
+                session.sql(f"INSERT INTO {target} ({columns}) VALUES {values}").collect()
+        return len(result)
+
+    def _merge_agg_data(self, session: Session, result: pd.DataFrame, segment_key: str) -> dict:
+        # Only the rows of the selection that changed since the table was written are deleted and inserted again
+        target = self.target_table
+        select = f"SELECT {', '.join(_quote(i) for i in SUMMARY_COLUMNS)} FROM {target} WHERE segments = {_literal(segment_key)}"
+        existing = self.to_pandas(session.sql(select), session)
+
+        keys = {i: object for i in SUMMARY_KEYS}
+        diff = existing.astype(keys).merge(result.astype(keys), on=SUMMARY_KEYS, how='outer', suffixes=('_old', ''), indicator=True)
+        changed = (diff['_merge'] == 'both') & (diff['count_old'] != diff['count'])
+        deletes = diff[changed | (diff['_merge'] == 'left_only')]
+        inserts = diff[changed | (diff['_merge'] == 'right_only')]
+
+        for i in range(0, len(deletes), WRITE_BATCH_ROWS):
+            rows = deletes.iloc[i:i + WRITE_BATCH_ROWS]
+            match = ' OR '.join('(' + ' AND '.join(_equals(k, v) for k, v in zip(SUMMARY_KEYS, row)) + ')' for row in rows[SUMMARY_KEYS].itertuples(index=False))
+            session.sql(f"DELETE FROM {target} WHERE segments = {_literal(segment_key)} AND ({match})").collect()
+
+        for i in range(0, len(inserts), WRITE_BATCH_ROWS):
+            rows = inserts.iloc[i:i + WRITE_BATCH_ROWS]
+            values = ', '.join(f"({_literal(state)}, {_literal(risk)}, {int(count)}, {_literal(segment_key)})" for state, risk, count in rows[SUMMARY_COLUMNS].itertuples(index=False))
+            session.sql(f"INSERT INTO {target} ({', '.join(_quote(i) for i in SUMMARY_COLUMNS + ['segments'])}) VALUES {values}").collect()
+
+        return {'mode': 'merge', 'skipped': False, 'rows_written': len(inserts), 'rows_deleted': len(deletes)}
+
+    def to_arrow_reader(self, df: DataFrame) -> pa.RecordBatchReader:
+        # Runs on the session df is bound to, which the caller must hold until the reader is consumed.
+        # Batches are streamed from the Trino client as they arrive, string columns are dictionary encoded as most of them are low cardinality labels
+        import pyarrow as pa
+
+        reader = df.to_arrow_batches(fallback_to_json=True)
+        schema = pa.schema([pa.field(i.name, pa.dictionary(pa.int32(), i.type), i.nullable) if _is_string(i.type) else i for i in reader.schema])
+
+        return pa.RecordBatchReader.from_batches(schema, (_dictionary_encode(batch, schema) for batch in reader))
+
+    def to_pyarrow(self, df: DataFrame, session: Session = None) -> pa.Table:
+        import pyarrow as pa
+
+        # The time to the first batch is mostly the cluster, the rest of the query time mostly the transfer
+        with metrics.span('to_pyarrow'), self.checkout(session) as session:
+            start = time.perf_counter()
+            reader = self.to_arrow_reader(_bind(df, session))
+            batches = list()
+            for batch in reader:
+                if not batches:
+                    metrics.add(first_row_seconds=time.perf_counter() - start)
+                batches.append(batch)
+            table = pa.Table.from_batches(batches, schema=reader.schema)
+            metrics.add(query_seconds=time.perf_counter() - start, rows=table.num_rows, bytes=table.nbytes, queries=1)
+            return table
+
+    def to_pandas(self, df: DataFrame, session: Session = None) -> pd.DataFrame:
+        # Only needed for the Gradio components, numeric columns are converted without copies where possible and dictionary columns become categoricals
+        with metrics.span('to_pandas'):
+            table = self.to_pyarrow(df, session)
+            start = time.perf_counter()
+            result = table.to_pandas(split_blocks=True, self_destruct=True)
+            metrics.add(convert_seconds=time.perf_counter() - start)
+            return result
+
+    def iter_batches(self, df: DataFrame, rows: int = None, max_bytes: int = None, limit: int = None, as_pandas: bool = False):
+        # Generator holding a pooled session until it is exhausted or closed, only one chunk is in memory at a time. Chunks have at most
+        # env.EXPORT_BATCH_ROWS rows and env.EXPORT_BATCH_BYTES bytes unless given, and are handed out as soon as their rows arrived
+        stats = exportModels.ExportStats()
+        with self.checkout() as session:
+            reader = self.to_arrow_reader(_bind(df, session))
+            chunks = exportModels.iter_pandas if as_pandas else exportModels.iter_batches
+            try:
+                yield from chunks(reader, rows or env.EXPORT_BATCH_ROWS, max_bytes or env.EXPORT_BATCH_BYTES, limit, stats)
+            finally:
+                metrics.record('iter_batches', stats.seconds, first_row_seconds=stats.first_row_seconds, rows=stats.rows, bytes=stats.bytes, queries=1)
+
+    def preview(self, df: DataFrame, limit: int = None, session: Session = None) -> pd.DataFrame:
+        # At most env.DISPLAY_MAX_ROWS rows unless given, the rest of the result is not read
+        with metrics.span('preview'), self.checkout(session) as session:
+            stats = exportModels.ExportStats()
+            table = exportModels.head(self.to_arrow_reader(_bind(df, session)), limit or env.DISPLAY_MAX_ROWS, stats)
+            metrics.add(first_row_seconds=stats.first_row_seconds, query_seconds=stats.seconds, rows=stats.rows, bytes=stats.bytes, queries=1)
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+
+    @metrics.measured('export')
+    def export(self, df: DataFrame, path: str, format: str = None, rows: int = None, max_bytes: int = None) -> dict:
+        # Written batch by batch, the whole result is never in memory. Returns the rows, bytes, batches, first_row_seconds and seconds
+        with self.checkout() as session:
+            stats = exportModels.write_batches(self.to_arrow_reader(_bind(df, session)), path, format,
+                                               rows or env.EXPORT_BATCH_ROWS, max_bytes or env.EXPORT_BATCH_BYTES)
+            metrics.add(first_row_seconds=stats.first_row_seconds, query_seconds=stats.seconds, rows=stats.rows, bytes=stats.bytes, queries=1)
+            return stats.to_dict()
+
+
+RISK_APPETITE_CLEANUP = "replace(\"risk_appetite\", 'wild_west', 'very_low')"
+SLIM_COLUMNS = ['state', 'risk_appetite', 'customer_segment']
+
+# Value bound by PlanTemplate, not a valid segment
+SEGMENTS_PLACEHOLDER = '__segments_placeholder__'
+
+SUMMARY_KEYS = ['state', 'risk_appetite']
+SUMMARY_COLUMNS = SUMMARY_KEYS + ['count']
+# Rows per DELETE or INSERT statement of a merge
+WRITE_BATCH_ROWS = 500
+
+# Table of the batch evaluation answers, the time they were asked is kept as an ISO string in UTC
+EVALUATION_COLUMNS = {'question': 'varchar', 'answer': 'varchar', 'error': 'varchar', 'attempts': 'integer', 'seconds': 'double',
+                      'prompt_tokens': 'integer', 'completion_tokens': 'integer', 'model': 'varchar', 'segments': 'varchar', 'asked_at': 'varchar'}
+# Answers are long, fewer rows per INSERT keep the statements small
+EVALUATION_BATCH_ROWS = 50
+
+def create_session(properties: dict) -> Session:
+    from pystarburst import Session
+
+    builder = Session.builder.configs(properties)
+    builder._options['source'] = 'PyStarburst:Demo:GradioApp'
+    return builder.create()
+
+def _trino_cursor(session: Session):
+    # The DB-API connection is private to pystarburst, None if this version keeps it elsewhere
+    connection = getattr(getattr(session, '_conn', None), '_conn', None)
+    return connection.cursor() if hasattr(connection, 'cursor') else None
+
+def _log_warm_up(future):
+    # Sessions that couldn't be created now are created on first use
+    if not future.cancelled() and future.exception() is not None:
+        print(f"WARNING: Warming up the session pool failed: {future.exception()}")
+
+def _bind(df: DataFrame, session: Session) -> DataFrame:
+    # Resolved plans are plain SQL, so a data frame built on one pooled session can run on another
+    return df if df._session is session else type(df)(session, df._plan)
+
+
+class PlanTemplate():
+    '''Resolved plan of a data frame with a placeholder literal, bound to a list of values without resolving the plan again
+
+    Attributes
+    ----------
+        df : pystarburst.DataFrame
+            Data frame built with the placeholder as the only value of an IN list
+        source : pystarburst.DataFrame
+            Data frame the template was built from, e.g. to rebuild it when that changed
+
+    Methods
+    -------
+        bind(values, session = None) -> pystarburst.DataFrame
+            Get the data frame with the values in place of the placeholder, on session if given
+    '''
+
+    def __init__(self, df: DataFrame, placeholder: str, source: DataFrame = None) -> None:
+        # The whole IN list is replaced, a placeholder anywhere else, e.g. in a string the SQL compares to, must not be
+        query = df.queries['queries'][-1]
+        in_list = list(re.finditer(r'\bIN\s*\(\s*' + re.escape(_literal(placeholder)) + r'\s*\)', query, flags=re.IGNORECASE))
+        if len(in_list) != 1 or query.count(_literal(placeholder)) != 1:
+            raise ValueError(f"IN ({_literal(placeholder)}) is not in the SQL exactly once")
+        self.df = df
+        self.source = source
+        self._head, self._tail = query[:in_list[0].start()], query[in_list[0].end():]
+
+    def bind(self, values, session: Session = None) -> DataFrame:
+        # The literals are escaped like the merge statements, an empty list matches nothing like before
+        query = self._head + 'IN (' + (', '.join(_literal(i) for i in values) if values else 'NULL') + ')' + self._tail
+        plan = self.df._plan.model_copy(update={'queries': self.df._plan.queries[:-1] + [query]})
+        return type(self.df)(session or self.df._session, plan)
+
+
+def _swap_table(session: Session, df: DataFrame, target: str):
+    # Replaces the target in one commit on Iceberg and Delta Lake, readers find the old or the new table and never none
+    try:
+        session.sql(f"CREATE OR REPLACE TABLE {target} AS {df.queries['queries'][-1]}").collect()
+        return
+    except Exception as e:
+        print(f"WARNING: CREATE OR REPLACE TABLE {target} failed, renaming a staging table over it, readers find no table in between: {e}")
+
+    staging, old = f'{target}_staging', f'{target}_old'
+    session.sql(f"DROP TABLE IF EXISTS {staging}").collect()
+    df.write.save_as_table(staging)
+    if _table_columns(session, target) is not None:
+        session.sql(f"ALTER TABLE {target} RENAME TO {old}").collect()
+    session.sql(f"ALTER TABLE {staging} RENAME TO {target}").collect()
+    session.sql(f"DROP TABLE IF EXISTS {old}").collect()
+
+def _execute(session: Session, query: str) -> list:
+    return session.sql(query).collect()
+
+def _table_columns(session: Session, name: str) -> list[str] | None:
+    # Column names of a table, or None if it doesn't exist
+    try:
+        return session.table(name).columns
+    except Exception:
+        return None
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _literal(value) -> str:
+    return 'NULL' if value is None or value != value else "'" + str(value).replace("'", "''") + "'"
+
+def _number(value, sql_type: str = 'double') -> str:
+    if pd.isna(value):
+        return 'NULL'
+    return str(int(value)) if sql_type == 'integer' else repr(float(value))
 
-        self.session.sql(f"DROP TABLE IF EXISTS {env.TARGET_CATALOG}.pystarburst_360_sum.s360_summary").collect()
+def _equals(name: str, value) -> str:
+    return f'{_quote(name)} IS NULL' if value is None or value != value else f'{_quote(name)} = {_literal(value)}'
 
-        self.df_summary.write.save_as_table(
-            f"{env.TARGET_CATALOG}.pystarburst_360_sum.s360_summary",
-        )
-        new_table = self.session.table(f"{env.TARGET_CATALOG}.pystarburst_360_sum.s360_summary")
 
-        return new_table.to_pandas()
+def _is_string(t: pa.DataType) -> bool:
+    import pyarrow as pa
+    return pa.types.is_string(t) or pa.types.is_large_string(t)
 
-    def to_pyarrow(df: DataFrame) -> pa.Table:
-        return pa.deserialize_pandas(df.to_pandas())
+def _dictionary_encode(batch: pa.RecordBatch, schema: pa.Schema) -> pa.RecordBatch:
+    import pyarrow as pa
+    columns = [i.dictionary_encode() if _is_string(i.type) else i for i in batch.columns]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
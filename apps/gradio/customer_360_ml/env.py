@@ -13,10 +13,18 @@ PROPMPT_CREDS=False
 SHOW_SETTINGS=True
 
 # Web App
-PORT = 7860
-BIND_HOST = '0.0.0.0'
+PORT = int(os.environ.get("PORT", 7860))
+BIND_HOST = os.environ.get("BIND_HOST", '0.0.0.0')
 SHARE = False
 DEBUG = False
+MAX_USERS = 1000 # Browser sessions whose selection and settings are kept, the least recently used are dropped first
+USER_IDLE_TIMEOUT = 3600 # Seconds before the state of an idle browser session is evicted
+# Worker processes started by serve.py behind its load balancer on PORT, they listen on the following ports
+WORKERS = int(os.environ.get("WORKERS", 1))
+# Directory of the result and LLM context caches shared by the workers, set by serve.py. In-process caches when None
+SHARED_CACHE_DIR = os.environ.get("SHARED_CACHE_DIR")
+# Seconds the connections of a browser without the worker cookie of serve.py go to the worker last picked for its address, 0 picks the least busy one for each
+BALANCER_CLIENT_TTL = float(os.environ.get("BALANCER_CLIENT_TTL", 60))
 
 # Show Sample Code in UI
 SHOW_SAMPLE_CODE = False
@@ -25,16 +33,67 @@ SHOW_SAMPLE_CODE = False
 HOST=os.environ.get("HOST")
 USERNAME=os.environ.get("SB_USER")
 
+# Galaxy session pool, concurrent requests each check out their own warm session
+POOL_MIN_SIZE = 1 # Sessions kept open and warm
+POOL_MAX_SIZE = 4 # Further requests wait for a free session
+POOL_IDLE_TIMEOUT = 300 # Seconds before idle sessions above the minimum are closed
+POOL_HEALTH_CHECK_INTERVAL = 60 # Sessions idle for longer are checked with 'select 1' before use
+QUERY_CONCURRENCY = 4 # Independent queries of one operation running at once, each on its own pooled session, 1 runs them one by one
+
+# Instrumentation shown in the Query History tab
+METRICS_MAX_EVENTS = 10000 # Latest Data and OpenAI operations kept for the latency quantiles
+QUERY_HISTORY_MAX_ENTRIES = 1000 # Latest queries kept for the Query History tab
+QUERY_HISTORY_REFRESH_SECONDS = 5 # A background thread collects new queries this often, clients only get the history again when it changed
+
 # Galaxy Source Catalog
 SOURCE_CATALOG='sample'
 SOURCE_SCHEMA='burstbank'
 
+# Aggregated results cache, repeated segment selections are served from memory
+AGG_CACHE_TTL = 300 # Seconds a cached result or the aggregate cube is valid, 0 disables the cache
+AGG_CACHE_MAX_BYTES = 64 * 1024 * 1024 # Least recently used results are evicted above this size
+USE_AGG_CUBE = False # Query the state x risk_appetite x segment counts once and slice them locally for each selection
+# Column profiles of Data.profile, reused until an Iceberg table gets a new snapshot or for the time to live on other tables
+PROFILE_CACHE_TTL = 3600 # Seconds a cached profile is valid, 0 disables the cache
+PROFILE_CACHE_MAX_BYTES = 16 * 1024 * 1024 # Least recently used profiles are evicted above this size
+# Results streamed by Data.iter_batches and Data.export are handed out in chunks of at most this many rows and bytes
+EXPORT_BATCH_ROWS = 100_000
+EXPORT_BATCH_BYTES = 64 * 1024 * 1024
+DISPLAY_MAX_ROWS = 1000 # Rows read back for the output tables, the rest of the result is not read
+# On-disk snapshots of the segments, cube and aggregates, a restart shows them before Starburst is connected and refreshes them in the background
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR") # e.g. /var/cache/customer360, no snapshots when not set
+SNAPSHOT_MAX_AGE = 24 * 3600 # Seconds a snapshot is used after it was taken
+SNAPSHOT_MAX_BYTES = 256 * 1024 * 1024 # The oldest snapshots are deleted above this size
+
 # Target Galaxy Catalog for writing
 ENABLE_WRITE = True # Setting to False will disable the write functionality
 TARGET_CATALOG='s3lakehouse'
+# How write_agg_data updates the summary table, writes are skipped when the summary didn't change since the last one
+# 'merge' deletes and inserts only the changed rows of the selected segments, the catalog has to support DELETE (e.g. Iceberg or Delta Lake)
+# 'swap' replaces the target in one commit with CREATE OR REPLACE TABLE (Iceberg, Delta Lake), readers never find it missing, other catalogs
+# rename a staging table over it. 'replace' drops and recreates the target like before, readers find no table in between
+WRITE_MODE = 'merge'
+WRITTEN_TTL = 3600 # Seconds an unchanged summary is not written again, after that it is written anyway and repairs changes to the target made outside the app
+# Slim copy of the state, risk appetite and segment columns, segment filters and aggregations scan it instead of joining the wide source tables
+SLIM_TABLE = None # e.g. f'{TARGET_CATALOG}.pystarburst_360_sum.customer_slim', a projection-pruned join of the source tables is queried when None
+SLIM_REFRESH_SECONDS = 3600 # The slim table is rebuilt in the background after this many seconds
 
 # OpenAI Configs
 ENABLE_OPENAI = True # Setting to False will disable the OpenAI integration
 OPENAI_MODEL = "gpt-3.5-turbo-16k"
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+OPENAI_API_BASE = os.environ.get("OPENAI_API_BASE") # Default OpenAI API when not set, e.g. http://127.0.0.1:8000/v1 for benchmarks/fakeOpenAI.py
+OPENAI_N = 1 # Completions requested per question, only the first one is shown
+OPENAI_STREAM = True # Stream the response into the UI as it is generated
+OPENAI_CONTEXT_FORMAT = 'csv' # Encoding of the data in the system message: 'csv', 'tsv' or 'table' for an outlined table
+OPENAI_CONTEXT_TOP_K = None # Only the K largest rows are listed and the others are summed up per risk appetite, all rows when None
+OPENAI_CONTEXT_MAX_TOKENS = 4000 # Fewer rows are listed until the data fits in this many tokens
+OPENAI_ANSWER_CACHE_TTL = 3600 # Seconds an answer is reused for the same question about the same summary, 0 disables the answer cache
+OPENAI_ANSWER_CACHE_MAX_BYTES = 16 * 1024 * 1024 # Least recently used answers are evicted above this size
+OPENAI_ANSWER_SIMILARITY = 0.9 # Near-duplicate questions with at least this similarity (0-1) share an answer, only identical questions when None
+# Batch evaluation of many questions, e.g. nightly with evaluate.py
+OPENAI_BATCH_CONCURRENCY = 8 # Requests in flight at once
+OPENAI_BATCH_REQUESTS_PER_MINUTE = 500 # Requests are spread out to stay below the account limit, no limit when None
+OPENAI_BATCH_TOKENS_PER_MINUTE = 160000 # Prompt and max completion tokens per minute, no limit when None
+OPENAI_BATCH_RETRIES = 5 # Retries of a question rejected with 429 or failing with a 5xx error, with exponential backoff
 
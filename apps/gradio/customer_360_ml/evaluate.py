@@ -0,0 +1,63 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file asks a list of standard questions about the summary of a segment selection in one batch, e.g. nightly from cron, and appends the answers to the evaluation table.
+#
+#   python evaluate.py questions.txt --segments gold platinum --output answers.csv
+#
+# The questions file has one question per line, '-' reads them from stdin. Concurrency, rate limits and retries default to the
+# OPENAI_BATCH_* settings in env.py.
+
+import sys
+import argparse
+
+import env
+from dataModels import Data
+from mlModels import OpenAI
+
+def main():
+    parser = argparse.ArgumentParser(description='Answer a batch of questions about the customer summary')
+    parser.add_argument('questions', help="File with one question per line, '-' for stdin")
+    parser.add_argument('--segments', nargs='+', help='Customer segments of the summary, all when not set')
+    parser.add_argument('--concurrency', type=int, default=env.OPENAI_BATCH_CONCURRENCY, help='Requests in flight at once')
+    parser.add_argument('--requests-per-minute', type=float, default=env.OPENAI_BATCH_REQUESTS_PER_MINUTE, help='Request rate limit, 0 for none')
+    parser.add_argument('--tokens-per-minute', type=float, default=env.OPENAI_BATCH_TOKENS_PER_MINUTE, help='Token rate limit, 0 for none')
+    parser.add_argument('--retries', type=int, default=env.OPENAI_BATCH_RETRIES, help='Retries on 429 and 5xx errors')
+    parser.add_argument('--output', help='Also write the answers to this CSV file')
+    parser.add_argument('--no-write', action='store_true', help="Don't append the answers to the evaluation table")
+    args = parser.parse_args()
+
+    with (sys.stdin if args.questions == '-' else open(args.questions)) as f:
+        questions = [i.strip() for i in f if i.strip()]
+
+    data = Data()
+    data.get_agg_data(args.segments or data.get_unique_segs())
+    model = OpenAI(data)
+    result = model.evaluate(questions, args.concurrency, args.requests_per_minute, args.tokens_per_minute, args.retries)
+
+    if args.output:
+        result.to_csv(args.output, index=False)
+    if env.ENABLE_WRITE and not args.no_write:
+        data.write_evaluation(result)
+
+    failed = int(result['error'].notna().sum())
+    print(f"INFO: {len(result) - failed} of {len(result)} questions answered, {result['attempts'].sum() - len(result)} retries")
+    if failed:
+        print(f"WARNING: {failed} questions failed, see the error column")
+        sys.exit(1)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,127 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file runs the independent queries of one operation concurrently, so it takes about as long as its slowest query instead of the sum of all of them. Steps that need another one first, e.g. a write after the DDL creating its schema, wait for it, and the first error cancels the steps that haven't started.
+
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+
+
+class QueryExecutor():
+    '''Runs the steps of an operation on a thread pool, each as soon as the steps it depends on succeeded.
+
+    Steps run in the context of the caller, so the metrics of their queries are part of its operation. A step running queries checks
+    out its own pooled session, pystarburst sessions can't be shared between threads. Use it as a context manager, leaving the block
+    waits for the running steps, and cancels the pending ones when the block raised.
+
+    Attributes
+    ----------
+        max_workers : int
+            Steps running at the same time, the others wait in submission order
+        error : BaseException
+            First error raised by a step, None while all succeeded
+
+    Methods
+    -------
+        submit(fn, *args, after=(), **kwargs) -> Future
+            Run fn(*args, **kwargs) once every future of after succeeded, the step is cancelled when one of them failed
+        gather(*futures) -> list
+            Wait for the futures, all steps submitted when none are given, and get their results, raises the first error of any step
+        cancel()
+            Cancel the steps that haven't started
+    '''
+
+    def __init__(self, max_workers: int = 4) -> None:
+        self.max_workers = max(1, max_workers)
+        self.error = None
+
+        self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='query')
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, after = (), **kwargs) -> Future:
+        future = Future()
+        context = contextvars.copy_context()
+        with self._lock:
+            self._futures.append(future)
+            if self.error is not None:
+                future.cancel()
+
+        def run():
+            # Cancelled steps get here too, waiters only see them as done once they were notified
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = context.run(fn, *args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                self._fail(e)
+            else:
+                future.set_result(result)
+
+        after = list(after)
+        waiting = [len(after)]
+        lock = threading.Lock()
+
+        def ready(dependency: Future):
+            with lock:
+                waiting[0] -= 1
+                last = waiting[0] == 0
+            if dependency.cancelled() or dependency.exception() is not None:
+                future.cancel()
+            if last:
+                self._pool.submit(run)
+
+        if not after:
+            self._pool.submit(run)
+        for i in after:
+            i.add_done_callback(ready)
+        return future
+
+    def gather(self, *futures) -> list:
+        with self._lock:
+            futures = futures or tuple(self._futures)
+        wait(futures)
+        if self.error is not None:
+            raise self.error
+        return [i.result() for i in futures]
+
+    def cancel(self):
+        with self._lock:
+            futures = list(self._futures)
+        for i in futures:
+            i.cancel()
+
+    def _fail(self, error: BaseException):
+        with self._lock:
+            if self.error is not None:
+                return
+            self.error = error
+        # Queries already running finish, their sessions are checked in as usual
+        self.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.cancel()
+        # Steps waiting for others are only handed to the pool once those finished, it is shut down after all of them
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+        self._pool.shutdown(wait=True)
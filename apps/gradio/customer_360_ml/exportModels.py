@@ -0,0 +1,160 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file streams query results in chunks of a bounded size instead of building one data frame of the whole result. Chunks are handed out as the record batches arrive, and the sinks write them straight to Parquet or Feather, so memory stays flat however large the result is.
+
+from __future__ import annotations
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+import os
+import time
+import tempfile
+
+FORMATS = {'.parquet': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
+
+class ExportStats():
+    '''Counters of a stream of record batches, updated as they are handed out
+
+    Attributes
+    ----------
+        rows : int
+            Rows handed out so far
+        bytes : int
+            Arrow bytes of the batches handed out so far
+        batches : int
+            Batches handed out so far
+        first_row_seconds : float
+            Seconds from the start until the first rows were handed out, None before
+        seconds : float
+            Seconds from the start until the last batch was handed out
+    '''
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self.bytes = 0
+        self.batches = 0
+        self.first_row_seconds = None
+        self.seconds = 0.0
+        self._start = time.perf_counter()
+
+    def add(self, batch: pa.RecordBatch):
+        self.seconds = time.perf_counter() - self._start
+        if self.first_row_seconds is None and batch.num_rows:
+            self.first_row_seconds = self.seconds
+        self.rows += batch.num_rows
+        self.bytes += batch.nbytes
+        self.batches += 1
+
+    def to_dict(self) -> dict:
+        return {'rows': self.rows, 'bytes': self.bytes, 'batches': self.batches, 'first_row_seconds': self.first_row_seconds, 'seconds': self.seconds}
+
+
+def iter_batches(reader: pa.RecordBatchReader, rows: int = None, max_bytes: int = None, limit: int = None,
+                 stats: ExportStats = None) -> Iterator[pa.RecordBatch]:
+    '''Record batches of reader with at most rows rows and about max_bytes bytes each, handed out as soon as they are complete
+    Args:  rows: Rows per batch, the batches of the reader when neither rows nor max_bytes is given
+            max_bytes: Bytes per batch, estimated from the bytes per row of the incoming batches
+            limit: Stop after this many rows, e.g. for a display, the rest of the result is not read
+            stats: Counters updated for every batch handed out'''
+    pending, pending_rows, total = [], 0, 0
+    try:
+        for batch in reader:
+            if limit is not None:
+                batch = batch.slice(0, limit - total)
+            total += batch.num_rows
+
+            size = rows or batch.num_rows or 1
+            if max_bytes and batch.num_rows:
+                size = min(size, max(1, int(max_bytes * batch.num_rows / max(batch.nbytes, 1))))
+
+            # Slices are views, only batches made of several small ones are copied
+            offset = 0
+            while offset < batch.num_rows:
+                chunk = batch.slice(offset, max(size - pending_rows, 1))
+                offset += chunk.num_rows
+                pending.append(chunk)
+                pending_rows += chunk.num_rows
+                if pending_rows >= size:
+                    yield _emit(pending, stats)
+                    pending, pending_rows = [], 0
+
+            if limit is not None and total >= limit:
+                break
+        if pending:
+            yield _emit(pending, stats)
+    finally:
+        # Stops reading the result, e.g. when the limit was reached or the consumer stopped early
+        reader.close()
+
+def iter_pandas(reader: pa.RecordBatchReader, rows: int = None, max_bytes: int = None, limit: int = None, stats: ExportStats = None):
+    '''pandas.DataFrame chunks of reader, see iter_batches()'''
+    for batch in iter_batches(reader, rows, max_bytes, limit, stats):
+        yield batch.to_pandas(split_blocks=True)
+
+def head(reader: pa.RecordBatchReader, limit: int, stats: ExportStats = None) -> pa.Table:
+    '''The first limit rows of reader in one table, the rest of the result is not read'''
+    import pyarrow as pa
+
+    return pa.Table.from_batches(list(iter_batches(reader, limit=limit, stats=stats)), schema=reader.schema)
+
+def write_batches(reader: pa.RecordBatchReader, path: str, format: str = None, rows: int = None, max_bytes: int = None,
+                  stats: ExportStats = None) -> ExportStats:
+    '''Write the batches of reader to a Parquet or Feather file as they arrive, one Parquet row group per batch.
+    The file is written next to path and renamed over it once complete, readers never see a partial file.
+    Args:  format: 'parquet' or 'feather', from the extension of path when None
+            rows, max_bytes: Size of the batches written, see iter_batches()
+    Returns: ExportStats of the rows written'''
+    import pyarrow as pa
+
+    format = format or FORMATS.get(os.path.splitext(path)[1].lower())
+    if format not in ('parquet', 'feather'):
+        raise ValueError(f"Unknown export format for {path}, use .parquet, .feather or format='parquet' or 'feather'")
+
+    stats = stats or ExportStats()
+    # Feather files can't change the dictionary of a column between batches, its values are written instead
+    schema = pa.schema([pa.field(i.name, i.type.value_type, i.nullable) if pa.types.is_dictionary(i.type) else i for i in reader.schema]) \
+        if format == 'feather' else reader.schema
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if format == 'parquet':
+                import pyarrow.parquet as pq
+
+                with pq.ParquetWriter(f, schema) as writer:
+                    for batch in iter_batches(reader, rows, max_bytes, stats=stats):
+                        writer.write_batch(batch)
+            else:
+                with pa.ipc.new_file(f, schema, options=pa.ipc.IpcWriteOptions(compression='lz4')) as writer:
+                    for batch in iter_batches(reader, rows, max_bytes, stats=stats):
+                        writer.write_batch(batch.cast(schema) if batch.schema != schema else batch)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return stats
+
+def _emit(batches: list, stats: ExportStats = None) -> pa.RecordBatch:
+    import pyarrow as pa
+
+    batch = batches[0] if len(batches) == 1 else pa.Table.from_batches(batches).combine_chunks().to_batches()[0]
+    if stats is not None:
+        stats.add(batch)
+    return batch
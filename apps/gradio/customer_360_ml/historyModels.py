@@ -0,0 +1,116 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file holds the query history shown in the UI. A single background thread drains the pystarburst query histories of the pooled sessions into a bounded log with a version counter, clients only get the log again when the version changed.
+
+import time
+import threading
+from collections import deque
+
+import pandas as pd
+
+
+class QueryEntry():
+    '''A query sent to Starburst.'''
+    __slots__ = ('query_id', 'sql_text', 'time')
+
+    def __init__(self, query_id: str, sql_text: str) -> None:
+        self.query_id = query_id
+        self.sql_text = sql_text
+        self.time = time.time()
+
+
+class QueryLog():
+    '''Bounded log of the queries run by the sessions of a pool
+
+    Attributes
+    ----------
+        max_entries : int
+            Number of queries kept, the oldest are dropped first
+        version : int
+            Incremented whenever queries were added
+
+    Methods
+    -------
+        drain(histories) -> int
+            Move the queries recorded by pystarburst.QueryHistory objects into the log
+        snapshot() -> (int, pd.DataFrame)
+            Get the version and the queries of the log, the data frame is shared until the next change
+        since(version) -> (int, pd.DataFrame)
+            Same as snapshot(), but the data frame is None if the version didn't change
+    '''
+    COLUMNS = ['query_id', 'sql_text']
+
+    def __init__(self, max_entries: int = 1000) -> None:
+        self.max_entries = max_entries
+        self.version = 0
+
+        self._entries = deque(maxlen=max_entries)
+        self._frame = (0, pd.DataFrame(columns=self.COLUMNS))
+        self._lock = threading.Lock()
+
+    def drain(self, histories) -> int:
+        # Records are removed from the histories once copied, so they don't grow with the lifetime of the sessions
+        added = 0
+        for history in list(histories):
+            queries = history.queries
+            new = queries[:]
+            if not new:
+                continue
+            # Queries recorded meanwhile are appended after the copied ones and kept for the next drain
+            del queries[:len(new)]
+            with self._lock:
+                self._entries.extend(QueryEntry(i.query_id, i.sql_text) for i in new)
+                self.version += 1
+            added += len(new)
+        return added
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            version, frame = self._frame
+            if version != self.version:
+                frame = pd.DataFrame([(i.query_id, i.sql_text) for i in self._entries], columns=self.COLUMNS)
+                self._frame = version, frame = self.version, frame
+            return version, frame
+
+    def since(self, version: int) -> tuple:
+        if version == self.version:
+            return version, None
+        return self.snapshot()
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+def start_refresher(pools, interval: float = 5) -> threading.Thread:
+    '''Start the process-wide thread draining the histories of the pools returned by pools() into their logs every interval seconds.'''
+    global _refresher
+    with _refresher_lock:
+        if _refresher is not None:
+            return _refresher
+
+        def run():
+            while True:
+                for pool in pools():
+                    try:
+                        pool.log.drain(pool.histories)
+                    except Exception as e:
+                        print(f"WARNING: Query history refresh failed: {e}")
+                time.sleep(interval)
+
+        _refresher = threading.Thread(target=run, name='query-history', daemon=True)
+        _refresher.start()
+        return _refresher
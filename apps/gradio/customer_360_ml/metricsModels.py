@@ -0,0 +1,260 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file holds the instrumentation of the Data and ML wrappers. Every operation records its wall time, time to first row, rows and bytes returned, client-side conversion time and cache use, together with the UI event that triggered it, so slow interactions can be traced to the cluster, the network or pandas.
+
+import copy
+import json
+import time
+import inspect
+import functools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+import env
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Seconds fields of an operation, all of them get latency quantiles
+TIMINGS = ('wall_seconds', 'first_row_seconds', 'query_seconds', 'convert_seconds')
+# Fields summed up when nested operations add to the one they run in
+TOTALS = ('query_seconds', 'convert_seconds', 'rows', 'bytes', 'queries')
+
+_current = contextvars.ContextVar('metrics_operation', default=None)
+_event = contextvars.ContextVar('metrics_event', default=None)
+
+
+class Metrics():
+    '''Bounded ring buffer of instrumented operations with latency quantiles and JSON and Prometheus export
+
+    Attributes
+    ----------
+        max_events : int
+            Number of operations kept, the oldest are dropped first
+        recorded : int
+            Number of operations recorded since start
+        totals : dict
+            Operations, errors, rows, bytes, queries, seconds and cache lookups per source since start, per operation and UI event
+
+    Methods
+    -------
+        measure(operation, **fields)
+            Context manager recording an operation, yields its record so fields can be set while it runs
+        span(operation)
+            Same as measure() unless an operation is already running in this context, which the fields are added to instead
+        record(operation, **fields)
+            Record a finished operation, e.g. one spanning the steps of a generator
+        measured(operation)
+            Decorator measuring every call of a function as an operation
+        add(**fields)
+            Add to the operation running in this context, e.g. rows read by a helper
+        event(name)
+            Decorator naming the UI event for everything a handler runs
+        events() -> list(dict)
+            Get the recorded operations, oldest first
+        summary() -> pd.DataFrame
+            Get count, quantiles, rows, bytes and cache hit ratio of the kept operations per operation and UI event
+        to_json() -> str
+            Export the summary and the recorded operations as JSON
+        to_prometheus(prefix) -> str
+            Export the totals since start and the quantiles of the kept operations in the Prometheus text format
+    '''
+
+    def __init__(self, max_events: int = 10000) -> None:
+        self.max_events = max_events
+        self.recorded = 0
+        self.totals = dict()
+
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, operation: str, **fields):
+        record = {'operation': operation, 'event': _event.get(), 'time': time.time(), 'first_row_seconds': None, 'cache': None, 'error': None, **fields}
+        token = _current.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            record['wall_seconds'] = time.perf_counter() - start
+            self._append(record)
+
+    def span(self, operation: str):
+        return nullcontext(_current.get()) if _current.get() is not None else self.measure(operation)
+
+    def record(self, operation: str, wall_seconds: float, **fields):
+        self._append({'operation': operation, 'event': _event.get(), 'time': time.time(), 'first_row_seconds': None, 'cache': None, 'error': None,
+                      'wall_seconds': wall_seconds, **fields})
+
+    def measured(self, operation: str):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.measure(operation):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _append(self, record: dict):
+        with self._lock:
+            self._events.append(record)
+            self.recorded += 1
+            self._count(record)
+        if env.DEBUG: print(f"INFO: Metrics {record}")
+
+    def _count(self, record: dict):
+        # Counters and sums only ever grow, the ring buffer drops the oldest operations and would make them go down
+        totals = self.totals.get((record['operation'], record['event'] or ''))
+        if totals is None:
+            totals = self.totals[(record['operation'], record['event'] or '')] = {'operations': 0, 'errors': 0, 'rows': 0, 'bytes': 0, 'queries': 0,
+                                                                                   'seconds': {i: [0.0, 0] for i in TIMINGS}, 'cache': dict()}
+        totals['operations'] += 1
+        totals['errors'] += record['error'] is not None
+        for total in ('rows', 'bytes', 'queries'):
+            totals[total] += record.get(total) or 0
+        for timing in TIMINGS:
+            if record.get(timing) is not None:
+                totals['seconds'][timing][0] += record[timing]
+                totals['seconds'][timing][1] += 1
+        if record['cache'] is not None:
+            totals['cache'][record['cache']] = totals['cache'].get(record['cache'], 0) + 1
+
+    def add(self, **fields):
+        '''Add to the operation running in this context, totals are summed and the first time to first row is kept.'''
+        record = _current.get()
+        if record is None:
+            return
+        with self._lock:
+            for key, value in fields.items():
+                if key in TOTALS:
+                    record[key] = record.get(key, 0) + value
+                elif key == 'first_row_seconds':
+                    if record[key] is None:
+                        record[key] = value
+                else:
+                    record[key] = value
+
+    def event(self, name: str):
+        '''Decorator for UI event handlers, operations run by the handler are tagged with the event name.'''
+        def decorator(fn):
+            if inspect.isgeneratorfunction(fn):
+                # Streaming handlers are resumed by Gradio from different threads, the event is set around every step
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    generator = fn(*args, **kwargs)
+                    try:
+                        while True:
+                            token = _event.set(name)
+                            try:
+                                value = next(generator)
+                            except StopIteration:
+                                return
+                            finally:
+                                _event.reset(token)
+                            yield value
+                    finally:
+                        generator.close()
+            else:
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    token = _event.set(name)
+                    try:
+                        return fn(*args, **kwargs)
+                    finally:
+                        _event.reset(token)
+            return wrapper
+        return decorator
+
+    def events(self) -> list:
+        with self._lock:
+            return [dict(i) for i in self._events]
+
+    def summary(self) -> pd.DataFrame:
+        rows = []
+        for (operation, event), group in self._groups():
+            row = {'operation': operation, 'event': event, 'count': len(group), 'errors': int(group['error'].notna().sum())}
+            for timing in TIMINGS:
+                values = group[timing].dropna()
+                for q in QUANTILES:
+                    row[_quantile_column(timing, q)] = 1000 * values.quantile(q) if len(values) else None
+            for total in ('rows', 'bytes', 'queries'):
+                row[total] = int(group[total].sum())
+            # Results from the cube and the snapshots are hits as well, only a miss queries Starburst or OpenAI
+            cache = group['cache'].dropna()
+            row['cache_hit_ratio'] = (cache != 'miss').mean() if len(cache) else None
+            rows.append(row)
+        return pd.DataFrame(rows, columns=['operation', 'event', 'count', 'errors'] + [_quantile_column(t, q) for t in TIMINGS for q in QUANTILES] +
+                            ['rows', 'bytes', 'queries', 'cache_hit_ratio'])
+
+    def to_json(self) -> str:
+        summary = self.summary().astype(object)
+        return json.dumps({'summary': summary.where(summary.notna(), None).to_dict('records'), 'events': self.events()}, indent=2, default=str)
+
+    def to_prometheus(self, prefix: str = 'customer360') -> str:
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append(f'# HELP {prefix}_{name} {help}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            lines.extend(f'{prefix}_{name}{suffix}{{{_labels(labels)}}} {value}' for suffix, labels, value in samples)
+
+        # Quantiles are of the operations kept in the ring buffer, sums, counts and counters of all operations since start
+        groups = {key: group for key, group in self._groups()}
+        with self._lock:
+            totals = sorted((key, copy.deepcopy(value)) for key, value in self.totals.items())
+        for timing in TIMINGS:
+            samples = []
+            for (operation, event), total in totals:
+                labels = {'operation': operation, 'event': event}
+                values = groups[(operation, event)][timing].dropna() if (operation, event) in groups else ()
+                samples += [('', {**labels, 'quantile': str(q)}, values.quantile(q)) for q in QUANTILES if len(values)]
+                samples += [('_sum', labels, total['seconds'][timing][0]), ('_count', labels, total['seconds'][timing][1])]
+            metric(timing, 'summary', f"{timing.removesuffix('_seconds').replace('_', ' ').capitalize()} time of the recorded operations in seconds", samples)
+
+        for name, help, total in (('operations_total', 'Recorded operations', 'operations'), ('errors_total', 'Operations that failed', 'errors'),
+                                  ('rows_total', 'Rows returned', 'rows'), ('bytes_total', 'Bytes returned', 'bytes'),
+                                  ('queries_total', 'Requests sent to Starburst or OpenAI', 'queries')):
+            metric(name, 'counter', help, [('', {'operation': operation, 'event': event}, value[total]) for (operation, event), value in totals])
+        metric('cache_lookups_total', 'counter', 'Cache lookups by result, a hit, the cube, a snapshot or a miss',
+               [('', {'operation': operation, 'event': event, 'cache': cache}, count) for (operation, event), value in totals for cache, count in sorted(value['cache'].items())])
+        return '\n'.join(lines) + '\n'
+
+    def _groups(self):
+        # Recorded operations per operation and UI event
+        events = pd.DataFrame(self.events(), columns=list(dict.fromkeys(['operation', 'event', 'error', 'cache', *TIMINGS, *TOTALS])))
+        events['event'] = events['event'].fillna('')
+        events[['rows', 'bytes', 'queries']] = events[['rows', 'bytes', 'queries']].fillna(0)
+        events[list(TIMINGS)] = events[list(TIMINGS)].astype(float)
+        return events.groupby(['operation', 'event'], sort=True)
+
+
+def _quantile_column(timing: str, q: float) -> str:
+    return f"{timing.removesuffix('_seconds')}_p{int(q * 100)}_ms"
+
+def _labels(labels: dict) -> str:
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{k}="{escape(v)}"' for k, v in labels.items())
+
+
+# Shared by all Data and OpenAI instances of the process
+metrics = Metrics(env.METRICS_MAX_EVENTS)
@@ -14,17 +14,25 @@ See the License for the specific language governing permissions and
 limitations under the License.
 '''
 
-import openai
-
 import env
 
-from dataModels import Data
+from dataModels import Data, SUMMARY_KEYS, EVALUATION_COLUMNS
+from cacheModels import content_hash, get_cache
+from metricsModels import metrics
+from batchModels import TokenBucket, with_retries, error_message
 
 import pandas as pd
 pd.options.plotting.backend = "plotly"
 
 import env
 
+import re
+import copy
+import math
+import time
+import asyncio
+from collections import deque, Counter
+
 from tabulate import tabulate
 
 class OpenAI():
@@ -39,17 +47,57 @@ class OpenAI():
             Data class for the model
         system_message : str
             System message for OpenAI chatbot
+        models : list(str)
+            Available OpenAI models, loaded by get_models() on first use
+        api_base : str
+            OpenAI API URL, the default one when None
+        n : int
+            Number of completions requested per question, only the first one is shown
+        stream : bool
+            Stream the response as it is generated
+        timings : deque(dict)
+            Time to first token, total time, number of chunks and prompt tokens of the latest requests
+        context_format : str
+            Encoding of the data in the system message, 'csv', 'tsv' or 'table'
+        context_top_k : int
+            Number of rows listed in the system message, the others are summed up, all when None
+        context_max_tokens : int
+            Token budget of the data in the system message
+        context_cache : cacheModels.ResultCache
+            System messages keyed by the content of the summary and the context settings, a cacheModels.SharedCache with several workers
+        answer_cache : cacheModels.ResultCache
+            Answers keyed by the normalized question and the same key as the system message, so they are not reused once the summary changed
+        answer_similarity : float
+            Near-duplicate questions with at least this trigram similarity share an answer, only the same normalized question when None
         
     Methods
     -------
         get_models()
-            Get list of OpenAI models
+            Get list of OpenAI models, cached after the first call
+        for_user(data_class) -> OpenAI
+            Get an OpenAI for a browser session, sharing the context cache and model list
         save_settings(api_key, model)
             Save settings for the session.
         set_system_message()
-            Set system message for OpenAI chatbot.
+            Set system message for OpenAI chatbot, rebuilt only when the summary changed
+        build_system_message(summary) -> (str, int)
+            Render the system message for a summary and count its tokens
         predict(message, system_message = None)
-            Predict response from OpenAI chatbot from the supplied question'''
+            Predict response from OpenAI chatbot from the supplied question, yields the partial response while streaming
+        cached_answer(message) -> str
+            Get the answer to the same or a near-duplicate question about the current summary, or None
+        cache_answer(message, answer)
+            Keep the answer to a question about the current summary
+        complete(message, system_message = None) -> str
+            Get the full response from OpenAI chatbot in one request
+        create(message, system_message = None, stream = False)
+            Send the question to the chat completions API
+        request(message, stream = False) -> dict
+            Get the arguments of a chat completions request
+        evaluate(questions, concurrency = None, requests_per_minute = None, tokens_per_minute = None, retries = None) -> pd.DataFrame
+            Answer a batch of questions concurrently within the rate limits, retrying 429 and 5xx errors
+        aevaluate(questions, ...) -> pd.DataFrame
+            Same as evaluate() in a running event loop'''
 
     def __init__(self, data_class: Data, model = None, api_key = None) -> None:
         '''Initialize OpenAI class with data class and model name
@@ -62,8 +110,6 @@ class OpenAI():
         else:
             self.api_key = env.OPENAI_API_KEY
         
-        openai.api_key = self.api_key
-        
         if model is None:
             self.model = env.OPENAI_MODEL
         else:
@@ -71,14 +117,49 @@ class OpenAI():
     
         self.data_class = data_class
 
-        self.models = self.get_models()
+        # Listing the models is a network call, it is deferred until the settings are opened
+        self.models = None
+
+        self.api_base = env.OPENAI_API_BASE
+        self.n = env.OPENAI_N
+        self.stream = env.OPENAI_STREAM
+        self.timings = deque(maxlen=1024)
+
+        self.context_format = env.OPENAI_CONTEXT_FORMAT
+        self.context_top_k = env.OPENAI_CONTEXT_TOP_K
+        self.context_max_tokens = env.OPENAI_CONTEXT_MAX_TOKENS
+        self.context_cache = get_cache('context', ttl=24 * 3600, max_bytes=4 * 1024 * 1024)
+        self.answer_cache = get_cache('answers', ttl=env.OPENAI_ANSWER_CACHE_TTL, max_bytes=env.OPENAI_ANSWER_CACHE_MAX_BYTES)
+        self.answer_similarity = env.OPENAI_ANSWER_SIMILARITY
+        self.system_message = None
+        self.context_tokens = 0
+        self._summary = None
+        self._fingerprint = None
+        self._categories = frozenset()
+        self._context = None
 
     def get_models(self):
-        '''Get list of OpenAI models'''
-        models_raw = openai.Model.list(self.api_key)
-        models = [i['id'] for i in models_raw['data']]
-        if env.DEBUG: print(f'Available models: {models}')
-        return models
+        '''Get list of OpenAI models, cached after the first call'''
+        if self.models is None:
+            import openai
+
+            models_raw = openai.Model.list(self.api_key, api_base=self.api_base)
+            self.models = [i['id'] for i in models_raw['data']]
+            if env.DEBUG: print(f'Available models: {self.models}')
+        return self.models
+
+    def for_user(self, data_class: Data) -> 'OpenAI':
+        '''Get an OpenAI for a browser session with its own settings and system message, rendered messages and answers are shared through the caches.
+        Args:  data_class : dataModels.Data of the same browser session'''
+        user = copy.copy(self)
+        user.data_class = data_class
+        user.system_message = None
+        user.context_tokens = 0
+        user._summary = None
+        user._fingerprint = None
+        user._categories = frozenset()
+        user._context = None
+        return user
 
     def save_settings(self, api_key: str, model: str):
         '''Save settings for the session.
@@ -86,22 +167,158 @@ class OpenAI():
                 model: OpenAI model name'''
         self.api_key = api_key
         self.model = model
+        self.models = None
 
+    @metrics.measured('set_system_message')
     def set_system_message(self):
-        '''Set system message for OpenAI chatbot withe appropiate data inlcuded.'''
-        
-        message_data_type = 'table'
-        message_data = tabulate(self.data_class.df_summary.to_pandas().rename(columns={'state': 'State', 'risk_appetite': 'Risk_Appetite', 'count': 'Count_of_Customers'}), headers='keys', tablefmt='outline', showindex=False)
-        
-        self.system_message = f'''You are an AI assistant who's purpose is to provide information on structured data. Please be as accurate as possible in any calculations.
-                                The data formated as {message_data_type} is: 
-                                {message_data}"'''
+        '''Set system message for OpenAI chatbot with the latest aggregated data included, only rebuilt when the data changed.'''
+
+        # The summary shown in the UI is reused instead of querying it again, identical results share one message
+        summary = self.data_class.get_summary()
+        if summary is not self._summary:
+            self._summary, self._fingerprint = summary, content_hash(summary, SUMMARY_KEYS)
+            self._categories = category_words(summary, self.data_class.segments)
+
+        self._context = key = (self._fingerprint, self.context_format, self.context_top_k, self.context_max_tokens, self.model)
+        context = self.context_cache.get(key)
+        metrics.add(cache='miss' if context is None else 'hit')
+        if context is None:
+            context = self.context_cache.put(key, self.build_system_message(summary))
+        self.system_message, self.context_tokens = context
+
+    def build_system_message(self, summary: pd.DataFrame) -> tuple:
+        '''Render the system message for a summary within the token budget
+        Args:  summary: Aggregated customer data
+        Returns: (system message, number of tokens)'''
+
+        header = '''You are an AI assistant who's purpose is to provide information on structured data. Please be as accurate as possible in any calculations.
+The data formated as {} is:
+{}'''
+        name = {'csv': 'CSV', 'tsv': 'TSV'}.get(self.context_format, 'table')
+        df = summary.rename(columns=CONTEXT_COLUMNS)[list(CONTEXT_COLUMNS.values())].astype({'State': str, 'Risk_Appetite': str})
+        df = df.sort_values('Count_of_Customers', ascending=False, kind='stable')
+
+        def render(k):
+            data = render_context(roll_up(df, k), self.context_format)
+            if k < len(df):
+                data += '\nRows with a State of other (N) sum up the customers of N more states with that risk appetite.'
+            message = header.format(name, data)
+            return message, count_tokens(message, self.model)
+
+        # Largest number of rows that fits in the budget
+        low, high = 0, len(df) if self.context_top_k is None else min(self.context_top_k, len(df))
+        best = render(high)
+        if self.context_max_tokens is None or best[1] <= self.context_max_tokens:
+            return best
+        while low < high:
+            k = (low + high + 1) // 2
+            message = render(k)
+            if message[1] <= self.context_max_tokens:
+                low, best = k, message
+            else:
+                high = k - 1
+        return best if low else render(0)
 
     def predict(self, message, system_message = None):
-        '''Predict response from OpenAI chatbot from the supplied question
+        '''Predict response from OpenAI chatbot from the supplied question, yields the response so far as chunks arrive
         Args:  message: Question to ask the OpenAI chatbot
                 system_message = None: System message for OpenAI chatbot'''
-        
+
+        start = time.perf_counter()
+        answer = self.cached_answer(message)
+        if answer is not None:
+            elapsed = time.perf_counter() - start
+            self.timings.append({'model': self.model, 'n': self.n, 'stream': self.stream, 'ttft_seconds': elapsed, 'total_seconds': elapsed,
+                                 'chunks': 1, 'prompt_tokens': 0})
+            metrics.record('predict', elapsed, first_row_seconds=elapsed, rows=1, bytes=len(answer.encode()), queries=0, prompt_tokens=0, cache='hit')
+            yield answer + "\n\n"
+            return
+
+        if not self.stream:
+            response = self.complete(message, system_message)
+            self.cache_answer(message, response.strip())
+            yield response
+            return
+
+        start = time.perf_counter()
+        first = None
+        chunks = 0
+        response = ''
+        completion = self.create(message, system_message, stream=True)
+        prompt_tokens = self.context_tokens + count_tokens(message, self.model)
+        for chunk in completion:
+            # With n > 1 the chunks of all completions are interleaved, only the first one is shown
+            for choice in chunk.choices:
+                content = choice.delta.get('content') if choice.index == 0 else None
+                if content:
+                    if first is None:
+                        first = time.perf_counter() - start
+                        if env.DEBUG: print(f"INFO: OpenAI time to first token {first:.3f}s")
+                    chunks += 1
+                    response += content
+                    yield response
+
+        self.timings.append({'model': self.model, 'n': self.n, 'stream': True, 'ttft_seconds': first,
+                             'total_seconds': time.perf_counter() - start, 'chunks': chunks, 'prompt_tokens': prompt_tokens})
+        metrics.record('predict', time.perf_counter() - start, first_row_seconds=first, query_seconds=time.perf_counter() - start,
+                       rows=chunks, bytes=len(response.encode()), queries=1, prompt_tokens=prompt_tokens, cache='miss')
+        self.cache_answer(message, response.strip())
+        if env.DEBUG: print(response)
+        yield response + "\n\n"
+
+    def cached_answer(self, message) -> str | None:
+        '''Get the answer to the same question about the current summary, or with answer_similarity to a near-duplicate one, or None
+        Args:  message: Question to ask the OpenAI chatbot'''
+        if not self.answer_cache.enabled:
+            return None
+
+        # The key of the system message changes with the summary, answers about older data are never found
+        self.set_system_message()
+        question = normalize_question(message)
+        answer = self.answer_cache.get(('answer', self._context, question))
+        if answer is None and self.answer_similarity is not None:
+            match = nearest_question(question, self.answer_cache.get(('questions', self._context)) or (), self.answer_similarity, self._categories)
+            if match is not None:
+                if env.DEBUG: print(f"INFO: Answering '{question}' like '{match}'")
+                answer = self.answer_cache.get(('answer', self._context, match))
+        return answer
+
+    def cache_answer(self, message, answer: str):
+        '''Keep the answer to a question about the current summary
+        Args:  message: Question asked
+                answer: Answer of the OpenAI chatbot'''
+        if not self.answer_cache.enabled or self._context is None:
+            return
+
+        question = normalize_question(message)
+        self.answer_cache.put(('answer', self._context, question), answer)
+        # Candidates for near-duplicate questions about the same data, the most recent ones
+        if self.answer_similarity is not None:
+            questions = self.answer_cache.get(('questions', self._context)) or ()
+            if question not in questions:
+                self.answer_cache.put(('questions', self._context), (questions + (question,))[-MAX_SIMILAR_QUESTIONS:])
+
+    def complete(self, message, system_message = None) -> str:
+        '''Get the full response from OpenAI chatbot from the supplied question
+        Args:  message: Question to ask the OpenAI chatbot
+                system_message = None: System message for OpenAI chatbot'''
+
+        start = time.perf_counter()
+        response = self.create(message, system_message)
+        responses = [i.message.content + "\n\n" for i in response.choices]
+        elapsed = time.perf_counter() - start
+
+        # Nothing is shown before the whole response arrived
+        prompt_tokens = self.context_tokens + count_tokens(message, self.model)
+        self.timings.append({'model': self.model, 'n': self.n, 'stream': False, 'ttft_seconds': elapsed, 'total_seconds': elapsed, 'chunks': 1,
+                             'prompt_tokens': prompt_tokens})
+        metrics.record('predict', elapsed, first_row_seconds=elapsed, query_seconds=elapsed, rows=1, bytes=len(responses[0].encode()),
+                       queries=1, prompt_tokens=prompt_tokens)
+        if env.DEBUG: print(responses)
+        return responses[0]
+
+    def create(self, message, system_message = None, stream = False):
+        '''Send the question with the system message to the chat completions API'''
         if system_message is None:
             system_message = self.set_system_message()
         
@@ -110,7 +327,15 @@ class OpenAI():
         
         if env.DEBUG: print(self.system_message)
 
-        response = openai.ChatCompletion.create(
+        import openai
+
+        return openai.ChatCompletion.create(**self.request(message, stream))
+
+    def request(self, message, stream = False) -> dict:
+        '''Arguments of the chat completions request for a question with the current system message'''
+        return dict(
+            api_key=self.api_key,
+            api_base=self.api_base,
             model=self.model,
             messages=[
                 {
@@ -123,13 +348,170 @@ class OpenAI():
                 }
             ],
             temperature=1,
-            max_tokens=2048,
+            max_tokens=MAX_TOKENS,
             top_p=1,
             frequency_penalty=0,
             presence_penalty=0,
-            n = 3
+            n = self.n,
+            stream = stream
         )
-        responses = [i.message.content + "\n\n" for i in response.choices]
-        if env.DEBUG: print(responses)
-        return responses[0]
-    
\ No newline at end of file
+
+    def evaluate(self, questions, concurrency = None, requests_per_minute = None, tokens_per_minute = None, retries = None) -> pd.DataFrame:
+        '''Answer a list of questions about the current summary, see aevaluate(). Not for use inside a running event loop.'''
+        return asyncio.run(self.aevaluate(questions, concurrency, requests_per_minute, tokens_per_minute, retries))
+
+    async def aevaluate(self, questions, concurrency = None, requests_per_minute = None, tokens_per_minute = None, retries = None) -> pd.DataFrame:
+        '''Answer a list of questions about the current summary concurrently, all sharing one system message
+        Args:  questions: Questions to ask the OpenAI chatbot
+                concurrency = env.OPENAI_BATCH_CONCURRENCY: Requests in flight at once
+                requests_per_minute = env.OPENAI_BATCH_REQUESTS_PER_MINUTE: Request rate limit, none when None
+                tokens_per_minute = env.OPENAI_BATCH_TOKENS_PER_MINUTE: Token rate limit counting the prompt and max_tokens, none when None
+                retries = env.OPENAI_BATCH_RETRIES: Retries of a question on 429 and 5xx errors
+        Returns: One row per question with its answer or error, see dataModels.EVALUATION_COLUMNS'''
+        import aiohttp
+        import openai
+
+        concurrency = concurrency or env.OPENAI_BATCH_CONCURRENCY
+        requests_per_minute = requests_per_minute if requests_per_minute is not None else env.OPENAI_BATCH_REQUESTS_PER_MINUTE
+        tokens_per_minute = tokens_per_minute if tokens_per_minute is not None else env.OPENAI_BATCH_TOKENS_PER_MINUTE
+        retries = retries if retries is not None else env.OPENAI_BATCH_RETRIES
+
+        # Rendered once for the whole batch, or taken from the context cache
+        await asyncio.to_thread(self.set_system_message)
+        segments = ','.join(sorted(set(self.data_class.summary_segments or self.data_class.segments or [])))
+
+        # Bursts of at most a second of the rate, the API enforces its per minute limits over shorter windows too
+        request_bucket = TokenBucket(requests_per_minute / 60, max(1, min(concurrency, requests_per_minute / 60))) if requests_per_minute else TokenBucket()
+        token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 6) if tokens_per_minute else TokenBucket()
+        slots = asyncio.Semaphore(concurrency)
+        retried = 0
+
+        def on_retry(error, delay):
+            nonlocal retried
+            retried += 1
+            # A rate limit applies to the whole account, all requests wait, not only the rejected one
+            if isinstance(error, openai.error.RateLimitError):
+                request_bucket.pause(delay)
+            if env.DEBUG: print(f"INFO: Retrying an OpenAI request in {delay:.2f}s: {error}")
+
+        async def ask(question):
+            prompt_tokens = self.context_tokens + count_tokens(question, self.model)
+
+            async def attempt():
+                # Retries count against the limits like first attempts, a burst of failures is not retried above the rate
+                await request_bucket.acquire()
+                await token_bucket.acquire(prompt_tokens + self.n * MAX_TOKENS)
+                return await openai.ChatCompletion.acreate(**self.request(question))
+
+            async with slots:
+                start = time.perf_counter()
+                row = {'question': question, 'answer': None, 'error': None, 'attempts': 1, 'prompt_tokens': prompt_tokens, 'completion_tokens': None}
+                try:
+                    response, row['attempts'] = await with_retries(attempt, retries, on_retry=on_retry)
+                    row['answer'] = response.choices[0].message.content
+                    row['completion_tokens'] = response.get('usage', {}).get('completion_tokens')
+                except Exception as e:
+                    row['error'], row['attempts'] = error_message(e), getattr(e, 'attempts', 1)
+                row['seconds'] = time.perf_counter() - start
+            return row
+
+        start = time.perf_counter()
+        # One connection pool for the batch instead of a new one per request
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+            token = openai.aiosession.set(session)
+            try:
+                rows = await asyncio.gather(*(ask(i) for i in questions))
+            finally:
+                openai.aiosession.reset(token)
+        elapsed = time.perf_counter() - start
+
+        result = pd.DataFrame(rows, columns=[i for i in EVALUATION_COLUMNS if i not in ('model', 'segments', 'asked_at')])
+        result['model'], result['segments'], result['asked_at'] = self.model, segments, pd.Timestamp.now(tz='UTC').floor('s').isoformat()
+        result = result[list(EVALUATION_COLUMNS)].astype({'completion_tokens': 'Int64'})
+
+        failed = int(result['error'].notna().sum())
+        metrics.record('evaluate', elapsed, rows=len(result), queries=len(result) + retried, bytes=int(result['answer'].fillna('').str.len().sum()),
+                       prompt_tokens=int(result['prompt_tokens'].sum()), error=f'{failed} of {len(result)} questions failed' if failed else None)
+        if env.DEBUG: print(f"INFO: Evaluated {len(result)} questions in {elapsed:.1f}s, {retried} retries, {failed} failed")
+        return result
+
+
+MAX_TOKENS = 2048 # Completion tokens requested per answer, also counted against the tokens per minute limit
+
+# Questions of a summary compared with a new one for a near-duplicate
+MAX_SIMILAR_QUESTIONS = 256
+# Ignored when comparing questions
+STOP_WORDS = frozenset(('a', 'an', 'the', 'of', 'in', 'on', 'for', 'to', 'is', 'are', 'was', 'were', 'be', 'do', 'does', 'did', 'what', 'which', 'who',
+                        'how', 'me', 'please', 'show', 'tell', 'with', 'and', 'by', 'there', 'that', 'this', 'have', 'has'))
+
+# Words turning a question into its opposite, they must be the same in near-duplicate questions
+NEGATIONS = frozenset(('not', 'no', 'never', 'without', 'except', 'nor', 'none', 'cannot'))
+# Words selecting or ranking the data, they must be the same in near-duplicate questions too, like the categories of the data
+QUALIFIERS = frozenset(('most', 'least', 'very', 'top', 'bottom', 'highest', 'lowest', 'high', 'low', 'medium', 'more', 'less', 'fewer', 'fewest',
+                        'largest', 'smallest', 'biggest', 'greatest', 'above', 'below', 'over', 'under', 'only', 'average', 'total', 'all', 'each', 'per'))
+
+CONTEXT_COLUMNS = {'state': 'State', 'risk_appetite': 'Risk_Appetite', 'count': 'Count_of_Customers'}
+
+def roll_up(df: pd.DataFrame, k: int) -> pd.DataFrame:
+    '''Keep the first k rows and sum up the others per risk appetite'''
+    if k >= len(df):
+        return df
+    tail = df.iloc[k:].groupby('Risk_Appetite', sort=False).agg(states=('State', 'nunique'), Count_of_Customers=('Count_of_Customers', 'sum')).reset_index()
+    tail.insert(0, 'State', [f'other ({i})' for i in tail.pop('states')])
+    return pd.concat([df.iloc[:k], tail.sort_values('Count_of_Customers', ascending=False)], ignore_index=True)
+
+def render_context(df: pd.DataFrame, fmt: str = 'csv') -> str:
+    '''Render the summary as CSV, TSV or an outlined table'''
+    if fmt == 'csv':
+        return df.to_csv(index=False).strip()
+    if fmt == 'tsv':
+        return df.to_csv(index=False, sep='\t').strip()
+    return tabulate(df, headers='keys', tablefmt='outline', showindex=False)
+
+def count_tokens(text: str, model: str = None) -> int:
+    '''Count the tokens of a text with tiktoken if it's installed, otherwise estimate them at 4 characters per token'''
+    try:
+        import tiktoken
+    except ImportError:
+        return -(-len(text) // 4)
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding('cl100k_base')
+    return len(encoding.encode(text))
+
+def normalize_question(text: str) -> str:
+    '''Lower case words of a question without punctuation'''
+    return ' '.join(re.findall(r'\w+', text.lower()))
+
+def category_words(summary: pd.DataFrame, segments = ()) -> frozenset:
+    '''Normalized words of the states, risk appetites and segments of a summary, e.g. "very" and "low" of very_low'''
+    values = [str(i) for k in SUMMARY_KEYS for i in summary[k].unique()] + [str(i) for i in segments or ()]
+    return frozenset(normalize_question(' '.join(values).replace('_', ' ')).split())
+
+def nearest_question(question: str, questions, threshold: float = 0.9, categories = frozenset()) -> str | None:
+    '''Most similar of the normalized questions by the cosine similarity of their character trigrams without stop words, if at least threshold.
+    Questions with different numbers, negations, qualifiers or category words are never similar, "top 5" and "top 10", "why" and "why not",
+    "most gold customers" and "gold customers" or "low" and "very low" need different answers.'''
+    def grams(q):
+        text = f" {' '.join(i for i in q.split() if i not in STOP_WORDS)} "
+        return Counter(text[i:i + 3] for i in range(len(text) - 2))
+
+    def selection(q):
+        # Numbers, negations and the qualifier and category words, "don't" is normalized to "don t"
+        words = q.split()
+        return ([i for i in words if i.isdigit()],
+                sorted([i for i in words if i in NEGATIONS] + ['not' for a, b in zip(words, words[1:]) if b == 't' and a.endswith('n')]),
+                sorted(i for i in words if i in QUALIFIERS or i in categories))
+
+    vector, selected = grams(question), selection(question)
+    norm = math.sqrt(sum(i * i for i in vector.values()))
+    best, match = threshold, None
+    for other in questions:
+        if selection(other) != selected:
+            continue
+        candidate = grams(other)
+        similarity = sum(n * candidate[k] for k, n in vector.items()) / ((norm * math.sqrt(sum(i * i for i in candidate.values()))) or 1)
+        if similarity >= best:
+            best, match = similarity, other
+    return match
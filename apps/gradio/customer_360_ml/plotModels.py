@@ -0,0 +1,63 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file turns aggregated results into the payload of the Gradio plots. It is built from the NumPy arrays of the columns instead of a JSON round trip of the data frame, sorted so the same data always gives the same payload, and with a digest so a browser that already shows the data is sent nothing.
+
+import hashlib
+
+import orjson
+import numpy as np
+import pandas as pd
+
+
+def plot_data(df: pd.DataFrame, x: str, y: str, color: str = None, mark: str = 'bar') -> dict:
+    '''Payload of a gr.BarPlot, or another native plot, for an aggregated result, as returned by its postprocess()
+    Args:  df: One row per x and color with the value in y
+            x: Column on the x axis, e.g. state
+            y: Quantitative column, e.g. count
+            color: Column of the stacked bars, e.g. risk_appetite
+            mark: Mark of the plot component, 'bar' for gr.BarPlot
+    Returns: dict with columns, data, datatypes and mark, the rows sorted by x and color'''
+    keys = [x] + ([color] if color else [])
+    labels = [_labels(df[i]) for i in keys]
+    values = df[y].to_numpy()
+    if np.issubdtype(values.dtype, np.integer):
+        values = values.astype(np.int64, copy=False)
+
+    # Sorted by the labels, last key first for lexsort
+    order = np.lexsort([i.astype(str) for i in reversed(labels)])
+    columns = [i[order].tolist() for i in labels] + [values[order].tolist()]
+
+    return {
+        'columns': keys + [y],
+        'data': [list(i) for i in zip(*columns)],
+        'datatypes': {**{i: 'nominal' for i in keys}, y: 'quantitative'},
+        'mark': mark,
+    }
+
+def plot_digest(payload: dict) -> str:
+    '''Digest of a plot payload, equal for equal data'''
+    # orjson comes with Gradio and serializes the rows about ten times faster than repr or json
+    return hashlib.sha256(orjson.dumps((payload['columns'], payload['data']))).hexdigest()
+
+def _labels(series: pd.Series) -> np.ndarray:
+    # Categorical columns are looked up from their codes, missing labels stay None
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        labels = series.cat.categories.to_numpy(dtype=object)[codes]
+        labels[codes < 0] = None
+        return labels
+    return series.to_numpy(dtype=object)
@@ -0,0 +1,278 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file holds a pool of Starburst sessions. A pystarburst.Session is not thread-safe and expensive to create (TLS, authentication and a version check), so concurrent Gradio workers each check out their own warm session instead of sharing one.
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import env
+
+from historyModels import QueryLog
+
+
+class PooledSession():
+    '''A session owned by the pool with its bookkeeping.'''
+    __slots__ = ('session', 'history', 'created', 'last_used', 'last_checked')
+
+    def __init__(self, session, history = None) -> None:
+        self.session = session
+        self.history = history
+        self.created = self.last_used = self.last_checked = time.monotonic()
+
+
+class SessionPool():
+    '''Pool of Starburst sessions with warm-up, health checks and idle eviction
+
+    Attributes
+    ----------
+        factory : callable
+            Creates a new pystarburst.Session
+        min_size : int
+            Number of sessions kept warm
+        max_size : int
+            Maximum number of sessions, further checkouts wait for a free one
+        idle_timeout : float
+            Seconds after which idle sessions above min_size are closed
+        health_check_interval : float
+            Seconds a session may be idle before it is checked with a cheap query on checkout
+        checkout_timeout : float
+            Seconds to wait for a free session before giving up
+        histories : list(pystarburst.QueryHistory)
+            Query history of every open session of the pool
+        log : historyModels.QueryLog
+            Queries of all sessions of the pool, drained from the histories
+
+    Methods
+    -------
+        session()
+            Context manager to check out a session for one request
+        checkout() -> pystarburst.Session
+            Check out a session
+        checkin(session)
+            Return a session to the pool
+        warm_up()
+            Create sessions up to min_size
+        evict_idle()
+            Close sessions idle for longer than idle_timeout, run on every checkout and checkin and in the background for the pools of get_pool()
+        close()
+            Close all sessions
+        stats() -> dict
+            Get latency and throughput counters
+    '''
+    HEALTH_CHECK = 'select 1'
+
+    def __init__(self, factory, min_size: int = 1, max_size: int = 4, idle_timeout: float = 300,
+                 health_check_interval: float = 60, checkout_timeout: float = 60) -> None:
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        self.histories = list()
+        self.log = QueryLog(env.QUERY_HISTORY_MAX_ENTRIES)
+
+        self._idle = deque()
+        self._in_use = dict()
+        self._creating = 0
+        self._cond = threading.Condition()
+        self._started = time.monotonic()
+
+        self._counters = {'created': 0, 'closed': 0, 'checkouts': 0, 'waits': 0, 'health_checks': 0, 'health_check_failures': 0}
+        self._checkout_seconds = deque(maxlen=1024)
+        self._create_seconds = deque(maxlen=1024)
+
+    @contextmanager
+    def session(self):
+        '''Check out a session for the duration of the block.'''
+        session = self.checkout()
+        try:
+            yield session
+        except BaseException:
+            # The query failed or was abandoned, e.g. a generator closed early, make sure the session is checked before it's used again
+            self.checkin(session, suspect=True)
+            raise
+        else:
+            self.checkin(session)
+
+    def checkout(self):
+        # Sessions that went idle while nothing was checked in are closed before one is picked
+        self.evict_idle()
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._cond:
+            self._counters['checkouts'] += 1
+            waited = False
+            while not self._idle and len(self._in_use) + self._creating >= self.max_size:
+                waited = True
+                if not self._cond.wait(deadline - time.monotonic()):
+                    raise TimeoutError(f'No Starburst session available after {self.checkout_timeout}s')
+            if waited:
+                self._counters['waits'] += 1
+
+            entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                self._creating += 1
+
+        if entry is None:
+            entry = self._create()
+        elif not self._healthy(entry):
+            with self._cond:
+                self._creating += 1
+            self._close(entry)
+            entry = self._create()
+
+        with self._cond:
+            self._in_use[id(entry.session)] = entry
+            self._checkout_seconds.append(time.perf_counter() - start)
+        return entry.session
+
+    def checkin(self, session, suspect: bool = False):
+        with self._cond:
+            entry = self._in_use.pop(id(session), None)
+            if entry is None:
+                return
+            entry.last_used = time.monotonic()
+            if suspect:
+                entry.last_checked = 0
+            # Most recently used sessions are handed out first so the others can go idle and be evicted
+            self._idle.append(entry)
+            self._cond.notify()
+        self.evict_idle()
+
+    def warm_up(self):
+        '''Create sessions up to min_size.'''
+        while True:
+            with self._cond:
+                if len(self._idle) + len(self._in_use) + self._creating >= self.min_size:
+                    return
+                self._creating += 1
+            entry = self._create()
+            with self._cond:
+                self._idle.appendleft(entry)
+                self._cond.notify()
+
+    def evict_idle(self):
+        '''Close sessions above min_size that have been idle for longer than idle_timeout.'''
+        expired = list()
+        with self._cond:
+            now = time.monotonic()
+            while self._idle and len(self._idle) + len(self._in_use) > self.min_size and now - self._idle[0].last_used > self.idle_timeout:
+                expired.append(self._idle.popleft())
+        for entry in expired:
+            self._close(entry)
+
+    def close(self):
+        with self._cond:
+            entries = list(self._idle) + list(self._in_use.values())
+            self._idle.clear()
+            self._in_use.clear()
+        for entry in entries:
+            self._close(entry)
+
+    def stats(self) -> dict:
+        with self._cond:
+            checkout = sorted(self._checkout_seconds)
+            create = list(self._create_seconds)
+            uptime = time.monotonic() - self._started
+            return {
+                **self._counters,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'checkouts_per_second': self._counters['checkouts'] / uptime if uptime else 0.0,
+                'checkout_p50_ms': 1000 * checkout[len(checkout) // 2] if checkout else 0.0,
+                'checkout_max_ms': 1000 * checkout[-1] if checkout else 0.0,
+                'create_avg_ms': 1000 * sum(create) / len(create) if create else 0.0,
+            }
+
+    def _create(self) -> PooledSession:
+        # The caller has reserved a slot by incrementing _creating
+        start = time.perf_counter()
+        try:
+            session = self.factory()
+            history = session.query_history()
+        finally:
+            with self._cond:
+                self._creating -= 1
+                self._cond.notify()
+        with self._cond:
+            self.histories.append(history)
+            self._counters['created'] += 1
+            self._create_seconds.append(time.perf_counter() - start)
+        return PooledSession(session, history)
+
+    def _healthy(self, entry: PooledSession) -> bool:
+        if time.monotonic() - entry.last_checked < self.health_check_interval:
+            return True
+
+        with self._cond:
+            self._counters['health_checks'] += 1
+        try:
+            entry.session.sql(self.HEALTH_CHECK).collect()
+        except Exception as e:
+            if env.DEBUG: print(f"INFO: Session health check failed: {e}")
+            with self._cond:
+                self._counters['health_check_failures'] += 1
+            return False
+        entry.last_checked = time.monotonic()
+        return True
+
+    def _close(self, entry: PooledSession):
+        try:
+            entry.session.close()
+        except Exception as e:
+            if env.DEBUG: print(f"INFO: Session close failed: {e}")
+        # Keep the last queries of the session, but not its history
+        self.log.drain([entry.history])
+        with self._cond:
+            self._counters['closed'] += 1
+            if entry.history in self.histories:
+                self.histories.remove(entry.history)
+
+
+_pools = dict()
+_pools_lock = threading.Lock()
+_reaper = None
+
+def pools() -> list[SessionPool]:
+    '''Get all pools of the process.'''
+    with _pools_lock:
+        return list(_pools.values())
+
+def get_pool(key: tuple, factory, **kwargs) -> SessionPool:
+    '''Get the process-wide pool for a connection key, e.g. the session properties, creating it on first use.'''
+    global _reaper
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SessionPool(factory, **kwargs)
+        if _reaper is None:
+            _reaper = threading.Thread(target=_evict_idle_pools, name='pool-reaper', daemon=True)
+            _reaper.start()
+        return pool
+
+def _evict_idle_pools():
+    # Pools of an app nobody uses are neither checked out nor in, their idle sessions are closed from here
+    while True:
+        time.sleep(max(env.POOL_IDLE_TIMEOUT / 4, 1))
+        for pool in pools():
+            try:
+                pool.evict_idle()
+            except Exception as e:
+                print(f"WARNING: Closing idle sessions failed: {e}")
@@ -0,0 +1,98 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file profiles the columns of a table in one aggregate query instead of DataFrame.describe(), which scans the table once per statistic. Distinct counts and percentiles are approximated with Trino's sketches, and the rows can be sampled with TABLESAMPLE for a fast estimate.
+
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pystarburst import Session
+    import pyarrow as pa
+
+# Quantiles reported by profile_query, as p25, p50 and p75
+PERCENTILES = (0.25, 0.5, 0.75)
+
+PROFILE_COLUMNS = ['column', 'type', 'count', 'nulls', 'min', 'max', 'mean', 'stddev', 'approx_distinct']
+
+
+def table_fields(session: Session, table: str, columns: list = None) -> list:
+    '''Name and pystarburst data type of the columns of a table, all of them or the given ones in their order'''
+    fields = {i.name: i.datatype for i in session.table(table).schema.fields}
+    missing = [i for i in columns or [] if i not in fields]
+    if missing:
+        raise ValueError(f"Columns not in {table}: {', '.join(missing)}")
+    return [(i, fields[i]) for i in columns] if columns else list(fields.items())
+
+def table_snapshot(session: Session, table: str) -> int | None:
+    '''Current snapshot of an Iceberg table, None for tables of other connectors, whose changes can't be told'''
+    catalog, schema, name = table.split('.')
+    try:
+        rows = session.sql(f'SELECT snapshot_id FROM {catalog}.{schema}."{name}$snapshots" ORDER BY committed_at DESC LIMIT 1').collect()
+    except Exception:
+        return None
+    return rows[0][0] if rows else None
+
+def profile_query(table: str, fields: list, sample: float = None, percentiles = PERCENTILES) -> str:
+    '''SQL of one aggregate query computing the statistics of every column of fields in a single scan
+    Args:  fields: (name, pystarburst data type) of the profiled columns, see table_fields()
+            sample: Fraction of the rows scanned with TABLESAMPLE BERNOULLI, all rows when None
+    Returns: SQL of a single row with a "<index>_<statistic>" column per column and statistic'''
+    aggs = ['count(*) AS "rows"']
+    for i, (name, datatype) in enumerate(fields):
+        column = _quote(name)
+        aggs += [f'count({column}) AS "{i}_count"', f'approx_distinct({column}) AS "{i}_approx_distinct"']
+        if _is_ordered(datatype):
+            # One column of all types, like describe() does for strings
+            aggs += [f'CAST(min({column}) AS varchar) AS "{i}_min"', f'CAST(max({column}) AS varchar) AS "{i}_max"']
+        if _is_numeric(datatype):
+            aggs += [f'avg({column}) AS "{i}_mean"', f'stddev({column}) AS "{i}_stddev"']
+            aggs += [f'approx_percentile(CAST({column} AS double), {p!r}) AS "{i}_{percentile_name(p)}"' for p in percentiles]
+
+    source = table if sample is None else f'{table} TABLESAMPLE BERNOULLI ({100 * sample:g})'
+    return f"SELECT {', '.join(aggs)} FROM {source}"
+
+def profile_result(result: pa.Table, fields: list, percentiles = PERCENTILES, metadata: dict = None) -> pa.Table:
+    '''One row per column of fields with the statistics of the single row result of profile_query(), missing ones are null.
+    Counts are of the scanned rows, of the sample if there was one. The number of scanned rows is kept in the schema metadata with metadata.'''
+    import pyarrow as pa
+
+    row = {k: v[0] for k, v in result.to_pydict().items()}
+    stats = ['count', 'approx_distinct', 'min', 'max', 'mean', 'stddev'] + [percentile_name(p) for p in percentiles]
+    columns = {i: [row.get(f'{n}_{i}') for n in range(len(fields))] for i in stats}
+    columns['nulls'] = [row['rows'] - i if i is not None else None for i in columns['count']]
+
+    types = {'count': pa.int64(), 'nulls': pa.int64(), 'approx_distinct': pa.int64(), 'min': pa.string(), 'max': pa.string()}
+    table = pa.table({
+        'column': pa.array([i for i, _ in fields], pa.string()),
+        'type': pa.array([type(i).__name__ for _, i in fields], pa.string()),
+        **{i: pa.array(columns[i], types.get(i, pa.float64())) for i in PROFILE_COLUMNS[2:] + stats[6:]},
+    })
+    return table.replace_schema_metadata({'rows': str(row['rows']), **{k: str(v) for k, v in (metadata or {}).items()}})
+
+def percentile_name(p: float) -> str:
+    return f'p{100 * p:g}'
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _is_numeric(datatype) -> bool:
+    from pystarburst.types import _NumericType
+    return isinstance(datatype, _NumericType)
+
+def _is_ordered(datatype) -> bool:
+    from pystarburst.types import _NumericType, StringType, CharType, DateType, TimestampType, TimeType
+    return isinstance(datatype, (_NumericType, StringType, CharType, DateType, TimestampType, TimeType))
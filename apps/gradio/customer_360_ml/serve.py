@@ -0,0 +1,192 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file runs the app with several worker processes behind a local load balancer, so pandas conversion, context rendering and plot building of different users run in parallel instead of sharing one GIL.
+#
+#   python serve.py --workers 4
+#
+# Every worker is a separate `python app.py` listening on the next ports after env.PORT. The balancer on env.PORT keeps a browser on the
+# same worker with a cookie, Gradio keeps the state and the event queue of a browser session in the worker. The first connections of a
+# browser are opened in parallel before the cookie came back, they go to the worker of its address until then. Aggregated results and
+# LLM contexts are shared by the workers through files in env.SHARED_CACHE_DIR, a temporary directory unless it is set.
+
+import os
+import re
+import sys
+import time
+import shutil
+import signal
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+
+import env
+
+COOKIE = 'c360_worker'
+# Client addresses remembered for the connections without the cookie, see env.BALANCER_CLIENT_TTL
+MAX_CLIENTS = 4096
+
+_cookie = re.compile(rb'(?im)^cookie:.*\b' + COOKIE.encode() + rb'=(\d+)')
+
+
+class Balancer():
+    '''Sticky HTTP load balancer in front of the workers
+
+    Attributes
+    ----------
+        ports : list(int)
+            Ports of the workers on 127.0.0.1
+        active : list(int)
+            Open connections per worker, new browsers go to the worker with the fewest
+        clients : OrderedDict
+            Worker and time of the latest pick per client address without the cookie, for env.BALANCER_CLIENT_TTL seconds
+
+    Methods
+    -------
+        pick(head, address = None) -> (int, bool)
+            Get the worker of a request and whether it has to set the cookie
+        serve(host, port)
+            Accept connections until cancelled
+    '''
+
+    def __init__(self, ports: list) -> None:
+        self.ports = ports
+        self.active = [0] * len(ports)
+        self.clients = OrderedDict()
+        self._next = 0
+
+    def pick(self, head: bytes, address: str = None) -> tuple:
+        # The worker of the browser, or the least busy one for a new browser. Its parallel first connections have no cookie yet and go
+        # to the same worker by address, browsers behind one NAT share a worker for env.BALANCER_CLIENT_TTL seconds
+        match = _cookie.search(head)
+        if match is not None and int(match.group(1)) < len(self.ports):
+            return int(match.group(1)), False
+
+        now = time.monotonic()
+        client = self.clients.get(address) if address is not None else None
+        if client is not None and now - client[1] < env.BALANCER_CLIENT_TTL:
+            return client[0], True
+
+        least = min(self.active)
+        candidates = [i for i, n in enumerate(self.active) if n == least]
+        self._next += 1
+        worker = candidates[self._next % len(candidates)]
+        if address is not None:
+            self.clients[address] = (worker, now)
+            self.clients.move_to_end(address)
+            while len(self.clients) > MAX_CLIENTS:
+                self.clients.popitem(last=False)
+        return worker, True
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self._handle, host, port, limit=1024 * 1024)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        peer = writer.get_extra_info('peername')
+        worker, new = self.pick(head, peer[0] if peer else None)
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection('127.0.0.1', self.ports[worker], limit=1024 * 1024)
+        except OSError:
+            writer.write(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            writer.close()
+            return
+
+        self.active[worker] += 1
+        try:
+            upstream_writer.write(head)
+            # Only the first response of a new browser's connection gets the cookie, the rest is passed through as is
+            await asyncio.gather(self._pipe(reader, upstream_writer),
+                                 self._pipe(upstream_reader, writer, f'Set-Cookie: {COOKIE}={worker}; Path=/; HttpOnly; SameSite=Lax\r\n'.encode() if new else None))
+        finally:
+            self.active[worker] -= 1
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, cookie: bytes = None):
+        try:
+            if cookie is not None:
+                head = await reader.readuntil(b'\r\n\r\n')
+                writer.write(head[:-2] + cookie + b'\r\n')
+            while data := await reader.read(64 * 1024):
+                writer.write(data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except RuntimeError:
+                pass
+
+
+def start_worker(command: list, port: int, cache_dir: str) -> subprocess.Popen:
+    environ = dict(os.environ, PORT=str(port), BIND_HOST='127.0.0.1', SHARED_CACHE_DIR=cache_dir, WORKERS='1')
+    return subprocess.Popen(command, env=environ)
+
+def supervise(workers: list, command: list, ports: list, cache_dir: str):
+    # Workers that exit are started again, a crash only loses the browser sessions of that worker
+    while True:
+        for i, proc in enumerate(workers):
+            if proc.poll() is not None:
+                print(f"WARNING: Worker {i} exited with {proc.returncode}, restarting")
+                workers[i] = start_worker(command, ports[i], cache_dir)
+        time.sleep(1)
+
+def serve(command: list, workers: int, host: str = env.BIND_HOST, port: int = env.PORT, cache_dir: str = env.SHARED_CACHE_DIR):
+    '''Start the workers and run the load balancer until interrupted.'''
+    temporary = cache_dir is None
+    cache_dir = cache_dir or tempfile.mkdtemp(prefix='customer360-cache-')
+    ports = [port + 1 + i for i in range(workers)]
+
+    procs = [start_worker(command, i, cache_dir) for i in ports]
+    threading.Thread(target=supervise, args=(procs, command, ports, cache_dir), name='workers', daemon=True).start()
+    print(f"INFO: {workers} workers on ports {ports[0]}-{ports[-1]}, load balancer on {host}:{port}, shared cache in {cache_dir}")
+
+    try:
+        asyncio.run(Balancer(ports).serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs:
+            proc.send_signal(signal.SIGTERM)
+        for proc in procs:
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if temporary:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the app with several worker processes')
+    parser.add_argument('--workers', type=int, default=max(env.WORKERS, 1), help='Number of app processes, e.g. the number of cores')
+    parser.add_argument('--app', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py'), help='Script run by every worker')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments passed to the workers after --')
+    args = parser.parse_args()
+
+    serve([sys.executable, args.app] + [i for i in args.args if i != '--'], args.workers)
+
+
+if __name__ == '__main__': main()
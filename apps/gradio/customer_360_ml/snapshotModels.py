@@ -0,0 +1,169 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# This file holds the on-disk snapshots of query results, so a restarted app can show the segments and the first chart before it has connected to Starburst. Snapshots are Arrow IPC files with their key, source tables, query hash and creation time in the schema metadata, memory-mapped when read.
+
+import os
+import ast
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+import pandas as pd
+
+
+class SnapshotStore():
+    '''Directory of result snapshots evicted by age and size
+
+    Attributes
+    ----------
+        directory : str
+            Directory of the snapshot files
+        max_age : float
+            Seconds a snapshot is used after it was taken
+        max_bytes : int
+            Upper bound for the size of all snapshots, the oldest are deleted first
+        hits : int
+            Number of snapshots loaded
+        misses : int
+            Number of lookups without a usable snapshot
+
+    Methods
+    -------
+        save(key, df, sources = (), query = None)
+            Snapshot a data frame
+        load(key) -> (pd.DataFrame, dict)
+            Get the snapshot of a key and its metadata, or (None, None)
+        evict()
+            Delete expired snapshots and the oldest ones above max_bytes
+        clear(prefix = ())
+            Delete the snapshots whose key starts with prefix, all of them by default
+        stats() -> dict
+            Get the counters
+    '''
+
+    def __init__(self, directory: str, max_age: float = 24 * 3600, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, key, df: pd.DataFrame, sources = (), query: str = None):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = {'key': repr(key), 'sources': list(sources), 'created': time.time(),
+                    'query_hash': hashlib.sha256(query.encode()).hexdigest() if query is not None else None}
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'snapshot': json.dumps(metadata).encode()})
+
+        # Written next to the snapshot and renamed over it, readers see the old or the new file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f, pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def load(self, key) -> tuple:
+        import pyarrow as pa
+
+        path = self._path(key)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.max_age:
+                raise FileNotFoundError(path)
+            # The mapped table needs no copy, only the conversion to pandas for the UI copies the strings
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+                metadata = json.loads(table.schema.metadata[b'snapshot'])
+                if metadata['key'] != repr(key):
+                    raise KeyError(key)
+                df = table.to_pandas()
+        except (OSError, KeyError, ValueError, pa.ArrowInvalid) as e:
+            if not isinstance(e, FileNotFoundError): print(f"WARNING: Snapshot {path} is unreadable: {e}")
+            with self._lock:
+                self.misses += 1
+            return None, None
+
+        with self._lock:
+            self.hits += 1
+        return df, metadata
+
+    def evict(self):
+        with self._lock:
+            now = time.time()
+            files = list()
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                # Temporary files of crashed writers are dropped after an hour
+                if (name.endswith('.arrow') and now - stat.st_mtime > self.max_age) or (name.endswith('.tmp') and now - stat.st_mtime > 3600):
+                    _unlink(path)
+                elif name.endswith('.arrow'):
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(i[1] for i in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                _unlink(path)
+                total -= size
+
+    def clear(self, prefix: tuple = ()):
+        # Snapshots of other connections and source tables share the directory, only the matching keys are deleted
+        with self._lock:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.endswith('.arrow') and (not prefix or _key_starts_with(path, prefix)):
+                    _unlink(path)
+
+    def stats(self) -> dict:
+        files = [i for i in os.listdir(self.directory) if i.endswith('.arrow')]
+        return {'snapshots': len(files), 'bytes': sum(os.path.getsize(os.path.join(self.directory, i)) for i in files),
+                'hits': self.hits, 'misses': self.misses}
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, hashlib.sha256(repr(key).encode()).hexdigest() + '.arrow')
+
+
+def _key_starts_with(path: str, prefix: tuple) -> bool:
+    # Keys are tuples of strings, their repr in the metadata is read back without loading the data
+    import pyarrow as pa
+
+    try:
+        with pa.memory_map(path) as source:
+            key = ast.literal_eval(json.loads(pa.ipc.open_file(source).schema.metadata[b'snapshot'])['key'])
+    except (OSError, KeyError, TypeError, ValueError, SyntaxError, pa.ArrowInvalid):
+        return False
+    return isinstance(key, tuple) and key[:len(prefix)] == prefix
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,71 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# The tests run the app modules against the local stand-ins of benchmarks/, localStarburst.py for Starburst and fakeOpenAI.py for OpenAI.
+#
+#   python -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+
+@pytest.fixture(scope='module')
+def summary_data():
+    # Data with the default aggregate of a local stand-in, shared by the tests of a module
+    from dataModels import Data
+    from localStarburst import LocalSession, load_customer_tables
+
+    base = LocalSession()
+    load_customer_tables(base, 2000)
+    data = Data(session_factory=base.new_session)
+    data.invalidate_cache()
+    data.get_initial_data()
+    yield data
+    data.pool.close()
+    base.close()
+
+@pytest.fixture
+def fake_openai():
+    # Starts fake chat completions servers with fast answers unless given, they are shut down after the test
+    from fakeOpenAI import FakeOpenAI
+
+    servers = []
+    def start(**kwargs):
+        servers.append(FakeOpenAI(**{'first_token_latency': 0.01, 'token_delay': 0.001, 'tokens': 20, **kwargs}).start())
+        return servers[-1]
+    yield start
+    for i in servers:
+        i.shutdown()
+
+@pytest.fixture
+def openai_model(summary_data):
+    # Every model has its own user and answer cache and talks to the given fake server
+    from mlModels import OpenAI
+    from cacheModels import ResultCache
+
+    def build(server, **kwargs):
+        model = OpenAI(summary_data.for_user(), api_key='fake')
+        model.api_base = server.api_base
+        model.answer_cache = ResultCache()
+        for k, v in kwargs.items():
+            setattr(model, k, v)
+        return model
+    return build
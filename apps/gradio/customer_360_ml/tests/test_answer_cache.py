@@ -0,0 +1,88 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Answer cache of mlModels.OpenAI against the fake chat completions server of benchmarks/fakeOpenAI.py, and its near-duplicate questions.
+
+import pytest
+import pandas as pd
+
+from mlModels import nearest_question, normalize_question, category_words
+
+QUESTION = 'Which 5 states have the highest risk appetite? Why?'
+
+
+def test_repeated_question_is_answered_from_the_cache(fake_openai, openai_model):
+    server = fake_openai()
+    model = openai_model(server, stream=True, n=1)
+    first = list(model.predict(QUESTION))[-1]
+    again = list(model.predict(f'  {QUESTION.upper()} '))
+
+    assert len(again) == 1 and again[0].strip() == first.strip()
+    assert server.requests == 1
+
+def test_answers_are_not_reused_for_another_summary(fake_openai, openai_model):
+    server = fake_openai()
+    model = openai_model(server, stream=True, n=1)
+    list(model.predict(QUESTION))
+    model.data_class.get_agg_data(['gold'])
+    list(model.predict(QUESTION))
+    assert server.requests == 2
+
+def test_negated_question_is_not_answered_like_the_cached_one(fake_openai, openai_model):
+    server = fake_openai()
+    model = openai_model(server, stream=True, n=1, answer_similarity=0.9)
+    list(model.predict('Which 5 states have the highest risk appetite?'))
+    list(model.predict('Which 5 states do not have the highest risk appetite?'))
+    assert server.requests == 2
+
+@pytest.mark.parametrize('question, cached', [
+    ('Which 5 states have the highest risk appetite, please?', 'Which 5 states have the highest risk appetite?'),
+    ('Show me the 5 states with the highest risk appetite', 'Which 5 states have the highest risk appetite?'),
+])
+def test_near_duplicate_questions_match(question, cached):
+    assert nearest_question(normalize_question(question), [normalize_question(cached)]) == normalize_question(cached)
+
+@pytest.mark.parametrize('question, cached', [
+    ('Which 5 states do not have the highest risk appetite?', 'Which 5 states have the highest risk appetite?'),
+    ("Which 5 states don't have the highest risk appetite?", 'Which 5 states have the highest risk appetite?'),
+    ('Why not?', 'Why?'),
+    ('Which states have customers except gold?', 'Which states have customers gold?'),
+    ('Which states never had a high risk appetite?', 'Which states had a high risk appetite?'),
+    ('Which 10 states have the highest risk appetite?', 'Which 5 states have the highest risk appetite?'),
+    ('Which states have the most gold customers?', 'Which states have gold customers?'),
+    ('Which states have customers with a very low risk appetite?', 'Which states have customers with a low risk appetite?'),
+    ('List states with the most customers', 'List states with customers'),
+    ('Which 5 states have the top risk appetite?', 'Which 5 states have the bottom risk appetite?'),
+])
+def test_questions_with_other_negations_numbers_or_qualifiers_never_match(question, cached):
+    assert nearest_question(normalize_question(question), [normalize_question(cached)], threshold=0.0) is None
+
+@pytest.mark.parametrize('question, cached', [
+    ('Which states have gold customers?', 'Which states have silver customers?'),
+    ('How many customers are in CA?', 'How many customers are in NY?'),
+    ('Which states have customers with a wild west risk appetite?', 'Which states have customers with a risk appetite?'),
+])
+def test_questions_about_other_categories_never_match(question, cached):
+    summary = pd.DataFrame({'state': ['CA', 'NY'], 'risk_appetite': ['low', 'wild_west'], 'count': [1, 2]})
+    categories = category_words(summary, ['gold', 'silver'])
+    assert nearest_question(normalize_question(question), [normalize_question(cached)], threshold=0.0, categories=categories) is None
+
+def test_more_specific_question_is_not_answered_like_the_cached_one(fake_openai, openai_model):
+    server = fake_openai()
+    model = openai_model(server, stream=True, n=1, answer_similarity=0.9)
+    list(model.predict('Which states have gold customers?'))
+    list(model.predict('Which states have the most gold customers?'))
+    assert server.requests == 2
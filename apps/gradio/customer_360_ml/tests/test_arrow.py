@@ -0,0 +1,58 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Results read as Arrow batches by Data.to_pyarrow and Data.to_pandas from the local stand-in.
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from dataModels import Data
+from localStarburst import LocalSession
+
+TABLE = 'local.demo.customers'
+STATES = ['CA', 'NY', None, 'CA', 'TX', 'NY', 'CA']
+
+
+@pytest.fixture
+def base():
+    # Three rows per batch, the seven rows arrive in three batches
+    session = LocalSession(batch_size=3)
+    session.load_table(TABLE, pd.DataFrame({'state': STATES, 'count': range(7)}))
+    yield session
+    session.close()
+
+@pytest.fixture
+def data(base):
+    data = Data(session_factory=base.new_session)
+    yield data
+    data.pool.close()
+
+def test_string_columns_are_dictionary_encoded_across_batches(base, data):
+    table = data.to_pyarrow(base.table(TABLE))
+
+    assert pa.types.is_dictionary(table.schema.field('state').type)
+    assert table.column('state').to_pylist() == STATES
+    assert table.schema.field('count').type == pa.int64()
+    assert table.column('count').to_pylist() == list(range(7))
+
+def test_pandas_result_has_categorical_labels(base, data):
+    df = data.to_pandas(base.table(TABLE))
+
+    assert isinstance(df['state'].dtype, pd.CategoricalDtype)
+    assert set(df['state'].cat.categories) == {'CA', 'NY', 'TX'}
+    assert df['state'].isna().tolist() == [i is None for i in STATES]
+    assert df['count'].tolist() == list(range(7))
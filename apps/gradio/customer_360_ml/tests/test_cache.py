@@ -0,0 +1,195 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Expiry, eviction and the counters of cacheModels.ResultCache and cacheModels.SharedCache, and the coalescing of cacheModels.SingleFlight.
+
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cacheModels import ResultCache, SharedCache, SingleFlight
+
+
+def unit_cache(ttl: float = 60, max_bytes: int = 2) -> ResultCache:
+    # Every value counts as one byte, max_bytes is the number of entries
+    return ResultCache(ttl=ttl, max_bytes=max_bytes, sizeof=lambda value: 1)
+
+def test_value_is_returned_until_it_expires():
+    cache = unit_cache(ttl=0.05)
+    cache.put('a', 1)
+    assert cache.get('a') == 1
+
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+    assert cache.stats() == {'entries': 0, 'bytes': 0, 'hits': 1, 'misses': 1, 'evictions': 0}
+
+def test_put_again_renews_the_expiry():
+    cache = unit_cache(ttl=0.1)
+    cache.put('a', 1)
+    time.sleep(0.06)
+    cache.put('a', 2)
+    time.sleep(0.06)
+    assert cache.get('a') == 2
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = unit_cache(max_bytes=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    # Reading a makes b the least recently used
+    cache.get('a')
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+def test_value_larger_than_the_cache_is_not_kept():
+    cache = ResultCache(ttl=60, max_bytes=10, sizeof=len)
+    cache.put('small', 'abc')
+    assert cache.put('large', 'x' * 11) == 'x' * 11
+    assert cache.get('large') is None
+    assert cache.get('small') == 'abc'
+
+def test_value_larger_than_the_cache_drops_the_one_cached_before():
+    cache = ResultCache(ttl=60, max_bytes=10, sizeof=len)
+    cache.put('key', 'abc')
+    cache.put('key', 'x' * 11)
+    assert cache.get('key') is None
+    assert cache.stats()['bytes'] == 0
+
+def test_disabled_cache_keeps_nothing():
+    cache = unit_cache(ttl=0)
+    assert not cache.enabled
+    assert cache.put('a', 1) == 1
+    assert cache.get('a') is None
+
+def test_invalidate_drops_the_values_and_keeps_the_counters():
+    cache = unit_cache()
+    cache.put('a', 1)
+    cache.get('a')
+    cache.invalidate()
+    assert cache.get('a') is None
+    assert cache.stats() == {'entries': 0, 'bytes': 0, 'hits': 1, 'misses': 1, 'evictions': 0}
+
+def test_shared_cache_files_stay_under_max_bytes(tmp_path):
+    cache = SharedCache(str(tmp_path), ttl=60, max_bytes=20000)
+    # Distinct keys within the time to live, more than the cache holds
+    for i in range(100):
+        cache.put(('key', i), bytes(1000))
+
+    files = [i for i in os.listdir(tmp_path) if i.endswith('.cache')]
+    assert sum(os.path.getsize(tmp_path / i) for i in files) <= 1.1 * cache.max_bytes
+    assert cache.stats()['evictions'] > 0
+    # The oldest entries are deleted first
+    assert cache.get(('key', 99)) == bytes(1000)
+    cache.local.invalidate()
+    assert cache.get(('key', 0)) is None
+
+def run_concurrently(flight: SingleFlight, key, fn, callers: int) -> list:
+    # The first caller runs fn, which only returns once all the others wait for it
+    started, release = threading.Event(), threading.Event()
+
+    def call():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    def caller(i):
+        try:
+            return flight.do(key, call)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(callers) as executor:
+        futures = [executor.submit(caller, 0)]
+        started.wait(5)
+        futures += [executor.submit(caller, i) for i in range(1, callers)]
+        while flight.stats()['coalesced'] < callers - 1:
+            time.sleep(0.001)
+        release.set()
+        return [i.result() for i in futures]
+
+def test_concurrent_callers_share_one_call():
+    flight, runs = SingleFlight(), []
+    results = run_concurrently(flight, 'key', lambda: runs.append(1) or 'result', callers=5)
+
+    assert results == ['result'] * 5
+    assert len(runs) == 1
+    assert flight.stats() == {'calls': 5, 'executions': 1, 'coalesced': 4, 'errors': 0, 'in_flight': 0}
+
+def test_concurrent_callers_share_the_error():
+    flight = SingleFlight()
+    def fail():
+        raise ValueError('query failed')
+    results = run_concurrently(flight, 'key', fail, callers=3)
+
+    assert all(isinstance(i, ValueError) for i in results)
+    assert len({id(i) for i in results}) == 1
+    assert flight.stats()['errors'] == 1 and flight.in_flight() == []
+
+def test_calls_after_the_running_one_run_again():
+    flight, runs = SingleFlight(), []
+    flight.do('key', lambda: runs.append(1))
+    flight.do('key', lambda: runs.append(1))
+    assert len(runs) == 2
+
+def test_other_keys_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: flight.do('b', lambda: 'b') + 'a') == 'ba'
+    assert flight.stats()['coalesced'] == 0
+
+def test_call_for_the_same_key_from_inside_the_running_one_runs_on_its_own():
+    flight = SingleFlight()
+    assert flight.do('key', lambda: flight.do('key', lambda: 'inner') + ' outer') == 'inner outer'
+    assert flight.stats()['executions'] == 2 and flight.in_flight() == []
+
+def test_async_callers_share_one_call():
+    flight, runs = SingleFlight(), []
+
+    def call():
+        time.sleep(0.1)
+        runs.append(1)
+        return 'result'
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async('key', call) for _ in range(3)))
+
+    assert asyncio.run(main()) == ['result'] * 3
+    assert len(runs) == 1
+
+def test_async_callers_joining_before_the_leader_started_share_its_call():
+    flight, runs, started = SingleFlight(), [], threading.Event()
+
+    def call():
+        runs.append(1)
+        return 'result'
+
+    async def main():
+        # The only executor thread is busy, every caller joins before the leader's function starts
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(1))
+        busy = loop.run_in_executor(None, started.wait, 5)
+        calls = [asyncio.ensure_future(flight.do_async('key', call)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        started.set()
+        await busy
+        return await asyncio.gather(*calls)
+
+    assert asyncio.run(main()) == ['result'] * 3
+    assert len(runs) == 1 and flight.stats()['coalesced'] == 2
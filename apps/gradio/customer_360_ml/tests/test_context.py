@@ -0,0 +1,78 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# The system message of mlModels.OpenAI built from the summary of a local stand-in: roll-up, token budget and context cache.
+
+import io
+
+import pandas as pd
+import pytest
+
+from cacheModels import ResultCache
+from mlModels import OpenAI, roll_up, count_tokens
+
+
+@pytest.fixture
+def model(summary_data):
+    model = OpenAI(summary_data.for_user(), api_key='fake')
+    model.context_cache = ResultCache()
+    return model
+
+def context_rows(message: str) -> pd.DataFrame:
+    # The CSV between the header line and the note on the rolled up rows
+    lines = [i for i in message.splitlines()[2:] if not i.startswith('Rows with a State of other')]
+    return pd.read_csv(io.StringIO('\n'.join(lines)))
+
+def test_roll_up_sums_the_other_rows_per_risk_appetite():
+    df = pd.DataFrame({'State': ['CA', 'NY', 'TX', 'WA', 'OR'], 'Risk_Appetite': ['low', 'high', 'low', 'low', 'high'],
+                       'Count_of_Customers': [50, 40, 30, 20, 10]})
+    rolled = roll_up(df, 2)
+
+    assert rolled['State'].tolist() == ['CA', 'NY', 'other (2)', 'other (1)']
+    assert rolled['Count_of_Customers'].tolist() == [50, 40, 50, 10]
+    assert roll_up(df, 5) is df
+
+def test_message_lists_every_row_within_the_budget(model, summary_data):
+    summary = summary_data.get_summary()
+    message, tokens = model.build_system_message(summary)
+
+    rows = context_rows(message)
+    assert len(rows) == len(summary)
+    assert rows['Count_of_Customers'].sum() == summary['count'].sum()
+    assert tokens == count_tokens(message, model.model)
+
+def test_message_over_the_budget_rolls_up_rows_and_keeps_the_total(model, summary_data):
+    summary = summary_data.get_summary()
+    model.context_max_tokens = model.build_system_message(summary)[1] // 2
+    message, tokens = model.build_system_message(summary)
+
+    rows = context_rows(message)
+    assert tokens <= model.context_max_tokens
+    assert len(rows) < len(summary) and rows['State'].str.startswith('other (').any()
+    assert rows['Count_of_Customers'].sum() == summary['count'].sum()
+
+def test_message_is_built_once_per_summary_and_settings(monkeypatch, model):
+    built = []
+    build = OpenAI.build_system_message
+    monkeypatch.setattr(OpenAI, 'build_system_message', lambda self, summary: built.append(1) or build(self, summary))
+
+    model.set_system_message()
+    model.set_system_message()
+    assert len(built) == 1
+
+    model.context_format = 'tsv'
+    model.set_system_message()
+    assert len(built) == 2 and '\t' in model.system_message
@@ -0,0 +1,85 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Segment selections sliced from cubeModels.SegmentCube and its expiry in Data, against the local stand-in.
+
+import time
+
+import pytest
+
+import env
+from dataModels import Data
+from localStarburst import LocalSession, load_customer_tables
+
+
+@pytest.fixture
+def base(monkeypatch):
+    monkeypatch.setattr(env, 'USE_AGG_CUBE', True)
+    session = LocalSession()
+    load_customer_tables(session, 2000)
+    yield session
+    session.close()
+
+@pytest.fixture
+def data(base):
+    data = Data(session_factory=base.new_session)
+    data.invalidate_cache()
+    data.get_initial_data(do_agg=False)
+    yield data
+    data.pool.close()
+
+@pytest.fixture
+def queries(monkeypatch):
+    # SQL run by every session of the stand-in
+    run = []
+    execute = LocalSession.execute
+    def record(self, query):
+        run.append(query)
+        return execute(self, query)
+    monkeypatch.setattr(LocalSession, 'execute', record)
+    return run
+
+def rows(result) -> list:
+    return sorted((state, risk, int(count)) for state, risk, count in result[['state', 'risk_appetite', 'count']].itertuples(index=False))
+
+@pytest.mark.parametrize('segments', [['gold'], ['gold', 'silver'], ['silver', 'gold', 'gold']])
+def test_slice_is_the_aggregate_of_the_selection(data, segments):
+    queried, _ = data._query_agg_data(segments)
+    sliced = data.cube.slice(segments)
+
+    assert rows(sliced) == rows(queried)
+    assert sliced['count'].is_monotonic_decreasing
+
+def test_slice_of_no_segments_is_empty(data):
+    sliced = data.cube.slice([])
+    assert sliced.empty and list(sliced.columns) == ['state', 'risk_appetite', 'count']
+
+def test_unknown_segments_are_ignored(data):
+    assert rows(data.cube.slice(['gold', 'unknown'])) == rows(data.cube.slice(['gold']))
+    assert data.cube.slice(['unknown']).empty
+
+def test_expired_cube_is_queried_and_rebuilt(data, queries):
+    data.cube.built -= env.AGG_CACHE_TTL + 1
+    stale = data.cube
+
+    result = data.get_agg_data(['gold'])
+    assert rows(result) == rows(stale.slice(['gold']))
+    assert any('GROUP BY' in i.upper() and "'gold'" in i for i in queries)
+
+    deadline = time.monotonic() + 5
+    while data.cube is stale and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert data.cube is not stale and data.cube.age < env.AGG_CACHE_TTL
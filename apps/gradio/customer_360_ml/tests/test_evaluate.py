@@ -0,0 +1,53 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Batch evaluation of mlModels.OpenAI, its rate limits and retries, against the fake chat completions server of benchmarks/fakeOpenAI.py.
+
+import time
+
+QUESTION = 'Which 5 states have the highest risk appetite? Why?'
+
+
+def test_evaluate_retries_rate_limited_requests(fake_openai, openai_model):
+    server = fake_openai(requests_per_second=2)
+    model = openai_model(server)
+    # No client-side limits, the server rejects what is above its rate
+    result = model.evaluate([f'{QUESTION} {i}' for i in range(4)], concurrency=4, requests_per_minute=0, tokens_per_minute=0, retries=5)
+
+    assert result['error'].isna().all() and result['answer'].notna().all()
+    assert server.rejected > 0
+    assert result['attempts'].max() > 1
+    assert server.requests == 4
+
+def test_evaluate_reports_questions_failing_after_the_retries(fake_openai, openai_model):
+    server = fake_openai(error_rate=1.0)
+    model = openai_model(server)
+    result = model.evaluate([f'{QUESTION} {i}' for i in range(2)], concurrency=2, requests_per_minute=0, tokens_per_minute=0, retries=2)
+
+    assert result['answer'].isna().all() and result['error'].notna().all()
+    assert (result['attempts'] == 3).all()
+    assert server.failed == 6
+
+def test_evaluate_retries_within_the_request_rate(fake_openai, openai_model):
+    server = fake_openai(error_rate=1.0)
+    model = openai_model(server)
+    # 2 requests per second with a burst of 2, the 4 retries wait for the bucket instead of only their short backoff
+    start = time.perf_counter()
+    result = model.evaluate([f'{QUESTION} {i}' for i in range(2)], concurrency=2, requests_per_minute=120, tokens_per_minute=0, retries=2)
+    elapsed = time.perf_counter() - start
+
+    assert server.failed == 6 and (result['attempts'] == 3).all()
+    assert elapsed >= 1.8
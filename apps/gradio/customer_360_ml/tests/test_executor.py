@@ -0,0 +1,131 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Dependencies, cancellation and errors of the steps of executorModels.QueryExecutor.
+
+import time
+import threading
+import contextvars
+
+import pytest
+
+from executorModels import QueryExecutor
+
+
+def step(events: list, name: str, seconds: float = 0, error: Exception = None):
+    # Records when the step starts and ends
+    def run():
+        events.append(f'{name} start')
+        time.sleep(seconds)
+        if error is not None:
+            raise error
+        events.append(f'{name} end')
+        return name
+    return run
+
+def test_independent_steps_run_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+    with QueryExecutor(3) as executor:
+        futures = [executor.submit(barrier.wait) for _ in range(3)]
+        # Each step only returns once all of them are running
+        assert sorted(executor.gather(*futures)) == [0, 1, 2]
+
+def test_step_runs_after_its_dependencies():
+    events = []
+    with QueryExecutor(4) as executor:
+        first = executor.submit(step(events, 'first', 0.05))
+        second = executor.submit(step(events, 'second', 0.02))
+        last = executor.submit(step(events, 'last'), after=[first, second])
+        assert executor.gather(last) == ['last']
+
+    assert events.index('last start') > max(events.index('first end'), events.index('second end'))
+
+def test_step_after_done_dependencies_runs():
+    with QueryExecutor(2) as executor:
+        first = executor.submit(lambda: 1)
+        executor.gather(first)
+        second = executor.submit(lambda: first.result() + 1, after=[first])
+        assert executor.gather(second) == [2]
+
+def test_failed_step_cancels_its_dependents():
+    events = []
+    with QueryExecutor(2) as executor:
+        failed = executor.submit(step(events, 'failed', 0.02, ValueError('schema missing')))
+        write = executor.submit(step(events, 'write'), after=[failed])
+        read_back = executor.submit(step(events, 'read back'), after=[write])
+        with pytest.raises(ValueError, match='schema missing'):
+            executor.gather()
+
+    assert write.cancelled() and read_back.cancelled()
+    assert 'write start' not in events and 'read back start' not in events
+
+def test_failed_step_cancels_the_steps_not_started():
+    events = []
+    with QueryExecutor(1) as executor:
+        executor.submit(step(events, 'failed', 0.02, ValueError('query failed')))
+        pending = executor.submit(step(events, 'pending'))
+        with pytest.raises(ValueError):
+            executor.gather()
+
+    assert pending.cancelled() and 'pending start' not in events
+
+def test_running_steps_finish_after_a_failure():
+    events = []
+    with QueryExecutor(2) as executor:
+        running = executor.submit(step(events, 'running', 0.1))
+        executor.submit(step(events, 'failed', 0.01, ValueError('query failed')))
+        with pytest.raises(ValueError):
+            executor.gather()
+
+    assert running.result() == 'running'
+
+def test_gather_raises_the_first_error():
+    with QueryExecutor(2) as executor:
+        first = executor.submit(step([], 'first', 0.01, ValueError('first')))
+        executor.submit(step([], 'second', 0.1, KeyError('second')))
+        with pytest.raises(ValueError, match='first'):
+            executor.gather()
+        assert executor.error is first.exception()
+
+def test_gather_of_succeeded_steps_raises_the_error_of_another_one():
+    with QueryExecutor(2) as executor:
+        executor.submit(step([], 'failed', 0, ValueError('failed')))
+        succeeded = executor.submit(step([], 'succeeded', 0.05))
+        with pytest.raises(ValueError):
+            executor.gather(succeeded)
+
+def test_steps_submitted_after_a_failure_are_cancelled():
+    with QueryExecutor(2) as executor:
+        executor.submit(step([], 'failed', 0, ValueError('failed')))
+        with pytest.raises(ValueError):
+            executor.gather()
+        assert executor.submit(lambda: 1).cancelled()
+
+def test_error_in_the_block_cancels_the_pending_steps():
+    events = []
+    with pytest.raises(RuntimeError):
+        with QueryExecutor(1) as executor:
+            executor.submit(step(events, 'running', 0.05))
+            pending = executor.submit(step(events, 'pending'))
+            raise RuntimeError('caller failed')
+
+    assert pending.cancelled() and events == ['running start', 'running end']
+
+def test_steps_run_in_the_context_of_the_caller():
+    operation = contextvars.ContextVar('operation', default=None)
+    operation.set('get_initial_data')
+    with QueryExecutor(2) as executor:
+        assert executor.gather(executor.submit(operation.get)) == ['get_initial_data']
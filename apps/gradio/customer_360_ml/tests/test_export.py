@@ -0,0 +1,76 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Chunking, limits and file sinks of exportModels on readers of record batches.
+
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from exportModels import ExportStats, iter_batches, head, write_batches
+
+
+def reader(rows: int = 10, batch_rows: int = 3, pulled: list = None) -> pa.RecordBatchReader:
+    # Batches of batch_rows rows with a dictionary encoded label, pulled counts the batches read
+    schema = pa.schema([('id', pa.int64()), ('label', pa.dictionary(pa.int32(), pa.string()))])
+    def batches():
+        for start in range(0, rows, batch_rows):
+            if pulled is not None:
+                pulled.append(start)
+            ids = list(range(start, min(start + batch_rows, rows)))
+            yield pa.RecordBatch.from_arrays([pa.array(ids, pa.int64()), pa.array([f'l{i % 2}' for i in ids]).dictionary_encode()], schema=schema)
+    return pa.RecordBatchReader.from_batches(schema, batches())
+
+def test_batches_are_rechunked_to_the_given_rows():
+    stats = ExportStats()
+    batches = list(iter_batches(reader(), rows=4, stats=stats))
+
+    assert [i.num_rows for i in batches] == [4, 4, 2]
+    assert [v for i in batches for v in i.column('id').to_pylist()] == list(range(10))
+    assert (stats.rows, stats.batches) == (10, 3)
+
+def test_limit_stops_reading_the_result():
+    pulled = []
+    table = head(reader(pulled=pulled), 4)
+
+    assert table.column('id').to_pylist() == [0, 1, 2, 3]
+    assert len(pulled) == 2
+
+def test_batches_stay_about_max_bytes():
+    # The rows per batch are estimated from the bytes per row of the incoming batches
+    incoming = next(reader(rows=500, batch_rows=500))
+    size = int(1000 * incoming.num_rows / incoming.nbytes)
+    batches = list(iter_batches(reader(rows=1000, batch_rows=500), max_bytes=1000))
+
+    assert sum(i.num_rows for i in batches) == 1000
+    assert len(batches) > 2 and all(i.num_rows <= size for i in batches)
+
+@pytest.mark.parametrize('name', ['export.parquet', 'export.feather'])
+def test_written_file_has_every_row(tmp_path, name):
+    path = str(tmp_path / name)
+    stats = write_batches(reader(), path, rows=4)
+
+    table = pq.read_table(path) if name.endswith('.parquet') else pa.ipc.open_file(path).read_all()
+    assert table.column('id').to_pylist() == list(range(10))
+    assert table.column('label').to_pylist() == [f'l{i % 2}' for i in range(10)]
+    assert stats.rows == 10 and os.listdir(tmp_path) == [name]
+
+def test_unknown_format_writes_nothing(tmp_path):
+    with pytest.raises(ValueError):
+        write_batches(reader(), str(tmp_path / 'export.csv'))
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,65 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Draining the query histories of sessions of the local stand-in into historyModels.QueryLog, its bound and its version.
+
+import pytest
+
+from historyModels import QueryLog
+from localStarburst import LocalSession
+
+
+@pytest.fixture
+def base():
+    session = LocalSession()
+    yield session
+    session.close()
+
+def test_drain_moves_the_queries_of_every_history(base):
+    log, sessions = QueryLog(), [base.new_session() for _ in range(2)]
+    histories = [i.query_history() for i in sessions]
+    sessions[0].execute('select 1')
+    sessions[1].execute('select 2')
+
+    assert log.drain(histories) == 2
+    assert sorted(log.snapshot()[1]['sql_text']) == ['select 1', 'select 2']
+    # Copied queries are removed, the histories don't grow with the lifetime of the sessions
+    assert all(i.queries == [] for i in histories)
+    assert log.drain(histories) == 0
+
+def test_oldest_queries_are_dropped_above_max_entries(base):
+    log, history = QueryLog(max_entries=2), base.query_history()
+    for i in range(3):
+        base.execute(f'select {i}')
+    log.drain([history])
+
+    assert log.snapshot()[1]['sql_text'].tolist() == ['select 1', 'select 2']
+
+def test_since_returns_the_log_only_when_it_changed(base):
+    log, history = QueryLog(), base.query_history()
+    base.execute('select 1')
+    log.drain([history])
+
+    version, frame = log.since(0)
+    assert len(frame) == 1
+    assert log.since(version) == (version, None)
+    # The frame is shared until the next change
+    assert log.snapshot()[1] is frame
+
+    base.execute('select 2')
+    log.drain([history])
+    newer, frame = log.since(version)
+    assert newer > version and len(frame) == 2
@@ -0,0 +1,104 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Initialization of Data on the path the app takes, prefetch() and the first requests, against the local stand-in.
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+import env
+from dataModels import Data
+from localStarburst import LocalSession, load_customer_tables
+
+
+@pytest.fixture
+def base(monkeypatch):
+    monkeypatch.setattr(env, 'USE_AGG_CUBE', False)
+    session = LocalSession()
+    load_customer_tables(session, 2000)
+    yield session
+    session.close()
+
+@pytest.fixture
+def running(monkeypatch):
+    # Highest number of queries of the stand-in running at the same time
+    state = {'now': 0, 'max': 0}
+    lock = threading.Lock()
+    execute = LocalSession.execute
+    def record(self, query):
+        with lock:
+            state['now'] += 1
+            state['max'] = max(state['max'], state['now'])
+        try:
+            return execute(self, query)
+        finally:
+            with lock:
+                state['now'] -= 1
+    monkeypatch.setattr(LocalSession, 'execute', record)
+    return state
+
+def test_prefetch_queries_the_segments_and_the_default_aggregate_at_once(base, running):
+    base.latency = 0.2
+    data = Data(session_factory=lambda: base.new_session())
+    data.invalidate_cache()
+
+    data.prefetch().join(30)
+    assert data.initialized
+    assert running['max'] >= 2
+    # The first chart is answered from the cache
+    assert data.agg_cache.get(data.agg_cache_key(data.segments)) is not None
+    data.pool.close()
+
+def test_first_request_caches_the_default_aggregate(base):
+    data = Data(session_factory=lambda: base.new_session())
+    data.invalidate_cache()
+
+    segments = data.get_unique_segs()
+    result = data.agg_cache.get(data.agg_cache_key(segments))
+    assert result is not None and int(result['count'].sum()) == 2000
+    # Only the user asking for a chart gets a summary
+    assert data.summary is None
+    data.pool.close()
+
+def test_async_request_does_not_block_the_event_loop(base):
+    base.latency = 0.2
+    data = Data(session_factory=lambda: base.new_session())
+    data.invalidate_cache()
+
+    async def main():
+        # Longest time the loop didn't run another coroutine while the initialization and the query were waiting for the stand-in
+        request, gaps, last = asyncio.ensure_future(data.get_agg_data_async(['gold'])), [], time.monotonic()
+        while not request.done():
+            await asyncio.sleep(0.01)
+            gaps.append(time.monotonic() - last)
+            last = time.monotonic()
+        return await request, max(gaps)
+
+    result, gap = asyncio.run(main())
+    assert data.initialized and int(result['count'].sum()) > 0
+    assert gap < 0.15
+    data.pool.close()
+
+def test_prefetch_reports_a_failed_warm_up(capsys):
+    def unavailable():
+        raise ConnectionError('cluster unavailable')
+    data = Data(session_factory=unavailable)
+
+    data.prefetch().join(30)
+    assert 'Warming up the session pool failed: cluster unavailable' in capsys.readouterr().out
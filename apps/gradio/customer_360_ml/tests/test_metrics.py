@@ -0,0 +1,45 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Totals, cache hit ratio and Prometheus export of metricsModels.Metrics.
+
+from metricsModels import Metrics
+
+
+def samples(text: str) -> dict:
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+
+def test_counters_keep_counting_the_operations_dropped_from_the_ring_buffer():
+    metrics = Metrics(max_events=2)
+    for _ in range(5):
+        metrics.record('get_agg_data', 0.5, rows=10, queries=1)
+
+    exported = samples(metrics.to_prometheus())
+    assert len(metrics.events()) == 2
+    assert exported['customer360_operations_total{operation="get_agg_data",event=""}'] == '5'
+    assert exported['customer360_rows_total{operation="get_agg_data",event=""}'] == '50'
+    assert exported['customer360_wall_seconds_count{operation="get_agg_data",event=""}'] == '5'
+    assert float(exported['customer360_wall_seconds_sum{operation="get_agg_data",event=""}']) == 2.5
+
+def test_cube_and_snapshot_results_are_cache_hits():
+    metrics = Metrics()
+    for cache in ('hit', 'cube', 'snapshot', 'miss'):
+        metrics.record('get_agg_data', 0.1, cache=cache)
+
+    assert metrics.summary()['cache_hit_ratio'].tolist() == [0.75]
+    exported = samples(metrics.to_prometheus())
+    assert exported['customer360_cache_lookups_total{operation="get_agg_data",event="",cache="cube"}'] == '1'
+    assert exported['customer360_cache_lookups_total{operation="get_agg_data",event="",cache="miss"}'] == '1'
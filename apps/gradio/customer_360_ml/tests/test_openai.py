@@ -0,0 +1,47 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Streaming responses of mlModels.OpenAI against the fake chat completions server of benchmarks/fakeOpenAI.py.
+
+import time
+
+QUESTION = 'Which 5 states have the highest risk appetite? Why?'
+
+
+def test_streaming_yields_the_answer_as_it_arrives(fake_openai, openai_model):
+    server = fake_openai(first_token_latency=0.05, token_delay=0.02, tokens=30)
+    model = openai_model(server, stream=True, n=1)
+
+    start, first, answers = time.perf_counter(), None, []
+    for answer in model.predict(QUESTION):
+        first = first if first is not None else time.perf_counter() - start
+        answers.append(answer)
+    total = time.perf_counter() - start
+
+    # One partial answer per token, each extending the one before, the first long before the last token
+    assert len(answers) == 31
+    assert all(b.startswith(a) for a, b in zip(answers, answers[1:]))
+    assert answers[-1].endswith('\n\n') and len(answers[-1].split()) == 30
+    assert first < total - 0.3
+    assert (server.requests, server.completion_tokens) == (1, 30)
+    assert model.timings[-1]['chunks'] == 30 and model.timings[-1]['ttft_seconds'] < model.timings[-1]['total_seconds']
+
+def test_blocking_yields_the_whole_answer_once(fake_openai, openai_model):
+    server = fake_openai()
+    model = openai_model(server, stream=False, n=1)
+    answers = list(model.predict(QUESTION))
+    assert len(answers) == 1 and len(answers[0].split()) == 20
+    assert server.requests == 1
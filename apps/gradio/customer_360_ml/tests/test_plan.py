@@ -0,0 +1,95 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# The aggregation plan of dataModels.PlanTemplate and Data.summary_plan against the local stand-in.
+
+import pytest
+
+from dataModels import Data, PlanTemplate, SEGMENTS_PLACEHOLDER
+from localStarburst import LocalSession, load_customer_tables
+
+PLACEHOLDER = f"'{SEGMENTS_PLACEHOLDER}'"
+
+
+@pytest.fixture
+def base():
+    session = LocalSession()
+    load_customer_tables(session, 500)
+    yield session
+    session.close()
+
+@pytest.fixture
+def data(base):
+    data = Data(session_factory=base.new_session)
+    data.get_initial_data(do_agg=False)
+    yield data
+    data.pool.close()
+
+def rows(data, df) -> list:
+    return sorted(data.to_pandas(df).itertuples(index=False, name=None))
+
+def test_bound_plan_returns_the_aggregate_of_the_selection(data):
+    with data.checkout() as session:
+        expected = data._build_summary_plan(['gold', 'silver'], session)
+
+    assert rows(data, data.summary_plan(['gold', 'silver'])) == rows(data, expected)
+    assert data.summary_template is not None
+
+def test_bind_escapes_quotes(data):
+    df = data.summary_plan(["o'brien"])
+
+    assert "IN ('o''brien')" in df.queries['queries'][-1]
+    assert rows(data, df) == []
+
+def test_bind_of_no_segments_matches_nothing(data):
+    df = data.summary_plan([])
+
+    assert 'IN (NULL)' in df.queries['queries'][-1]
+    assert rows(data, df) == []
+
+@pytest.mark.parametrize('where', [f'customer_segment = {PLACEHOLDER}', f"customer_segment IN ({PLACEHOLDER}, 'gold')",
+                                   f'customer_segment IN ({PLACEHOLDER}) OR state = {PLACEHOLDER}'])
+def test_template_needs_the_placeholder_as_the_only_value_of_one_in_list(base, where):
+    with pytest.raises(ValueError):
+        PlanTemplate(base.sql(f'SELECT * FROM sample.burstbank.customer_profile WHERE {where}'), SEGMENTS_PLACEHOLDER)
+
+def test_plan_without_an_in_list_is_built_for_every_selection(monkeypatch, data):
+    build = Data._build_summary_plan
+    def without_in_list(self, segments, session):
+        # e.g. a single segment compared with =
+        if segments == [SEGMENTS_PLACEHOLDER]:
+            return session.sql(f'SELECT * FROM sample.burstbank.customer_profile WHERE customer_segment = {PLACEHOLDER}')
+        return build(self, segments, session)
+    monkeypatch.setattr(Data, '_build_summary_plan', without_in_list)
+
+    df = data.summary_plan(['gold'])
+    assert data.summary_template is None
+    with data.checkout() as session:
+        assert rows(data, df) == rows(data, build(data, ['gold'], session))
+
+def test_plan_is_not_resolved_on_the_session_of_df_slim(monkeypatch, base, data):
+    # df_slim was built on a session another thread may have checked out meanwhile
+    other = base.new_session()
+    data.df_slim = type(data.df_slim)(other, data.df_slim._plan)
+    resolved = []
+    resolve = LocalSession.resolve
+    def record(self, query):
+        resolved.append(self)
+        return resolve(self, query)
+    monkeypatch.setattr(LocalSession, 'resolve', record)
+
+    data.summary_plan(['gold'])
+    assert resolved and other not in resolved
@@ -0,0 +1,47 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Plot payloads and digests of plotModels for aggregated results.
+
+import pandas as pd
+
+from plotModels import plot_data, plot_digest
+
+SUMMARY = pd.DataFrame({'state': ['NY', 'CA', 'CA', 'NY'], 'risk_appetite': ['low', 'high', 'low', 'high'], 'count': [4, 3, 2, 1]})
+
+
+def test_payload_rows_are_sorted_by_x_and_color():
+    payload = plot_data(SUMMARY, 'state', 'count', color='risk_appetite')
+
+    assert payload['columns'] == ['state', 'risk_appetite', 'count']
+    assert payload['data'] == [['CA', 'high', 3], ['CA', 'low', 2], ['NY', 'high', 1], ['NY', 'low', 4]]
+    assert payload['datatypes'] == {'state': 'nominal', 'risk_appetite': 'nominal', 'count': 'quantitative'}
+    assert all(type(row[-1]) is int for row in payload['data'])
+
+def test_digest_is_equal_for_the_same_data_in_any_order():
+    shuffled = SUMMARY.sample(frac=1, random_state=1).reset_index(drop=True)
+    digest = plot_digest(plot_data(SUMMARY, 'state', 'count', color='risk_appetite'))
+
+    assert plot_digest(plot_data(shuffled, 'state', 'count', color='risk_appetite')) == digest
+    assert plot_digest(plot_data(SUMMARY.assign(count=[4, 3, 2, 0]), 'state', 'count', color='risk_appetite')) != digest
+
+def test_categorical_labels_match_the_strings_and_keep_missing_ones():
+    categorical = SUMMARY.astype({'state': 'category', 'risk_appetite': 'category'})
+    assert plot_data(categorical, 'state', 'count', color='risk_appetite') == plot_data(SUMMARY, 'state', 'count', color='risk_appetite')
+
+    missing = categorical.copy()
+    missing.loc[0, 'state'] = None
+    assert [None, 'low', 4] in plot_data(missing, 'state', 'count', color='risk_appetite')['data']
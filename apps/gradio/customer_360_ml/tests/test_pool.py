@@ -0,0 +1,123 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Checkout, checkin, eviction and the counters of poolModels.SessionPool on sessions of the local stand-in.
+
+import time
+
+import pytest
+
+from poolModels import SessionPool
+from localStarburst import LocalSession
+
+
+@pytest.fixture
+def base():
+    session = LocalSession()
+    yield session
+    session.close()
+
+def test_checkout_reuses_the_session_checked_in(base):
+    pool = SessionPool(base.new_session, min_size=1, max_size=2)
+    with pool.session() as first:
+        assert pool.stats()['in_use'] == 1
+    with pool.session() as second:
+        pass
+
+    assert second is first
+    stats = pool.stats()
+    assert (stats['created'], stats['checkouts'], stats['in_use'], stats['idle']) == (1, 2, 0, 1)
+    pool.close()
+
+def test_concurrent_checkouts_get_their_own_session(base):
+    pool = SessionPool(base.new_session, min_size=1, max_size=2)
+    with pool.session() as first, pool.session() as second:
+        assert first is not second
+        assert pool.stats()['in_use'] == 2
+    assert pool.stats()['idle'] == 2
+    pool.close()
+
+def test_checkout_times_out_when_all_sessions_are_in_use(base):
+    pool = SessionPool(base.new_session, min_size=1, max_size=1, checkout_timeout=0.05)
+    with pool.session():
+        with pytest.raises(TimeoutError):
+            pool.checkout()
+    assert pool.stats()['waits'] == 0
+    pool.close()
+
+def test_failed_query_checks_in_a_suspect_session(base):
+    pool = SessionPool(base.new_session, min_size=1, max_size=1, health_check_interval=60)
+    with pytest.raises(ValueError):
+        with pool.session():
+            raise ValueError('query failed')
+
+    # Checked with a cheap query before it is used again
+    with pool.session():
+        pass
+    stats = pool.stats()
+    assert (stats['in_use'], stats['health_checks'], stats['health_check_failures']) == (0, 1, 0)
+    pool.close()
+
+def test_generator_closed_early_checks_in_its_session(base):
+    pool = SessionPool(base.new_session, min_size=1, max_size=2, checkout_timeout=0.5)
+
+    def rows():
+        with pool.session() as session:
+            yield from range(10)
+
+    # Every abandoned generator gets GeneratorExit at its yield, its session must not leak
+    for _ in range(3):
+        stream = rows()
+        next(stream)
+        stream.close()
+    assert pool.stats()['in_use'] == 0
+
+    with pool.session(), pool.session():
+        pass
+    pool.close()
+
+def test_idle_sessions_above_the_minimum_are_evicted(base):
+    pool = SessionPool(base.new_session, min_size=1, max_size=3, idle_timeout=0.05)
+    sessions = [pool.checkout() for _ in range(3)]
+    for i in sessions:
+        pool.checkin(i)
+    assert pool.stats()['idle'] == 3
+
+    time.sleep(0.1)
+    pool.evict_idle()
+    stats = pool.stats()
+    assert (stats['idle'], stats['closed']) == (1, 2)
+    pool.close()
+
+def test_checkout_closes_the_sessions_that_went_idle(base):
+    pool = SessionPool(base.new_session, min_size=1, max_size=3, idle_timeout=0.05)
+    sessions = [pool.checkout() for _ in range(3)]
+    for i in sessions:
+        pool.checkin(i)
+
+    time.sleep(0.1)
+    with pool.session():
+        stats = pool.stats()
+    assert (stats['in_use'], stats['idle'], stats['closed']) == (1, 0, 2)
+    pool.close()
+
+def test_warm_up_creates_the_minimum(base):
+    pool = SessionPool(base.new_session, min_size=2, max_size=4)
+    pool.warm_up()
+    stats = pool.stats()
+    assert (stats['created'], stats['idle']) == (2, 2)
+    assert stats['checkout_p50_ms'] == 0.0
+    pool.close()
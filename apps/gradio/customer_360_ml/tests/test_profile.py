@@ -0,0 +1,73 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Column profiles of Data.profile, built by profileModels in one query, against the local stand-in.
+
+import pandas as pd
+import pytest
+
+from dataModels import Data
+from localStarburst import LocalSession
+
+TABLE = 'local.demo.accounts'
+
+
+@pytest.fixture
+def base():
+    session = LocalSession()
+    session.load_table(TABLE, pd.DataFrame({'state': ['CA', 'NY', None, 'CA'], 'balance': [10.0, 20.0, 30.0, None]}))
+    yield session
+    session.close()
+
+@pytest.fixture
+def data(base):
+    data = Data(session_factory=base.new_session)
+    data.profile_cache.invalidate()
+    yield data
+    data.pool.close()
+
+@pytest.fixture
+def queries(monkeypatch):
+    # SQL run by every session of the stand-in
+    run = []
+    execute = LocalSession.execute
+    def record(self, query):
+        run.append(query)
+        return execute(self, query)
+    monkeypatch.setattr(LocalSession, 'execute', record)
+    return run
+
+def test_profile_has_the_statistics_of_every_column(data, queries):
+    profile = data.profile(TABLE).set_index('column')
+
+    assert profile.loc['state', ['count', 'nulls', 'min', 'max', 'approx_distinct']].tolist() == [3, 1, 'CA', 'NY', 2]
+    assert profile.loc['balance', ['count', 'nulls', 'mean', 'p50']].tolist() == [3, 1, 20.0, 20.0]
+    assert pd.isna(profile.loc['state', 'mean'])
+    # One scan for all statistics
+    assert len([i for i in queries if 'approx_distinct' in i]) == 1
+
+def test_profile_of_the_given_columns_in_their_order(data):
+    assert data.profile(TABLE, columns=['balance', 'state'])['column'].tolist() == ['balance', 'state']
+
+def test_profile_is_reused_until_it_expires(data, queries):
+    data.profile(TABLE)
+    data.profile(TABLE)
+    assert len([i for i in queries if 'approx_distinct' in i]) == 1
+
+@pytest.mark.parametrize('columns, sample', [(['unknown'], None), (None, 0), (None, 1.5)])
+def test_unknown_columns_and_invalid_samples_are_rejected(data, columns, sample):
+    with pytest.raises(ValueError):
+        data.profile(TABLE, columns=columns, sample=sample)
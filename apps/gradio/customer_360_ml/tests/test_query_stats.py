@@ -0,0 +1,53 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Query statistics of Data.query_stats from the Trino cursor of the local stand-in, and without one.
+
+import pandas as pd
+import pytest
+
+from dataModels import Data
+from localStarburst import LocalSession
+
+TABLE = 'local.demo.customers'
+
+
+@pytest.fixture
+def base():
+    session = LocalSession()
+    session.load_table(TABLE, pd.DataFrame({'state': ['CA', 'NY', 'TX'], 'count': [1, 2, 3]}))
+    yield session
+    session.close()
+
+@pytest.fixture
+def data(base):
+    data = Data(session_factory=base.new_session)
+    yield data
+    data.pool.close()
+
+def test_stats_of_the_trino_cursor(base, data):
+    stats = data.query_stats(base.table(TABLE))
+
+    assert stats['rows'] == 3 and stats['processedRows'] == 3
+    assert stats['physicalInputBytes'] > 0
+
+def test_session_without_a_trino_connection_reports_the_rows(monkeypatch, base, data):
+    # e.g. another pystarburst version keeping its DB-API connection elsewhere
+    monkeypatch.setattr(LocalSession, '_conn', property(lambda self: object()))
+    stats = data.query_stats(base.table(TABLE))
+
+    assert stats['rows'] == 3 and 'physicalInputBytes' not in stats
+    assert stats['wall_seconds'] >= 0
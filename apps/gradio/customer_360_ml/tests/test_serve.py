@@ -0,0 +1,58 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Worker selection of the serve.Balancer in front of the app workers.
+
+import env
+import serve
+from serve import Balancer, COOKIE
+
+HEAD = b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+
+def with_cookie(worker: int) -> bytes:
+    return f'GET / HTTP/1.1\r\nHost: localhost\r\nCookie: {COOKIE}={worker}\r\n\r\n'.encode()
+
+def test_browser_with_the_cookie_stays_on_its_worker():
+    balancer = Balancer([8001, 8002, 8003])
+    assert balancer.pick(with_cookie(2), '10.0.0.1') == (2, False)
+
+def test_new_browsers_go_to_the_least_busy_worker():
+    balancer = Balancer([8001, 8002, 8003])
+    balancer.active = [2, 0, 1]
+    assert balancer.pick(HEAD, '10.0.0.1') == (1, True)
+
+def test_first_connections_without_the_cookie_go_to_the_worker_of_the_address():
+    balancer = Balancer([8001, 8002, 8003])
+    worker, _ = balancer.pick(HEAD, '10.0.0.1')
+    # Parallel connections of the same browser, the first one keeps its worker busy
+    balancer.active[worker] += 1
+    assert {balancer.pick(HEAD, '10.0.0.1') for _ in range(3)} == {(worker, True)}
+    assert balancer.pick(HEAD, '10.0.0.2')[0] != worker
+
+def test_address_is_forgotten_after_the_client_ttl(monkeypatch):
+    balancer = Balancer([8001, 8002])
+    worker, _ = balancer.pick(HEAD, '10.0.0.1')
+    balancer.active[worker] += 1
+    monkeypatch.setattr(env, 'BALANCER_CLIENT_TTL', 0)
+    assert balancer.pick(HEAD, '10.0.0.1')[0] != worker
+
+def test_addresses_are_bounded(monkeypatch):
+    monkeypatch.setattr(serve, 'MAX_CLIENTS', 2)
+    balancer = Balancer([8001, 8002])
+    for i in range(5):
+        balancer.pick(HEAD, f'10.0.0.{i}')
+    assert list(balancer.clients) == ['10.0.0.3', '10.0.0.4']
@@ -0,0 +1,53 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Users switching their Starburst settings, the pools keep the properties they were created with.
+
+import pytest
+
+import dataModels
+from dataModels import Data
+
+
+@pytest.fixture
+def created(monkeypatch):
+    hosts = list()
+    monkeypatch.setattr(dataModels, 'create_session', lambda properties: hosts.append(properties['host']))
+    monkeypatch.setattr(Data, 'prefetch', lambda self: None)
+    return hosts
+
+def test_pool_keeps_the_host_it_was_created_for(created):
+    base = Data()
+    first, second = base.for_user(), base.for_user()
+
+    first.save_settings('h2.example.com', 'first')
+    second.save_settings('h2.example.com', 'second')
+    first.save_settings('h3.example.com', 'first')
+
+    assert second.pool is not first.pool
+    second.pool.factory()
+    first.pool.factory()
+    assert created == ['h2.example.com', 'h3.example.com']
+
+def test_same_properties_share_a_pool(created):
+    base = Data()
+    first, second = base.for_user(), base.for_user()
+
+    first.save_settings('h2.example.com', 'first')
+    second.save_settings('h2.example.com', 'second')
+
+    assert second.pool is first.pool
+    assert base.session_properties['host'] != 'h2.example.com'
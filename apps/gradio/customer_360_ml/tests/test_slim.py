@@ -0,0 +1,50 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# The materialized slim table of Data, env.SLIM_TABLE, against the local stand-in.
+
+import pytest
+
+import env
+from dataModels import Data
+from localStarburst import LocalSession, load_customer_tables
+
+SLIM_TABLE = 'local.pystarburst_360_sum.customer_slim'
+
+
+@pytest.fixture
+def base(monkeypatch):
+    monkeypatch.setattr(env, 'SLIM_TABLE', SLIM_TABLE)
+    # The background refresh never runs during a test
+    monkeypatch.setattr(env, 'SLIM_REFRESH_SECONDS', 3600)
+    session = LocalSession()
+    load_customer_tables(session, 2000)
+    yield session
+    session.close()
+
+def test_initialization_with_a_single_session_refreshes_the_slim_table(monkeypatch, base):
+    monkeypatch.setattr(env, 'POOL_MIN_SIZE', 1)
+    monkeypatch.setattr(env, 'POOL_MAX_SIZE', 1)
+    data = Data(session_factory=lambda: base.new_session())
+    data.pool.checkout_timeout = 1
+    data.invalidate_cache()
+
+    # The refresh runs on the session the initialization holds instead of waiting for a second one
+    data.get_initial_data(do_agg=False)
+    assert data.slim_refreshed is not None
+    assert data.pool.stats()['created'] == 1
+    assert int(data.get_agg_data(data.segments)['count'].sum()) == 2000
+    data.pool.close()
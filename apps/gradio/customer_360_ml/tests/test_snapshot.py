@@ -0,0 +1,114 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Disk snapshots of Data against the local stand-in: restored on start, never served once the data is initialized.
+
+import asyncio
+
+import pytest
+
+import env
+from dataModels import Data
+from localStarburst import LocalSession, load_customer_tables, quote
+
+SEGMENTS = ['gold']
+
+
+@pytest.fixture
+def base(monkeypatch, tmp_path):
+    monkeypatch.setattr(env, 'SNAPSHOT_DIR', str(tmp_path))
+    # Selections are queried instead of sliced from the cube
+    monkeypatch.setattr(env, 'USE_AGG_CUBE', False)
+    session = LocalSession()
+    load_customer_tables(session, 2000)
+    yield session
+    session.close()
+
+def new_data(base) -> Data:
+    # Pools and shared data are keyed by the session factory, a new factory object gets a new pool and new shared data like a restarted
+    # process. base.new_session would not, bound methods of the same object are equal
+    return Data(session_factory=lambda: base.new_session())
+
+def gold_count(result) -> int:
+    return int(result['count'].sum())
+
+def demote_gold(base):
+    base.execute(f"UPDATE {quote('sample.burstbank.customer_profile')} SET customer_segment = 'silver' WHERE customer_segment = 'gold'")
+
+def test_expired_result_is_queried_again_after_initialization(base):
+    data = new_data(base)
+    data.invalidate_cache()
+    data.get_initial_data(do_agg=False)
+    assert gold_count(data.get_agg_data(SEGMENTS)) > 0
+    assert data.snapshots.load(data.agg_cache_key(SEGMENTS))[0] is not None
+
+    demote_gold(base)
+    # Like an expired AGG_CACHE_TTL, the snapshot on disk is still valid
+    data.agg_cache.invalidate()
+    assert gold_count(data.get_agg_data(SEGMENTS)) == 0
+    data.pool.close()
+
+def test_restart_serves_the_snapshot_until_initialized(base):
+    data = new_data(base)
+    data.invalidate_cache()
+    data.get_initial_data(do_agg=False)
+    expected = gold_count(data.get_agg_data(SEGMENTS))
+    data.pool.close()
+
+    data.agg_cache.invalidate()
+    restarted = new_data(base)
+    assert restarted.restored and not restarted.initialized
+    assert restarted.segments == data.segments
+    assert gold_count(restarted._cached_agg_data(SEGMENTS)) == expected
+
+    demote_gold(base)
+    restarted.get_initial_data(do_agg=False)
+    assert not restarted.restored
+    # The snapshots of the last run were dropped with the cached results, the fresh segments replace them. Revalidating the served
+    # snapshot in the background may have written a fresh one meanwhile
+    snapshot = restarted.snapshots.load(restarted.agg_cache_key(SEGMENTS))[0]
+    assert snapshot is None or gold_count(snapshot) == 0
+    assert restarted.snapshots.load(restarted.snapshot_key('segments'))[0] is not None
+    assert gold_count(restarted.get_agg_data(SEGMENTS)) == 0
+    restarted.pool.close()
+
+def test_async_request_after_a_restart_serves_the_snapshot(base):
+    data = new_data(base)
+    data.invalidate_cache()
+    data.get_initial_data(do_agg=False)
+    expected = gold_count(data.get_agg_data(SEGMENTS))
+    data.pool.close()
+
+    data.agg_cache.invalidate()
+    restarted = new_data(base)
+    demote_gold(base)
+    # Served from disk, not from a query of the demoted customers
+    assert gold_count(asyncio.run(restarted.get_agg_data_async(SEGMENTS))) == expected
+    restarted.pool.close()
+
+def test_invalidate_cache_clears_the_snapshots_of_its_connection(base):
+    data = new_data(base)
+    data.get_initial_data(do_agg=False)
+    result = data.get_agg_data(SEGMENTS)
+    other = ('other-host',) + data.source_tables + (tuple(SEGMENTS),)
+    data.snapshots.save(other, result)
+
+    data.invalidate_cache()
+    assert data.snapshots.load(data.agg_cache_key(SEGMENTS))[0] is None
+    # Other connections keep their warm start, the segments of this one are replaced by the next initialization
+    assert data.snapshots.load(other)[0] is not None
+    assert data.snapshots.load(data.snapshot_key('segments'))[0] is not None
+    data.pool.close()
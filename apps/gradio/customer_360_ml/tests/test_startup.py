@@ -0,0 +1,34 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# The app starts serving the UI before the data is loaded, so the SDKs that take seconds to import must stay off the startup path.
+
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.mark.parametrize('module', ['app', 'dataModels', 'mlModels'])
+def test_import_leaves_pystarburst_and_openai_unloaded(module):
+    # A new process, the tests before may have imported them already
+    code = f"import sys, json; import {module}; print(json.dumps([i for i in ('pystarburst', 'openai') if i in sys.modules]))"
+    proc = subprocess.run([sys.executable, '-c', code], cwd=APP_DIR, capture_output=True, text=True, timeout=300)
+    assert proc.returncode == 0, proc.stderr
+    assert json.loads(proc.stdout.splitlines()[-1]) == []
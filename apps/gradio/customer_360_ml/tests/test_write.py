@@ -0,0 +1,155 @@
+'''
+Copyright 2024 Starburst Data
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+# Summary writes of Data.write_agg_data with every env.WRITE_MODE against the local stand-in.
+
+import pytest
+
+import env
+from dataModels import Data
+from localStarburst import LocalSession, load_customer_tables, quote
+
+SEGMENTS = ['gold', 'silver']
+SEGMENT_KEY = 'gold,silver'
+
+
+@pytest.fixture
+def base():
+    session = LocalSession()
+    load_customer_tables(session, 2000)
+    yield session
+    session.close()
+
+@pytest.fixture
+def data(base):
+    # Pools and shared data are keyed by the session factory, a bound method of the stand-in of this test, so every test gets its own.
+    # The result cache is process-wide
+    data = Data(session_factory=base.new_session)
+    data.invalidate_cache()
+    data.get_initial_data(do_agg=False)
+    yield data
+    data.pool.close()
+
+@pytest.fixture
+def queries(monkeypatch):
+    # SQL run by every session of the stand-in
+    run = []
+    execute = LocalSession.execute
+    def record(self, query):
+        run.append(query)
+        return execute(self, query)
+    monkeypatch.setattr(LocalSession, 'execute', record)
+    return run
+
+def target_rows(base, data, segment_key = SEGMENT_KEY) -> dict:
+    rows = base.connection.execute(f'SELECT state, risk_appetite, count FROM {quote(data.target_table)} WHERE segments = ?', (segment_key,))
+    return {(state, risk): count for state, risk, count in rows}
+
+def summary_rows(result) -> dict:
+    return {(state, risk): count for state, risk, count in result[['state', 'risk_appetite', 'count']].itertuples(index=False)}
+
+def move_customers(base):
+    base.execute(f"UPDATE {quote('sample.burstbank.customer')} SET state = 'CA' WHERE custkey % 40 = 0")
+
+@pytest.mark.parametrize('mode', ['replace', 'swap', 'merge'])
+def test_write_stores_the_summary(monkeypatch, base, data, mode):
+    monkeypatch.setattr(env, 'WRITE_MODE', mode)
+    summary = data.get_agg_data(SEGMENTS)
+    written = data.write_agg_data()
+
+    assert target_rows(base, data) == summary_rows(summary)
+    assert summary_rows(written) == summary_rows(summary)
+    assert data.last_write['skipped'] is False
+    assert data.last_write['rows_written'] == len(summary)
+
+@pytest.mark.parametrize('mode', ['replace', 'swap', 'merge'])
+def test_write_after_the_source_changed_stores_the_new_summary(monkeypatch, base, data, mode):
+    monkeypatch.setattr(env, 'WRITE_MODE', mode)
+    data.get_agg_data(SEGMENTS)
+    data.write_agg_data()
+    move_customers(base)
+    data.invalidate_cache()
+
+    summary = data.get_agg_data(SEGMENTS)
+    data.write_agg_data()
+    assert target_rows(base, data) == summary_rows(summary)
+
+@pytest.mark.parametrize('mode', ['replace', 'swap', 'merge'])
+def test_unchanged_summary_runs_no_other_query(monkeypatch, base, data, queries, mode):
+    monkeypatch.setattr(env, 'WRITE_MODE', mode)
+    data.get_agg_data(SEGMENTS)
+    data.write_agg_data()
+
+    queries.clear()
+    data.write_agg_data()
+    assert data.last_write == {'mode': mode, 'skipped': True, 'rows_written': 0, 'rows_deleted': 0}
+    # Only the summary is read, no DDL and no lookup of the target
+    assert len(queries) == 1 and queries[0].lstrip().upper().startswith('SELECT')
+
+def test_merge_rewrites_only_the_changed_rows(monkeypatch, base, data):
+    monkeypatch.setattr(env, 'WRITE_MODE', 'merge')
+    before = summary_rows(data.get_agg_data(SEGMENTS))
+    data.write_agg_data()
+    move_customers(base)
+    data.invalidate_cache()
+
+    after = summary_rows(data.get_agg_data(SEGMENTS))
+    data.write_agg_data()
+    changed = {k for k in before.keys() | after.keys() if before.get(k) != after.get(k)}
+    assert 0 < len(changed) < len(after)
+    assert data.last_write['rows_written'] == len([k for k in changed if k in after])
+    assert data.last_write['rows_deleted'] == len([k for k in changed if k in before])
+
+def test_swap_replaces_the_target_in_one_statement(monkeypatch, base, data, queries):
+    monkeypatch.setattr(env, 'WRITE_MODE', 'swap')
+    data.get_agg_data(SEGMENTS)
+    data.write_agg_data()
+    move_customers(base)
+    data.invalidate_cache()
+    data.get_agg_data(SEGMENTS)
+
+    queries.clear()
+    data.write_agg_data()
+    writes = [i for i in queries if not i.lstrip().upper().startswith(('SELECT', 'PRAGMA'))]
+    # No rename or drop leaves readers without a table
+    assert len(writes) == 1 and writes[0].upper().startswith('CREATE OR REPLACE TABLE')
+
+@pytest.mark.parametrize('mode', ['replace', 'swap'])
+def test_write_after_another_selection_replaced_the_target(monkeypatch, base, data, mode):
+    monkeypatch.setattr(env, 'WRITE_MODE', mode)
+    gold = data.get_agg_data(['gold'])
+    data.write_agg_data()
+    data.get_agg_data(['silver'])
+    data.write_agg_data()
+
+    # The silver write replaced the table, the unchanged gold summary is written again
+    data.get_agg_data(['gold'])
+    data.write_agg_data()
+    assert data.last_write['skipped'] is False
+    assert target_rows(base, data, 'gold') == summary_rows(gold)
+    assert target_rows(base, data, 'silver') == {}
+
+def test_unchanged_summary_written_by_another_worker_is_skipped(monkeypatch, tmp_path, base):
+    # Each worker has its own shared data, only the cache directory is the same
+    monkeypatch.setattr(env, 'SHARED_CACHE_DIR', str(tmp_path))
+    workers = [Data(session_factory=lambda: base.new_session()) for _ in range(2)]
+    for data in workers:
+        data.get_agg_data(SEGMENTS)
+        data.write_agg_data()
+
+    assert [data.last_write['skipped'] for data in workers] == [False, True]
+    for data in workers:
+        data.pool.close()